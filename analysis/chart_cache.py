@@ -0,0 +1,171 @@
+# analysis/chart_cache.py
+# ───────────────────────────────────────────────────────────
+# Кэш готовых PNG. Ключ — (uid, вид графика, аргументы, версия данных), где
+# версия — storage.data_version(): она меняется только при новой записи
+# чек-ина или сна, так что листание страниц туда-обратно и повторный выбор
+# параметра отдают уже нарисованную картинку. В памяти — LRU с лимитом по
+# числу и размеру, на диске — data/<uid>/.cache/charts/<версия>_<хэш>.png;
+# картинки прошлых версий удаляются при первой записи новой.
+# Там же (file_ids.json) помним file_id уже отправленных в Telegram картинок:
+# их можно переслать без повторной загрузки, пока версия данных та же.
+import hashlib, json, os, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from utils import storage
+
+MEM_ITEMS = 256                   # картинок в памяти
+MEM_BYTES = 32 * 1024 * 1024      # и не больше стольких байт
+DISK_BYTES = 16 * 1024 * 1024     # на диске на одного пользователя
+
+Key = Tuple[int, str, tuple, str]
+
+_mem: "OrderedDict[Key, bytes]" = OrderedDict()
+_mem_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "file_id_hits": 0}
+_file_ids: Dict[int, Tuple[str, Dict[str, str]]] = {}   # uid → (версия, хэш → file_id)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def key(uid: int, kind: str, args: tuple) -> Key:
+    """Cache key of a chart of the user's current data."""
+    return uid, kind, _freeze(args), storage.data_version(uid)
+
+
+def _charts_dir(uid: int) -> Path:
+    return storage.user_dir(uid) / ".cache" / "charts"
+
+
+def _digest(k: Key) -> str:
+    _, kind, args, _ = k
+    return hashlib.sha1(repr((kind, args)).encode()).hexdigest()[:20]
+
+
+def _disk_path(k: Key) -> Path:
+    return _charts_dir(k[0]) / f"{k[3]}_{_digest(k)}.png"
+
+
+def _remember(k: Key, data: bytes) -> None:
+    global _mem_bytes
+    with _lock:
+        old = _mem.pop(k, None)
+        if old is not None:
+            _mem_bytes -= len(old)
+        _mem[k] = data
+        _mem_bytes += len(data)
+        while _mem and (len(_mem) > MEM_ITEMS or _mem_bytes > MEM_BYTES):
+            _, dropped = _mem.popitem(last=False)
+            _mem_bytes -= len(dropped)
+            _stats["evictions"] += 1
+
+
+def get(k: Key) -> Optional[bytes]:
+    with _lock:
+        data = _mem.get(k)
+        if data is not None:
+            _mem.move_to_end(k)
+            _stats["hits"] += 1
+            return data
+    try:
+        data = _disk_path(k).read_bytes()
+    except OSError:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["disk_hits"] += 1
+    _remember(k, data)
+    return data
+
+
+def _prune(folder: Path, version: str) -> None:
+    """Удаляет картинки прошлых версий и самые старые сверх DISK_BYTES."""
+    files = []
+    for e in os.scandir(folder):
+        if not e.name.endswith(".png"):
+            continue
+        if not e.name.startswith(version + "_"):
+            os.unlink(e.path)
+            continue
+        st = e.stat()
+        files.append((st.st_mtime_ns, st.st_size, e.path))
+    total = sum(f[1] for f in files)
+    for _, size, path in sorted(files):
+        if total <= DISK_BYTES:
+            break
+        os.unlink(path)
+        total -= size
+
+
+def put(k: Key, data: bytes) -> None:
+    _remember(k, data)
+    fp = _disk_path(k)
+    try:
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fp.with_name(f".{fp.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, fp)
+        _prune(fp.parent, k[3])
+    except OSError:
+        pass                          # диск — лишь второй уровень кэша
+
+
+# ─────────────── file_id в Telegram ────────────────────────
+def _ids_path(uid: int) -> Path:
+    return _charts_dir(uid) / "file_ids.json"
+
+
+def _ids(uid: int, version: str) -> Dict[str, str]:
+    """file_id картинок версии version (старые версии забываются). Под _lock."""
+    entry = _file_ids.get(uid)
+    if entry is None:
+        try:
+            raw = json.loads(_ids_path(uid).read_text(encoding="utf-8"))
+            entry = raw["version"], dict(raw["ids"])
+        except (OSError, ValueError, KeyError, TypeError):
+            entry = "", {}
+    if entry[0] != version:
+        entry = version, {}
+    _file_ids[uid] = entry
+    return entry[1]
+
+
+def file_id(k: Key) -> Optional[str]:
+    """Telegram file_id of an already sent chart with this key, if any."""
+    with _lock:
+        fid = _ids(k[0], k[3]).get(_digest(k))
+        if fid:
+            _stats["file_id_hits"] += 1
+        return fid
+
+
+def remember_file_id(k: Key, fid: Optional[str]) -> None:
+    """Store (or forget, with fid=None) the file_id of a sent chart."""
+    uid, version = k[0], k[3]
+    with _lock:
+        ids = _ids(uid, version)
+        if fid:
+            ids[_digest(k)] = fid
+        else:
+            ids.pop(_digest(k), None)
+        text = json.dumps({"version": version, "ids": ids})
+    fp = _ids_path(uid)
+    try:
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fp.with_name(f".{fp.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, fp)
+    except OSError:
+        pass
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats, size=len(_mem), bytes=_mem_bytes)
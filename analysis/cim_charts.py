@@ -0,0 +1,78 @@
+# analysis/cim_charts.py
+# ───────────────────────────────────────────────────────────
+# Графики CIM поверх плотной матрицы emotions.matrix(): тепловая карта
+# эмоций во времени и самые частые пары эмоций в одних и тех же днях.
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from analysis import emotions
+from analysis.generate_plot import _png, _window
+from config import CIM_EMOTIONS
+
+HEATMAP_MAX_COLUMNS = 120           # дольше — усредняем по неделям
+
+
+def _period(uid: int, period: str, page: int) -> emotions.EmotionDays:
+    m = emotions.matrix(uid)
+    if m.empty:
+        return m
+    win = _window(period, page, m.days[-1]) if period != "all" else None
+    return m.slice(*win) if win else m
+
+
+def render_heatmap(uid: int, period: str, page: int = 0) -> Optional[bytes]:
+    """PNG heatmap of emotion intensities by day (or week) for a page of period."""
+    m = _period(uid, period, page)
+    present = m.present()
+    if m.empty or not len(present):
+        return None
+    df = pd.DataFrame(m.values[:, present], index=m.days,
+                      columns=[CIM_EMOTIONS[j] for j in present])
+    df = df.reindex(pd.date_range(m.days[0], m.days[-1], freq="D"), fill_value=0)
+    if len(df) > HEATMAP_MAX_COLUMNS:
+        df = df.resample("W-MON", label="left", closed="left").mean()
+
+    fig = Figure(figsize=(8, max(3, 0.25 * len(present) + 1.5)))
+    ax = fig.subplots()
+    img = ax.imshow(df.to_numpy().T, aspect="auto", cmap="viridis", interpolation="nearest")
+    ax.set_yticks(range(len(df.columns)))
+    ax.set_yticklabels(df.columns, fontsize=8)
+    step = max(1, len(df) // 8)
+    ax.set_xticks(range(0, len(df), step))
+    ax.set_xticklabels([d.strftime("%d.%m.%y") for d in df.index[::step]],
+                       rotation=45, ha="right", fontsize=8)
+    ax.set_title(f"Эмоции снов ({period})")
+    fig.colorbar(img, ax=ax, label="интенсивность")
+    fig.tight_layout()
+    return _png(fig)
+
+
+def render_pairs(uid: int, period: str, page: int = 0, k: int = 10) -> Optional[bytes]:
+    """PNG bar chart of the k emotion pairs that most often share a day."""
+    m = _period(uid, period, page)
+    if m.empty:
+        return None
+    pairs = m.top_pairs(k)
+    if not pairs:
+        return None
+    corr = m.correlation()
+    labels = [f"{a} + {b}" for a, b, _ in pairs][::-1]
+    counts = [n for _, _, n in pairs][::-1]
+    r = [corr[CIM_EMOTIONS.index(a), CIM_EMOTIONS.index(b)] for a, b, _ in pairs][::-1]
+
+    fig = Figure(figsize=(8, 0.35 * len(pairs) + 1.5))
+    ax = fig.subplots()
+    bars = ax.barh(range(len(pairs)), counts)
+    ax.set_yticks(range(len(pairs)))
+    ax.set_yticklabels(labels, fontsize=8)
+    for bar, rho in zip(bars, r):
+        if not np.isnan(rho):
+            ax.text(bar.get_width(), bar.get_y() + bar.get_height() / 2,
+                    f" r={rho:.2f}", va="center", fontsize=8)
+    ax.set_xlabel("дней вместе")
+    ax.set_title(f"Частые пары эмоций ({period})")
+    fig.tight_layout()
+    return _png(fig)
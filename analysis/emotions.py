@@ -0,0 +1,228 @@
+# analysis/emotions.py
+# ───────────────────────────────────────────────────────────
+# Счётчики эмоций снов по дням: день → {эмоция: сколько снов}, плюс итог и
+# сумма интенсивностей по дням. Хранятся в data/<uid>/.cache/emotions.pkl
+# вместе с подписью сновидений; новый сон прибавляется подписчиком
+# storage.on_save, а сон, дождавшийся разбора (storage.update_records), —
+# вычитанием прежней версии и прибавлением новой. Меню CIM считает эмоции
+# за O(число эмоций), а не перечитывает все сны.
+# `python maintenance.py rebuild-emotions` пересобирает счётчики из истории.
+#
+# Для графиков CIM есть плотная матрица EmotionDays: дни со снами ×
+# CIM_EMOTIONS, float32, значение — средняя интенсивность снов дня с этой
+# эмоцией (0 — эмоции не было). Она строится из тех же счётчиков, а не из
+# записей снов. Срезы по периоду, совместная встречаемость и корреляции
+# считаются над ней векторно.
+import datetime, threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import CIM_EMOTIONS
+from utils import storage
+
+TALLY_VERSION = 2
+_NO_DATE = ""                         # сны без разборчивой даты — только в итоге
+
+_tallies: Dict[int, dict] = {}        # uid → {"sig", "days", "total", "weights"}
+_lock = threading.Lock()
+
+
+def _sig(uid: int) -> str:
+    return repr(storage.signature(uid, "dreams"))
+
+
+def _intensity(metrics: Dict[str, Any]) -> float:
+    try:
+        return float(metrics.get("intensity", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _bump(counter: Dict[str, Any], key: str, delta) -> None:
+    value = counter.get(key, 0) + delta
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _add(tally: dict, records: List[Dict[str, Any]], sign: int = 1) -> None:
+    """Прибавляет эмоции записей к счётчикам (sign=-1 — вычитает)."""
+    days, total, weights = tally["days"], tally["total"], tally["weights"]
+    for rec in records:
+        metrics = rec.get("metrics") or {}
+        emotions = metrics.get("emotions") or []
+        if not emotions:
+            continue
+        day = storage.parse_date(rec.get("date"))
+        key = day.isoformat() if day else _NO_DATE
+        bucket = days.setdefault(key, {})
+        wbucket = weights.setdefault(key, {})
+        w = _intensity(metrics)
+        for emo in emotions:
+            _bump(bucket, emo, sign)
+            _bump(total, emo, sign)
+            if emo in bucket:
+                wbucket[emo] = wbucket.get(emo, 0.0) + sign * w
+            else:
+                wbucket.pop(emo, None)     # последний сон с эмоцией — без остатков округления
+        if not bucket:
+            days.pop(key, None)
+            weights.pop(key, None)
+
+
+def _read(uid: int) -> Optional[dict]:
+    return storage.load_cache(uid, "emotions", TALLY_VERSION)
+
+
+def _write(uid: int, tally: dict) -> None:
+    storage.store_cache(uid, "emotions", TALLY_VERSION, tally)
+
+
+def rebuild(uid: int) -> dict:
+    """Recount emotions from all of a user's dreams and persist the tally."""
+    sig = _sig(uid)
+    tally = {"sig": sig, "days": {}, "total": {}, "weights": {}}
+    _add(tally, storage.load_records(uid, "dreams"))
+    with _lock:
+        _tallies[uid] = tally
+        _write(uid, tally)
+    return tally
+
+
+def _tally(uid: int) -> dict:
+    sig = _sig(uid)
+    with _lock:
+        tally = _tallies.get(uid) or _read(uid)
+        if tally is not None and tally["sig"] == sig:
+            _tallies[uid] = tally
+            return tally
+    return rebuild(uid)
+
+
+@storage.on_save
+def _update(uid: int, sub: str, records: List[Dict[str, Any]], before: tuple) -> None:
+    """Прибавляем эмоции нового сна к сохранённым счётчикам."""
+    if sub != "dreams":
+        return
+    with _lock:
+        tally = _tallies.get(uid) or _read(uid)
+        if tally is None or tally["sig"] != repr(before):
+            _tallies.pop(uid, None)   # счётчики устарели — пересоберём по запросу
+            return
+        _add(tally, records)
+        tally["sig"] = _sig(uid)
+        _tallies[uid] = tally
+        _write(uid, tally)
+
+
+@storage.on_update
+def _replace(uid: int, sub: str, pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+             before: tuple) -> None:
+    """Перезаписанный сон: вычитаем эмоции прежней версии и прибавляем новой."""
+    if sub != "dreams":
+        return
+    with _lock:
+        tally = _tallies.get(uid) or _read(uid)
+        if tally is None or tally["sig"] != repr(before):
+            _tallies.pop(uid, None)
+            return
+        _add(tally, [old for old, _ in pairs], sign=-1)
+        _add(tally, [new for _, new in pairs])
+        tally["sig"] = _sig(uid)
+        _tallies[uid] = tally
+        _write(uid, tally)
+
+
+# ─────────────── публичный API ─────────────────────────────
+def counts(uid: int,
+           since: Optional[datetime.date] = None,
+           until: Optional[datetime.date] = None) -> Dict[str, int]:
+    """Emotion → number of dreams mentioning it within [since, until]."""
+    tally = _tally(uid)
+    if since is None and until is None:
+        return dict(tally["total"])
+    lo = since.isoformat() if since else "0000"
+    hi = until.isoformat() if until else "9999"
+    out: Dict[str, int] = {}
+    for day, bucket in tally["days"].items():
+        if day and lo <= day <= hi:
+            for emo, n in bucket.items():
+                out[emo] = out.get(emo, 0) + n
+    return out
+
+
+# ─────────────── матрица «день × эмоция» ───────────────────
+_EMO_INDEX = {e: j for j, e in enumerate(CIM_EMOTIONS)}
+
+
+@dataclass
+class EmotionDays:
+    days: pd.DatetimeIndex            # дни со снами, по возрастанию
+    values: np.ndarray                # (len(days), len(CIM_EMOTIONS)), float32
+
+    @property
+    def empty(self) -> bool:
+        return not len(self.days)
+
+    def slice(self, start: Optional[pd.Timestamp] = None,
+              end: Optional[pd.Timestamp] = None) -> "EmotionDays":
+        """Days within [start, end)."""
+        lo = 0 if start is None else self.days.searchsorted(start)
+        hi = len(self.days) if end is None else self.days.searchsorted(end)
+        return EmotionDays(self.days[lo:hi], self.values[lo:hi])
+
+    def present(self) -> np.ndarray:
+        """Indices of emotions that occur at least once."""
+        return np.flatnonzero((self.values > 0).any(axis=0))
+
+    def cooccurrence(self) -> np.ndarray:
+        """Emotion × emotion: number of days on which both occurred."""
+        hits = (self.values > 0).astype(np.float32)
+        return hits.T @ hits
+
+    def correlation(self) -> np.ndarray:
+        """Pearson correlation of daily intensities (NaN for constant emotions)."""
+        v = self.values - self.values.mean(axis=0)
+        norm = np.sqrt((v * v).sum(axis=0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (v.T @ v) / np.outer(norm, norm)
+
+    def top_pairs(self, k: int = 10) -> List[Tuple[str, str, int]]:
+        """The k most frequent pairs of emotions on the same day."""
+        co = self.cooccurrence()
+        i, j = np.triu_indices(len(CIM_EMOTIONS), 1)
+        n = co[i, j]
+        order = np.argsort(n, kind="stable")[::-1][:k]
+        return [(CIM_EMOTIONS[i[o]], CIM_EMOTIONS[j[o]], int(n[o])) for o in order if n[o] > 0]
+
+
+def _build_matrix(tally: dict) -> EmotionDays:
+    keys = sorted(d for d, bucket in tally["days"].items()
+                  if d != _NO_DATE and any(e in _EMO_INDEX for e in bucket))
+    values = np.zeros((len(keys), len(CIM_EMOTIONS)), np.float32)
+    for i, d in enumerate(keys):
+        weights = tally["weights"].get(d, {})
+        for emo, n in tally["days"][d].items():
+            j = _EMO_INDEX.get(emo)
+            if j is not None:
+                values[i, j] = weights.get(emo, 0.0) / n
+    return EmotionDays(pd.DatetimeIndex(keys), values)
+
+
+_matrices: Dict[int, Tuple[str, EmotionDays]] = {}
+
+
+def matrix(uid: int) -> EmotionDays:
+    """Dense emotion-by-day matrix of a user's dreams (cached until dreams change)."""
+    tally = _tally(uid)
+    with _lock:
+        hit = _matrices.get(uid)
+        if hit is not None and hit[0] == tally["sig"]:
+            return hit[1]
+        m = _build_matrix(tally)
+        _matrices[uid] = (tally["sig"], m)
+    return m
@@ -0,0 +1,180 @@
+# analysis/episodes.py
+# ───────────────────────────────────────────────────────────
+# Онлайн-поиск сдвигов по чек-инам: для каждого параметра двусторонний
+# CUSUM относительно медленно плывущего базового уровня (EWMA среднего и
+# разброса). Состояние на параметр — несколько чисел, каждая новая запись
+# обновляет его за O(1) подписчиком storage.on_save; хранится в
+# data/<uid>/.cache/episodes.pkl вместе с подписью mood.
+#
+# Сработавший CUSUM — событие (параметр, вверх/вниз, дата). Если за
+# WINDOW_DAYS набралось MIN_SIGNS событий «вверх» по маниакальным признакам
+# (или «вниз» по депрессивным), поднимается флаг, который бот сообщает
+# пользователю один раз; флаг гаснет, когда события выходят из окна.
+# Записи задним числом (раньше последней учтённой) ломают порядок — тогда
+# состояние пересобирается из истории целиком, как и командой
+# `python maintenance.py rebuild-episodes`.
+import datetime, json, math, threading
+from typing import Any, Dict, List, Optional
+
+from utils import storage
+
+STATE_VERSION = 1
+WARMUP = 14                 # первые записи только учат базовый уровень
+ALPHA = 0.05                # скорость EWMA базового уровня
+K = 0.5                     # допуск CUSUM, в стандартных отклонениях
+H = 5.0                     # порог срабатывания
+MIN_SD = 0.5                # шкала −3…3: меньший разброс не считаем
+WINDOW_DAYS = 7
+MIN_SIGNS = 2
+
+MANIC = {"mood", "energy", "thought_speed", "impulsivity", "libido", "irritability"}
+DEPRESSIVE = {"mood", "energy", "thought_speed", "libido"}
+KINDS = {"mania": ("up", MANIC), "depression": ("down", DEPRESSIVE)}
+
+_states: Dict[int, dict] = {}
+_lock = threading.Lock()
+
+
+def _empty() -> dict:
+    return {"params": {}, "events": [], "last": None, "flag": None}
+
+
+def _step(p: dict, x: float) -> Optional[str]:
+    """Один шаг CUSUM параметра; 'up' / 'down' при срабатывании."""
+    p["n"] += 1
+    alarm = None
+    if p["n"] > WARMUP:
+        z = (x - p["mean"]) / max(math.sqrt(p["var"]), MIN_SD)
+        p["pos"] = max(0.0, p["pos"] + z - K)
+        p["neg"] = max(0.0, p["neg"] - z - K)
+        if p["pos"] > H:
+            alarm, p["pos"], p["neg"] = "up", 0.0, 0.0
+        elif p["neg"] > H:
+            alarm, p["pos"], p["neg"] = "down", 0.0, 0.0
+    a = max(ALPHA, 1 / p["n"])       # пока данных мало — обычное среднее
+    d = x - p["mean"]
+    p["mean"] += a * d
+    p["var"] = (1 - a) * (p["var"] + a * d * d)
+    return alarm
+
+
+def _feed(state: dict, rec: Dict[str, Any]) -> None:
+    day = storage.parse_date(rec.get("date"))
+    if day is None:
+        return
+    iso = day.isoformat()
+    for key, x in rec.items():
+        if key == "date" or isinstance(x, bool) or not isinstance(x, (int, float)):
+            continue
+        p = state["params"].setdefault(key, {"n": 0, "mean": 0.0, "var": 0.0, "pos": 0.0, "neg": 0.0})
+        alarm = _step(p, float(x))
+        if alarm:
+            state["events"].append([key, alarm, iso])
+    state["last"] = iso
+
+    horizon = (day - datetime.timedelta(days=WINDOW_DAYS)).isoformat()
+    state["events"] = [e for e in state["events"] if e[2] > horizon]
+    for kind, (direction, signs) in KINDS.items():
+        events = [e for e in state["events"] if e[1] == direction and e[0] in signs]
+        hit = sorted({e[0] for e in events})
+        flag = state["flag"]
+        ongoing = flag and flag["active"] and flag["kind"] == kind
+        if len(hit) >= MIN_SIGNS and not ongoing:
+            state["flag"] = {"kind": kind, "since": min(e[2] for e in events),
+                             "params": hit, "active": True, "reported": False}
+        elif ongoing and len(hit) < MIN_SIGNS:
+            flag["active"] = False
+
+
+def _read(uid: int) -> Optional[dict]:
+    state = storage.load_cache(uid, "episodes", STATE_VERSION)
+    if state is None:                 # episodes.json прежних версий: в нём отметка «сообщено»
+        try:
+            raw = json.loads((storage.user_dir(uid) / ".cache" / "episodes.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        state = raw if raw.get("version") == STATE_VERSION else None
+    return state
+
+
+def _write(uid: int, state: dict) -> None:
+    storage.store_cache(uid, "episodes", STATE_VERSION, state)
+
+
+def _by_date(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    dated = [(storage.parse_date(r.get("date")), i, r) for i, r in enumerate(records)]
+    return [r for d, _, r in sorted((t for t in dated if t[0]), key=lambda t: (t[0], t[1]))]
+
+
+def rebuild(uid: int, quiet: bool = False) -> dict:
+    """Replay all check-ins in date order and persist the detector state.
+
+    With quiet=True the resulting flag counts as already reported.
+    """
+    sig = repr(storage.signature(uid, "mood"))
+    state = _empty()
+    for rec in _by_date(storage.load_records(uid, "mood")):
+        _feed(state, rec)
+    flag = state["flag"]
+    if flag:
+        with _lock:
+            prev = (_states.get(uid) or _read(uid) or {}).get("flag")
+        same = prev and (prev["kind"], prev["since"]) == (flag["kind"], flag["since"])
+        flag["reported"] = quiet or bool(same and prev["reported"])
+    state["sig"] = sig
+    with _lock:
+        _states[uid] = state
+        _write(uid, state)
+    return state
+
+
+def _state(uid: int) -> dict:
+    sig = repr(storage.signature(uid, "mood"))
+    with _lock:
+        state = _states.get(uid) or _read(uid)
+        if state is not None and state["sig"] == sig:
+            _states[uid] = state
+            return state
+    return rebuild(uid)
+
+
+@storage.on_save
+def _update(uid: int, sub: str, records: List[Dict[str, Any]], before: tuple) -> None:
+    """Новый чек-ин — один шаг детектора по каждому параметру."""
+    if sub != "mood":
+        return
+    with _lock:
+        state = _states.get(uid) or _read(uid)
+        new = _by_date(records)
+        if (state is None or state["sig"] != repr(before)
+                or (new and state["last"]
+                    and storage.parse_date(new[0]["date"]).isoformat() < state["last"])):
+            _states.pop(uid, None)            # задним числом — пересоберём по запросу
+            return
+        for rec in new:
+            _feed(state, rec)
+        state["sig"] = repr(storage.signature(uid, "mood"))
+        _states[uid] = state
+        _write(uid, state)
+
+
+# ─────────────── публичный API ─────────────────────────────
+def current(uid: int) -> Optional[dict]:
+    """The active shift flag {"kind", "since", "params", ...} or None."""
+    flag = _state(uid)["flag"]
+    return flag if flag and flag["active"] else None
+
+
+def take_new_flag(uid: int) -> Optional[dict]:
+    """Return a not yet reported flag and mark it reported."""
+    state = _state(uid)
+    with _lock:
+        flag = state["flag"]
+        if not flag or not flag["active"] or flag["reported"]:
+            return None
+        fresh = datetime.date.today() - datetime.timedelta(days=WINDOW_DAYS)
+        if state["last"] < fresh.isoformat():
+            return None                       # сдвиг давний — не тревожим
+        flag["reported"] = True
+        _write(uid, state)
+        return dict(flag)
@@ -1,52 +1,93 @@
-import datetime
+from typing import Optional
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
-from analysis.generate_plot import _load
+from analysis import spectral
+from analysis.generate_plot import _png
 
+MODE_TITLES = {"fft": "FFT", "ls": "Ломб–Скаргл"}
 
-def _series(uid: int, param: str):
-    df = _load(uid)
-    if df.empty or param not in df.columns:
+
+def render_fft(uid: int, param: str, mode: str = "fft") -> Optional[bytes]:
+    """PNG of the spectrum of param (None if no data); mode is "fft" or "ls"."""
+    spec = spectral.spectrum(uid, param, mode)
+    if spec is None:
         return None
-    df = df.dropna(subset=[param]).sort_values("date")
-    if df.empty:
+    freq, amp = spec
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(freq, amp)
+    ax.set_title(f"{MODE_TITLES[mode]} {param}")
+
+    if len(amp) > 4:
+        for T, power in spectral.dominant(spec):
+            ax.plot(1 / T, power, "ro")
+            ax.text(1 / T, power, spectral.period_label(T))
+
+    return _png(fig)
+
+
+def render_spectra(uid: int, params: list[str], mode: str = "fft") -> Optional[bytes]:
+    """PNG with normalised spectra of several parameters against the period in days."""
+    specs = spectral.spectra(uid, mode)
+    params = [p for p in params if p in specs]
+    if not params:
         return None
-    x = df["date"].dt.date.map(datetime.date.toordinal).to_numpy()
-    y = df[param].to_numpy()
-    return np.array([x, y])
-def save_fft(uid: int, param: str, out: str):
-    res = _series(uid, param)
-    if res is None:
+
+    fig = Figure()
+    ax = fig.subplots()
+    for p in params:
+        freq, amp = specs[p]
+        top = amp.max()
+        ax.plot(1 / freq, amp / top if top > 0 else amp, label=p)
+    ax.set_xscale("log")
+    ax.set_xlabel("период, дней")
+    ax.legend()
+    ax.set_title(f"{MODE_TITLES[mode]}: все параметры")
+    fig.tight_layout()
+    return _png(fig)
+
+
+def render_spectrogram(uid: int, param: str) -> Optional[bytes]:
+    """PNG heatmap of the sliding-window spectrogram of param (None if too little data)."""
+    sg = spectral.spectrogram(uid, param)
+    if sg is None or not len(sg[2]):
         return None
+    centres, periods, power = sg
+    keep = periods >= 2
+    # каждое окно нормируем на свой максимум: видно, какой цикл ведущий в данный момент
+    top = np.nanmax(power[:, keep], axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm = power[:, keep] / top
 
-    x, y = res
-    days = np.arange(x[0], x[-1] + 1)
-    y = np.interp(days, x, y) - np.mean(y)
+    fig = Figure(figsize=(8, 4.8))
+    ax = fig.subplots()
+    mesh = ax.pcolormesh(centres, periods[keep], norm.T, shading="nearest", cmap="magma")
+    ax.set_yscale("log")
+    ax.set_ylabel("период, дней")
+    ax.set_title(f"Спектрограмма {param} (окно {spectral.SG_WINDOW} дн)")
+    fig.colorbar(mesh, ax=ax, label="доля от максимума окна")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return _png(fig)
 
-    amp = np.abs(np.fft.rfft(y))
-    freq = np.fft.rfftfreq(len(days), d=1)
 
-    plt.figure()
-    plt.plot(freq[1:], amp[1:])
-    plt.title(f"FFT {param}")
+def cycles_text(uid: int, params: list[tuple[str, str]], mode: str = "fft") -> str:
+    """Dominant cycles of (key, label) params, one line per parameter."""
+    specs = spectral.spectra(uid, mode)
+    lines = []
+    for key, label in params:
+        if key in specs:
+            cycles = ", ".join(spectral.period_label(T) for T, _ in spectral.dominant(specs[key]))
+            lines.append(f"{label}: {cycles}")
+    return "\n".join(lines)
 
-    if len(amp) > 4:
-        idx = np.argsort(amp[1:])[-3:][::-1]
-        for i in idx:
-            f = freq[1:][i]
-            if f == 0:
-                continue
-            T = 1 / f
-            if T <= 90:
-                label = f"{round(T)} дн"
-            elif T <= 365 * 3:
-                label = f"{round(T/30)} мес"
-            else:
-                label = f"{round(T/365, 1)} лет"
-            plt.plot(f, amp[1:][i], "ro")
-            plt.text(f, amp[1:][i], label)
-
-    plt.savefig(out)
-    plt.close()
+
+def save_fft(uid: int, param: str, out: str, mode: str = "fft"):
+    data = render_fft(uid, param, mode)
+    if data is None:
+        return None
+    with open(out, "wb") as f:
+        f.write(data)
     return out
@@ -0,0 +1,142 @@
+# analysis/frame.py
+# ───────────────────────────────────────────────────────────
+# Аналитический DataFrame пользователя (чек-ины + метрики снов) строится
+# один раз, дальше к нему только дописываются новые строки при сохранении
+# записи. Снимок лежит в data/<uid>/.cache/frame.pkl с версией формата и
+# подписью данных, поэтому после перезапуска JSON заново не разбирается.
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import CIM_EMOTIONS
+from utils import storage
+
+FRAME_VERSION = 3
+
+_frames: Dict[int, Tuple[tuple, pd.DataFrame]] = {}   # uid → (подпись, frame) этого процесса
+_lock = threading.Lock()
+
+
+# ─────────────── записи → DataFrame ────────────────────────
+_EMO_INDEX = {e: j for j, e in enumerate(CIM_EMOTIONS)}
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """ISO-даты одним векторным проходом, затем YYYYMMDD… для оставшихся."""
+    s = values.astype("string")
+    out = pd.to_datetime(s, format="%Y-%m-%d", errors="coerce")
+    rest = out.isna() & s.notna()
+    if rest.any():
+        out[rest] = pd.to_datetime(s[rest].str.slice(0, 8), format="%Y%m%d", errors="coerce")
+    return out
+
+
+def _mood_frame(mood: List[Dict[str, Any]]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(mood)
+    if df.empty or "date" not in df.columns:
+        return pd.DataFrame()
+    df["date"] = _parse_dates(df["date"])
+    return df[df["date"].notna()].reset_index(drop=True)
+
+
+def _dream_frame(dreams: List[Dict[str, Any]]) -> pd.DataFrame:
+    recs = [r for r in dreams if r.get("date") and r.get("metrics")]
+    if not recs:
+        return pd.DataFrame()
+    metrics = [r["metrics"] for r in recs]
+    cols: Dict[str, Any] = {"date": _parse_dates(pd.Series([r["date"] for r in recs]))}
+    for key in ("cim_score", "intensity"):
+        if any(key in m for m in metrics):
+            cols[key] = pd.to_numeric(pd.Series([m.get(key) for m in metrics]), errors="coerce")
+    df = pd.DataFrame(cols)
+
+    # one-hot блок эмоций: строка — сон, столбец — эмоция из CIM_EMOTIONS,
+    # значение — интенсивность сна (NaN, если эмоции в сне нет)
+    weight = pd.to_numeric(
+        pd.Series([m.get("intensity", 1) for m in metrics]), errors="coerce"
+    ).to_numpy(dtype=float)
+    hits = [(i, _EMO_INDEX[e]) for i, m in enumerate(metrics)
+            for e in (m.get("emotions") or []) if e in _EMO_INDEX]
+    if hits:
+        rows, idx = np.array(hits).T
+        block = np.full((len(recs), len(CIM_EMOTIONS)), np.nan)
+        block[rows, idx] = weight[rows]
+        used = np.unique(idx)
+        emo = pd.DataFrame(block[:, used], columns=[f"emo_{CIM_EMOTIONS[j]}" for j in used])
+        df = pd.concat([df, emo], axis=1)
+    return df[df["date"].notna()].reset_index(drop=True)
+
+
+def from_records(mood: List[Dict[str, Any]], dreams: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Return DataFrame with mood records and dream metrics (columnar ingestion)."""
+    df = _mood_frame(mood)
+    df_dream = _dream_frame(dreams)
+    if df_dream.empty:
+        return df
+    if df.empty:
+        return df_dream
+    return pd.concat([df, df_dream], ignore_index=True, sort=False)
+
+
+# ─────────────── снимок на диске ───────────────────────────
+def _read_snapshot(uid: int) -> Optional[Tuple[tuple, pd.DataFrame]]:
+    return storage.load_cache(uid, "frame", FRAME_VERSION)
+
+
+def _write_snapshot(uid: int, sig: tuple, df: pd.DataFrame) -> None:
+    storage.store_cache(uid, "frame", FRAME_VERSION, (sig, df))
+
+
+# ─────────────── публичный API ─────────────────────────────
+def get_frame(uid: int) -> pd.DataFrame:
+    """Full analytics frame of a user (a copy the caller may modify)."""
+    sig = storage.data_signature(uid)
+    with _lock:
+        entry = _frames.get(uid)
+        if entry is None or entry[0] != sig:
+            entry = _read_snapshot(uid)
+            if entry is None or entry[0] != sig:
+                df = from_records(storage.load_records(uid, "mood"),
+                                  storage.load_records(uid, "dreams"))
+                entry = (sig, df)
+                if storage.data_signature(uid) == sig:    # иначе подписчик допишет строки дважды
+                    _write_snapshot(uid, sig, df)
+            _frames[uid] = entry
+        return entry[1].copy()
+
+
+def rows(sub: str, records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Frame rows contributed by records of kind sub ("mood" or "dreams")."""
+    return from_records(records if sub == "mood" else [], records if sub == "dreams" else [])
+
+
+@storage.on_save
+def _append(uid: int, sub: str, records: List[Dict[str, Any]], before: tuple) -> None:
+    """Дописываем в готовый frame только новые строки."""
+    if sub not in ("mood", "dreams"):
+        return
+    expected = storage.data_signature_before(uid, sub, before)
+    with _lock:
+        _frames.pop(uid, None)           # frame читают процессы рендера — из снимка
+        entry = _read_snapshot(uid)
+        if entry is None or entry[0] != expected:
+            return                       # состояние устарело — соберём заново по запросу
+        new = rows(sub, records)
+        df = entry[1] if new.empty else pd.concat([entry[1], new], ignore_index=True, sort=False)
+        _write_snapshot(uid, storage.data_signature(uid), df)
+
+
+@storage.on_update
+def _replace(uid: int, sub: str, pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+             before: tuple) -> None:
+    """
+    Перезапись записи, у которой строк во frame не было (сон, дождавшийся
+    разбора), — то же, что дописывание новой. Строки прежней версии записи
+    во frame не найти, поэтому остальные изменения пересобирают frame.
+    """
+    if sub not in ("mood", "dreams"):
+        return
+    if rows(sub, [old for old, _ in pairs]).empty:
+        _append(uid, sub, [new for _, new in pairs], before)
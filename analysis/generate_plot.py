@@ -1,60 +1,15 @@
-import datetime
+import datetime, io
 from dateutil.relativedelta import relativedelta
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure   # без pyplot: у каждого графика своя фигура
 from typing import Optional
 from math import ceil
 
-from utils.storage import load_records
-
-
-def _load(uid: int) -> pd.DataFrame:
-    """Return DataFrame with mood records and dream metrics."""
-    rows: list[dict] = []
-    for rec in load_records(uid, "mood"):
-        date_str = rec.get("date")
-        if not date_str:
-            continue
-        try:
-            rec_date = datetime.date.fromisoformat(str(date_str))
-        except ValueError:
-            try:
-                rec_date = datetime.datetime.strptime(str(date_str)[:8], "%Y%m%d").date()
-            except ValueError:
-                continue
-        rec["date"] = rec_date
-        rows.append(rec)
-    df = pd.DataFrame(rows)
-
-    # добавляем показатели снов
-    dream_rows = []
-    for rec in load_records(uid, "dreams"):
-        date = rec.get("date")
-        metrics = rec.get("metrics") or {}
-        if not date or not metrics:
-            continue
-        row = {"date": pd.to_datetime(date)}
-        if "cim_score" in metrics:
-            row["cim_score"] = metrics["cim_score"]
-        if "intensity" in metrics:
-            row["intensity"] = metrics["intensity"]
-        if "emotions" in metrics:
-            for emo in metrics["emotions"]:
-                row.setdefault(f"emo_{emo}", metrics.get("intensity", 1))
-        dream_rows.append(row)
-
-    df_dream = pd.DataFrame(dream_rows)
-    if not df.empty and "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"])
-    if not df_dream.empty:
-        df = pd.concat([df, df_dream], ignore_index=True, sort=False)
-    return df
-
-
-def _slice(df: pd.DataFrame, period: str, page: int) -> pd.DataFrame:
-    if period == "all" or df.empty:
-        return df
-    last = df["date"].max()
+from analysis import emotions, pyramid
+
+
+def _window(period: str, page: int, last: pd.Timestamp) -> Optional[tuple[pd.Timestamp, pd.Timestamp]]:
+    """[start, end) of the given page of a period, counted back from the last date."""
     if period == "year":
         start = (last - relativedelta(years=page)).replace(month=1, day=1)
         end = start + relativedelta(years=1)
@@ -65,38 +20,62 @@ def _slice(df: pd.DataFrame, period: str, page: int) -> pd.DataFrame:
         start = last - datetime.timedelta(days=last.weekday()) - datetime.timedelta(weeks=page)
         end = start + datetime.timedelta(weeks=1)
     else:
-        return df
-    return df[(df["date"] >= start) & (df["date"] < end)]
-
-
-def emotion_counts(uid: int) -> dict[str, int]:
-    """Return a mapping emotion -> total occurrences in dreams."""
-    counts: dict[str, int] = {}
-    for rec in load_records(uid, "dreams"):
-        metrics = rec.get("metrics") or {}
-        for emo in metrics.get("emotions", []):
-            counts[emo] = counts.get(emo, 0) + 1
-    return counts
-
+        return None
+    return start, end
 
-def plot_multi(uid: int, params: list[str], period: str, out: str, page: int = 0) -> Optional[str]:
 
-    df = _load(uid)
-    if df.empty:
+def _daily_mean(uid: int, params: list[str], period: str, page: int) -> Optional[pd.DataFrame]:
+    """
+    Среднее по дням за страницу периода из дневного уровня пирамиды:
+    от первого до последнего дня с записями, пустые дни — нули.
+    """
+    last = pyramid.last_day(uid)
+    if last is None:
         return None
-    params = [p for p in params if p in df.columns]
+    params = [p for p in params if p in pyramid.columns(uid)]
     if not params:
         return None
-    df = _slice(df, period, page)
-    if df.empty:
+    win = _window(period, page, last) if period != "all" else None
+    day = pyramid.level(uid, "D", *(win or (None, None)), params=params)
+    if day.empty:
         return None
+    days = pd.date_range(day.index.min(), day.index.max(), freq="D")
+    mean = day[[(p, "mean") for p in params]].set_axis(params, axis=1)
+    return mean.reindex(days).fillna(0)
+
+
+def page_count(uid: int, params: list[str], period: str) -> int:
+    """How many pages of period reach back to the oldest data of params (0 if none)."""
+    last = pyramid.last_day(uid)
+    params = [p for p in params if p in pyramid.columns(uid)]
+    if last is None or not params:
+        return 0
+    day = pyramid.level(uid, "D", params=params)
+    seen = day[[(p, "count") for p in params]].sum(axis=1) > 0
+    if not seen.any():
+        return 0
+    if period == "all":
+        return 1
+    first = day.index[seen.to_numpy()].min()
+    pages = 1
+    while _window(period, pages, last)[1] > first:
+        pages += 1
+    return pages
+
+
+def emotion_counts(uid: int,
+                   since: Optional[datetime.date] = None,
+                   until: Optional[datetime.date] = None) -> dict[str, int]:
+    """Return a mapping emotion -> total occurrences in dreams."""
+    return emotions.counts(uid, since, until)
 
-    df = df.sort_values("date")
-    df.set_index("date", inplace=True)
 
-    daily_mean = df[params].resample("1D").mean().fillna(0)
-    if daily_mean.empty:
+def render_multi(uid: int, params: list[str], period: str, page: int = 0) -> Optional[bytes]:
+    """PNG of the daily means of params for a page of period (None if no data)."""
+    daily_mean = _daily_mean(uid, params, period, page)
+    if daily_mean is None:
         return None
+    params = list(daily_mean.columns)
 
     if len(params) > 1:
         mean = daily_mean.rolling(window=7, min_periods=1).mean()
@@ -107,14 +86,15 @@ def plot_multi(uid: int, params: list[str], period: str, out: str, page: int = 0
             step = max(1, ceil(span / 60))
         mean = daily_mean.resample(f"{step}D").mean()
 
-    plt.figure()
+    fig = Figure()
+    ax = fig.subplots()
     for p in params:
         if p in mean.columns:
             series = mean[p]
             if len(params) > 1:
-                plt.plot(series.index, series, label=p)
+                ax.plot(series.index, series, label=p)
             else:
-                plt.plot(series.index, series, label=p)
+                ax.plot(series.index, series, label=p)
 
     # ───── оформление оси X ────────────────────────────────
     months_nom = [
@@ -184,12 +164,27 @@ def plot_multi(uid: int, params: list[str], period: str, out: str, page: int = 0
             f"{months_nom[end.month-1]} {end.year}"
         )
 
-    plt.xticks(ticks, labels, rotation=45, ha="right")
-    plt.xlabel(xlabel)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels, rotation=45, ha="right")
+    ax.set_xlabel(xlabel)
+
+    ax.legend()
+    ax.set_title(f"{', '.join(params)} ({period})")
+    fig.tight_layout()
+    return _png(fig)
+
+
+def _png(fig: Figure) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
 
-    plt.legend()
-    plt.title(f"{', '.join(params)} ({period})")
-    plt.tight_layout()
-    plt.savefig(out)
-    plt.close()
+
+def plot_multi(uid: int, params: list[str], period: str, out: str, page: int = 0) -> Optional[str]:
+    """render_multi() written to a file (for the CLI)."""
+    data = render_multi(uid, params, period, page)
+    if data is None:
+        return None
+    with open(out, "wb") as f:
+        f.write(data)
     return out
@@ -0,0 +1,119 @@
+# analysis/lagcorr.py
+# ───────────────────────────────────────────────────────────
+# Корреляция со сдвигом между CIM-score снов и параметрами настроения:
+# r(k) = corr(cim[t], param[t + k]) для k = −MAX_LAG…+MAX_LAG дней
+# (k > 0 — настроение спустя k дней после сна). Ряды — дневные средние
+# пирамиды без заполнения пропусков: в каждую пару идут только дни, где
+# есть оба значения. Все параметры и все сдвиги считаются одной матрицей
+# (sliding_window_view + маскированные суммы), результат кэшируется до
+# смены storage.data_version() в памяти и в data/<uid>/.cache/lagcorr.pkl,
+# общем для всех процессов рендера.
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from analysis import pyramid
+from analysis.generate_plot import _png
+from utils import storage
+
+MAX_LAG = 14
+MIN_PAIRS = 10                        # меньше пар — корреляция не считается
+LAGCORR_VERSION = 1
+
+Lagged = Tuple[np.ndarray, np.ndarray, np.ndarray]      # (сдвиги, r, число пар)
+
+_cache: Dict[int, Tuple[str, Dict[str, Lagged]]] = {}
+_lock = threading.Lock()
+
+
+def _compute(uid: int) -> Dict[str, Lagged]:
+    have = pyramid.columns(uid)
+    params = [p for p in have if p != "cim_score" and not p.startswith("emo_")]
+    if "cim_score" not in have or not params:
+        return {}
+    day = pyramid.level(uid, "D", params=["cim_score", *params])
+    days = pd.date_range(day.index.min(), day.index.max(), freq="D")
+    cim = day[("cim_score", "mean")].reindex(days).to_numpy(dtype=float)
+    vals = day[[(p, "mean") for p in params]].reindex(days).to_numpy(dtype=float)
+
+    # окно row t, столбец j → param[t + j − MAX_LAG]
+    pad = np.full((MAX_LAG, len(params)), np.nan)
+    padded = np.vstack([pad, vals, pad])
+    y = np.lib.stride_tricks.sliding_window_view(padded, 2 * MAX_LAG + 1, axis=0)  # (дни, P, сдвиги)
+    x = np.broadcast_to(cim[:, None, None], y.shape)
+    ok = ~np.isnan(x) & ~np.isnan(y)
+    x0 = np.where(ok, x, 0.0)
+    y0 = np.where(ok, y, 0.0)
+
+    n = ok.sum(axis=0)
+    sx, sy = x0.sum(axis=0), y0.sum(axis=0)
+    sxx, syy, sxy = (x0 * x0).sum(axis=0), (y0 * y0).sum(axis=0), (x0 * y0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    r[n < MIN_PAIRS] = np.nan
+
+    lags = np.arange(-MAX_LAG, MAX_LAG + 1)
+    return {p: (lags, r[j], n[j]) for j, p in enumerate(params)}
+
+
+# ─────────────── публичный API ─────────────────────────────
+def correlations(uid: int) -> Dict[str, Lagged]:
+    """param → (lags, r, pairs) for the correlation of cim_score with param shifted by lag."""
+    version = storage.data_version(uid)
+    with _lock:
+        hit = _cache.get(uid)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    result = storage.load_cache(uid, "lagcorr", (LAGCORR_VERSION, MAX_LAG, version))
+    if result is None:
+        result = _compute(uid)
+        storage.store_cache(uid, "lagcorr", (LAGCORR_VERSION, MAX_LAG, version), result)
+    with _lock:
+        _cache[uid] = (version, result)
+    return result
+
+
+def strongest(lagged: Lagged) -> Optional[Tuple[int, float]]:
+    """(lag, r) with the largest |r|, or None if nothing is computable."""
+    lags, r, _ = lagged
+    if np.isnan(r).all():
+        return None
+    i = int(np.nanargmax(np.abs(r)))
+    return int(lags[i]), float(r[i])
+
+
+def render(uid: int, params: List[str]) -> Optional[bytes]:
+    """PNG of r(lag) curves for the given parameters."""
+    res = correlations(uid)
+    params = [p for p in params if p in res and not np.isnan(res[p][1]).all()]
+    if not params:
+        return None
+
+    fig = Figure()
+    ax = fig.subplots()
+    for p in params:
+        lags, r, _ = res[p]
+        ax.plot(lags, r, marker=".", label=p)
+    ax.axhline(0, color="grey", linewidth=0.8)
+    ax.axvline(0, color="grey", linewidth=0.8, linestyle=":")
+    ax.set_xlabel("сдвиг, дней (> 0 — настроение после сна)")
+    ax.set_ylabel("r")
+    ax.set_title("CIM-score снов ↔ параметры")
+    ax.legend(fontsize=8)
+    fig.tight_layout()
+    return _png(fig)
+
+
+def summary(uid: int, params: List[Tuple[str, str]]) -> str:
+    """Strongest lag per (key, label) parameter, one line each."""
+    res = correlations(uid)
+    lines = []
+    for key, label in params:
+        best = strongest(res[key]) if key in res else None
+        if best:
+            lag, r = best
+            lines.append(f"{label}: r={r:+.2f} при сдвиге {lag:+d} дн")
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+# analysis/pyramid.py
+# ───────────────────────────────────────────────────────────
+# Пирамида агрегатов: для каждого числового столбца аналитического frame
+# (параметры user_graph_params, cim_score, emo_*) хранятся сумма, число
+# значений, минимум и максимум по дням, неделям (с понедельника) и месяцам.
+# При новой записи пересчитываются только затронутые корзины, поэтому любая
+# страница периода в меню графиков и CIM — это срез, а не resample истории.
+# Пирамида лежит в data/<uid>/.cache/pyramid.pkl с подписью данных: её
+# обновляет подписчик storage.on_save в процессе бота, а читают процессы
+# рендера (analysis/render_service.py) — им не нужно собирать её заново.
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import frame
+from utils import storage
+
+LEVELS = ("D", "W", "M")
+PYRAMID_VERSION = 1
+ROWS = "_rows"                     # сколько записей (любых) попало в корзину
+_STATS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+_pyramids: Dict[int, Tuple[tuple, Dict[str, pd.DataFrame]]] = {}   # прочитанные этим процессом
+_lock = threading.Lock()
+
+
+def _bucket(dates: pd.Series, level: str) -> pd.Series:
+    day = dates.dt.normalize()
+    if level == "D":
+        return day
+    if level == "W":
+        return day - pd.to_timedelta(day.dt.weekday, unit="D")
+    return day.dt.to_period("M").dt.start_time
+
+
+def _days(df: pd.DataFrame) -> pd.DataFrame:
+    """Дневной уровень из строк frame: (столбец, статистика) + _rows."""
+    if df.empty or "date" not in df.columns:
+        return pd.DataFrame()
+    num = df.drop(columns="date").apply(pd.to_numeric, errors="coerce")
+    num = num.loc[:, num.notna().any()]
+    key = _bucket(df["date"], "D").to_numpy()
+    rows = pd.Series(key).value_counts().sort_index()
+    rows = pd.DataFrame({(ROWS, "count"): rows.to_numpy()}, index=rows.index)
+    if num.empty:
+        return rows
+    out = num.groupby(key).agg(["sum", "count", "min", "max"])
+    return pd.concat([out.reindex(rows.index), rows], axis=1)
+
+
+def _combine(parts: pd.DataFrame, key) -> pd.DataFrame:
+    """Сливает корзины с одинаковым ключом: суммы и счётчики складываются."""
+    parts = parts.copy()
+    counts = [c for c in parts.columns if c[1] in ("sum", "count")]
+    parts[counts] = parts[counts].fillna(0)
+    funcs = {c: _STATS[c[1]] for c in parts.columns}
+    return parts.groupby(key).agg(funcs)
+
+
+def _rollup(day: pd.DataFrame, level: str) -> pd.DataFrame:
+    if level == "D" or day.empty:
+        return day
+    return _combine(day, _bucket(day.index.to_series(), level).to_numpy())
+
+
+def _merge(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Добавляет корзины new к уровню old, пересчитывая только общие."""
+    if old.empty:
+        return new
+    common = old.index.intersection(new.index)
+    parts = pd.concat([old.loc[common], new])
+    merged = _combine(parts, parts.index)
+    out = pd.concat([old.drop(common), merged]).sort_index()
+    counts = [c for c in out.columns if c[1] in ("sum", "count")]
+    out[counts] = out[counts].fillna(0)
+    return out
+
+
+def _build(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    day = _days(df)
+    return {level: _rollup(day, level) for level in LEVELS}
+
+
+def _levels(uid: int) -> Dict[str, pd.DataFrame]:
+    sig = storage.data_signature(uid)
+    with _lock:
+        entry = _pyramids.get(uid)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+    levels = storage.load_cache(uid, "pyramid", (PYRAMID_VERSION, sig))
+    if levels is None:
+        levels = _build(frame.get_frame(uid))
+        # сохраняем, только если данные не изменились за время сборки: иначе
+        # подписчик добавил бы новые записи к пирамиде, где они уже учтены
+        if storage.data_signature(uid) == sig:
+            storage.store_cache(uid, "pyramid", (PYRAMID_VERSION, sig), levels)
+    with _lock:
+        _pyramids[uid] = (sig, levels)
+    return levels
+
+
+@storage.on_save
+def _update(uid: int, sub: str, records: List[Dict[str, Any]], before: tuple) -> None:
+    """Пересчитываем только корзины, в которые попали новые записи."""
+    if sub not in ("mood", "dreams"):
+        return
+    expected = storage.data_signature_before(uid, sub, before)
+    with _lock:
+        _pyramids.pop(uid, None)
+        levels = storage.load_cache(uid, "pyramid", (PYRAMID_VERSION, expected))
+        if levels is None:
+            return                        # снимка нет или он устарел — соберут по запросу
+        day = _days(frame.rows(sub, records))
+        if not day.empty:
+            levels = {lvl: _merge(levels[lvl], _rollup(day, lvl)) for lvl in LEVELS}
+        storage.store_cache(uid, "pyramid", (PYRAMID_VERSION, storage.data_signature(uid)), levels)
+
+
+@storage.on_update
+def _replace(uid: int, sub: str, pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+             before: tuple) -> None:
+    """Записи без строк во frame (сон до разбора) дополняются как новые; иначе — пересборка."""
+    if sub not in ("mood", "dreams"):
+        return
+    if frame.rows(sub, [old for old, _ in pairs]).empty:
+        _update(uid, sub, [new for _, new in pairs], before)
+
+
+# ─────────────── публичный API ─────────────────────────────
+def level(uid: int, lvl: str = "D",
+          start: Optional[pd.Timestamp] = None,
+          end: Optional[pd.Timestamp] = None,
+          params: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Агрегаты уровня lvl ("D", "W", "M") за [start, end): столбцы
+    (параметр, mean|count|min|max) и (_rows, count). params сужает набор.
+    """
+    agg = _levels(uid)[lvl]
+    if agg.empty:
+        return agg
+    if start is not None:
+        agg = agg[agg.index >= start]
+    if end is not None:
+        agg = agg[agg.index < end]
+    have = [p for p in agg.columns.get_level_values(0).unique() if p != ROWS]
+    params = have if params is None else [p for p in params if p in have]
+    out = {}
+    for p in params:
+        count = agg[(p, "count")]
+        out[(p, "mean")] = agg[(p, "sum")] / count.where(count > 0, np.nan)
+        out[(p, "count")] = count
+        out[(p, "min")] = agg[(p, "min")]
+        out[(p, "max")] = agg[(p, "max")]
+    out[(ROWS, "count")] = agg[(ROWS, "count")]
+    return pd.DataFrame(out, index=agg.index)
+
+
+def columns(uid: int) -> List[str]:
+    """Parameters available in the pyramid."""
+    day = _levels(uid)["D"]
+    if day.empty:
+        return []
+    return [p for p in day.columns.get_level_values(0).unique() if p != ROWS]
+
+
+def last_day(uid: int) -> Optional[pd.Timestamp]:
+    day = _levels(uid)["D"]
+    return None if day.empty else day.index.max()
@@ -0,0 +1,165 @@
+# analysis/render_service.py
+# ───────────────────────────────────────────────────────────
+# Рендер графиков в отдельных процессах: matplotlib + pandas занимают
+# сотни миллисекунд CPU, и в корутине это замораживало бы бота для всех.
+# Пул процессов (RENDER_WORKERS) рисует параллельно на нескольких ядрах,
+# а очередь ограничена RENDER_QUEUE заданиями сверх числа процессов.
+# Память у процессов своя: frame, пирамиду агрегатов, спектры и корреляции
+# они читают из data/<uid>/.cache, куда их кладут подписчики storage.on_save
+# в процессе бота и сами процессы рендера.
+# Те же чистые функции (render_multi, render_fft → PNG в байтах) доступны
+# из командной строки через обёртки plot_multi/save_fft:
+#
+#     python -m analysis.render_service graph <uid> <out.png> mood energy --period month
+#     python -m analysis.render_service fft <uid> <param> <out.png>
+import argparse, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from analysis import chart_cache
+from config import RENDER_QUEUE, RENDER_WORKERS
+from utils import aio_storage
+
+
+class RenderBusy(Exception):
+    """Очередь рендера заполнена — запрос стоит повторить позже."""
+
+
+class RenderService:
+    def __init__(self, workers: int = RENDER_WORKERS, queue: int = RENDER_QUEUE) -> None:
+        self.workers = max(1, workers)
+        self.limit = self.workers + max(0, queue)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: дочерние процессы не наследуют event loop и потоки бота
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def render(self, uid: int, fn: Callable, *args) -> Any:
+        """Run fn(*args) in a worker process once uid's pending writes are on disk.
+
+        Cancelling the caller does not stop a render already handed to a worker:
+        its slot stays taken until the worker really finishes.
+        """
+        if self._inflight >= self.limit:
+            raise RenderBusy()
+        self._inflight += 1
+        try:
+            await aio_storage.settled(uid)
+            fut = asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        except BaseException:
+            self._inflight -= 1
+            raise
+        fut.add_done_callback(self._release)
+        return await asyncio.shield(fut)
+
+    def _release(self, fut: asyncio.Future) -> None:
+        self._inflight -= 1
+        if not fut.cancelled():
+            fut.exception()              # ошибка брошенного рендера не «теряется» в логе
+
+    def idle(self) -> int:
+        """How many worker processes are free right now."""
+        return max(0, self.workers - self._inflight)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+_service = RenderService()
+
+
+async def render(uid: int, fn: Callable, *args) -> Any:
+    return await _service.render(uid, fn, *args)
+
+
+async def chart_key(uid: int, kind: str, args: tuple) -> chart_cache.Key:
+    """chart_cache key of the chart over uid's data as of all queued writes."""
+    return await aio_storage.call(uid, chart_cache.key, uid, kind, args)
+
+
+# рендеры, ещё не положенные в chart_cache: ключ → задача «нарисовать и сохранить»
+_filling: Dict[chart_cache.Key, asyncio.Task] = {}
+
+
+async def _fill(uid: int, key: chart_cache.Key, fn: Callable, args: tuple) -> Optional[bytes]:
+    try:
+        data = await render(uid, fn, uid, *args)
+        if data is not None:
+            await aio_storage.run_io(chart_cache.put, key, data)
+        return data
+    finally:
+        _filling.pop(key, None)
+
+
+async def chart(uid: int, kind: str, fn: Callable, *args,
+                key: Optional[chart_cache.Key] = None) -> Optional[bytes]:
+    """PNG from chart_cache, or fn(uid, *args) rendered in the pool and cached.
+
+    The render and the cache write go on if the caller is cancelled, and a
+    second request for the same key waits for the render already running.
+    """
+    if key is None:
+        key = await chart_key(uid, kind, args)
+    data = await aio_storage.run_io(chart_cache.get, key)
+    if data is not None:
+        return data
+    task = _filling.get(key)
+    if task is None:
+        task = _filling[key] = asyncio.ensure_future(_fill(uid, key, fn, args))
+        task.add_done_callback(_retrieve)
+    return await asyncio.shield(task)
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()                 # все ждавшие могли уйти — не ругаться в лог
+
+
+def idle() -> int:
+    return _service.idle()
+
+
+def shutdown() -> None:
+    _service.shutdown()
+
+
+# ─────────────── CLI ───────────────────────────────────────
+def main(argv=None) -> None:
+    from analysis.fourier import save_fft
+    from analysis.generate_plot import plot_multi
+
+    parser = argparse.ArgumentParser(description="Построить график без бота")
+    cmds = parser.add_subparsers(dest="cmd", required=True)
+
+    p = cmds.add_parser("graph", help="график параметров (emo_<эмоция> — для CIM)")
+    p.add_argument("uid", type=int)
+    p.add_argument("out")
+    p.add_argument("params", nargs="+")
+    p.add_argument("--period", default="all", choices=["all", "year", "month", "week"])
+    p.add_argument("--page", type=int, default=0)
+
+    p = cmds.add_parser("fft", help="спектр параметра")
+    p.add_argument("uid", type=int)
+    p.add_argument("param")
+    p.add_argument("out")
+    p.add_argument("--mode", default="fft", choices=["fft", "ls"])
+
+    args = parser.parse_args(argv)
+    if args.cmd == "graph":
+        res = plot_multi(args.uid, args.params, args.period, args.out, args.page)
+    else:
+        res = save_fft(args.uid, args.param, args.out, args.mode)
+    print(res or "Нет данных.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# analysis/spectral.py
+# ───────────────────────────────────────────────────────────
+# Спектры всех параметров пользователя за один проход. Источник — дневные
+# средние из пирамиды (analysis/pyramid.py): одна матрица «день × параметр»
+# вместо отдельной загрузки frame на каждый параметр.
+#   fft — каждый ряд берётся от своего первого до последнего дня с данными,
+#         пропуски внутри заполняются линейно; ряды с одинаковым отрезком —
+#         один np.fft.rfft по матрице (axis=0);
+#   ls  — периодограмма Ломба–Скаргла только по дням с данными, без
+#         интерполяции: честнее при редких чек-инах.
+# Результат кэшируется по (uid, режим) до смены storage.data_version() — в
+# памяти процесса и в data/<uid>/.cache/spectra_<режим>.pkl, общем для всех
+# процессов рендера.
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks, lombscargle
+
+from analysis import pyramid
+from utils import storage
+
+MODES = ("fft", "ls")
+MIN_DAYS = 8                          # меньше — спектр бессмысленен
+SPECTRA_VERSION = 2
+
+Spectrum = Tuple[np.ndarray, np.ndarray]          # (частота, 1/день; мощность)
+
+_cache: Dict[Tuple[int, str], Tuple[str, Dict[str, Spectrum]]] = {}
+_lock = threading.Lock()
+
+
+def _daily(uid: int) -> pd.DataFrame:
+    """Дневные средние всех параметров (кроме emo_*): индекс — дни с записями."""
+    params = [p for p in pyramid.columns(uid) if not p.startswith("emo_")]
+    if not params:
+        return pd.DataFrame()
+    day = pyramid.level(uid, "D", params=params)
+    return day[[(p, "mean") for p in params]].set_axis(params, axis=1)
+
+
+def _fft(daily: pd.DataFrame) -> Dict[str, Spectrum]:
+    # отрезок ряда → его параметры: параметр, который ведут не всю историю
+    # (свои параметры, cim_score), не дополняется нулями до общего отрезка
+    spans: Dict[Tuple[pd.Timestamp, pd.Timestamp], List[str]] = {}
+    for p in daily.columns:
+        seen = daily.index[daily[p].notna()]
+        spans.setdefault((seen.min(), seen.max()), []).append(p)
+    out = {}
+    for (first, last), params in spans.items():
+        block = daily.loc[first:last, params]
+        days = pd.date_range(first, last, freq="D")
+        values = block.reindex(days).interpolate(limit_area="inside").to_numpy(dtype=float)
+        amp = np.abs(np.fft.rfft(values - block.mean().to_numpy(dtype=float), axis=0))
+        freq = np.fft.rfftfreq(len(days), d=1)
+        out.update({p: (freq[1:], amp[1:, j]) for j, p in enumerate(params)})
+    return out
+
+
+def _ls(daily: pd.DataFrame) -> Dict[str, Spectrum]:
+    t = ((daily.index - daily.index.min()) / pd.Timedelta(days=1)).to_numpy(dtype=float)
+    span = int(t[-1]) + 1
+    freq = np.arange(1, span // 2 + 1) / span           # та же сетка, что у rfftfreq
+    omega = 2 * np.pi * freq
+    out = {}
+    for p in daily.columns:
+        col = daily[p].to_numpy(dtype=float)
+        ok = ~np.isnan(col)
+        if ok.sum() < MIN_DAYS:
+            continue
+        y = col[ok] - col[ok].mean()
+        out[p] = (freq, lombscargle(t[ok], y, omega))
+    return out
+
+
+def _compute(uid: int, mode: str) -> Dict[str, Spectrum]:
+    daily = _daily(uid)
+    if daily.empty or len(daily) < 2:
+        return {}
+    span = (daily.index.max() - daily.index.min()).days + 1
+    if span < MIN_DAYS:
+        return {}
+    daily = daily.loc[:, daily.notna().sum() >= 2]
+    return _ls(daily) if mode == "ls" else _fft(daily)
+
+
+# ─────────────── публичный API ─────────────────────────────
+def spectra(uid: int, mode: str = "fft") -> Dict[str, Spectrum]:
+    """Spectra of all of a user's parameters: param → (frequency, power)."""
+    if mode not in MODES:
+        raise ValueError(f"unknown spectral mode: {mode}")
+    version = storage.data_version(uid)
+    with _lock:
+        hit = _cache.get((uid, mode))
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    result = storage.load_cache(uid, f"spectra_{mode}", (SPECTRA_VERSION, version))
+    if result is None:
+        result = _compute(uid, mode)
+        storage.store_cache(uid, f"spectra_{mode}", (SPECTRA_VERSION, version), result)
+    with _lock:
+        _cache[(uid, mode)] = (version, result)
+    return result
+
+
+def spectrum(uid: int, param: str, mode: str = "fft") -> Optional[Spectrum]:
+    return spectra(uid, mode).get(param)
+
+
+def dominant(spec: Spectrum, k: int = 3) -> List[Tuple[float, float]]:
+    """Up to k strongest spectral peaks as (period in days, power)."""
+    freq, power = spec
+    peaks, _ = find_peaks(power)
+    if not len(peaks):
+        peaks = np.arange(len(power))
+    top = peaks[np.argsort(power[peaks])[::-1][:k]]
+    return [(1 / freq[i], float(power[i])) for i in top if freq[i] > 0]
+
+
+def period_label(T: float) -> str:
+    if T <= 90:
+        return f"{round(T)} дн"
+    if T <= 365 * 3:
+        return f"{round(T / 30)} мес"
+    return f"{round(T / 365, 1)} лет"
+
+
+# ─────────────── спектрограмма ─────────────────────────────
+# Скользящее окно SG_WINDOW дней с шагом SG_STEP: все окна — одна матрица
+# (sliding_window_view) и один rfft по строкам. Состояние хранится в
+# data/<uid>/.cache/spectrogram/<параметр>.pkl; при новых днях пересчитываются
+# только окна, задевающие изменившийся хвост ряда, а не вся история.
+SG_WINDOW = 90
+SG_STEP = 7
+SG_MIN_COVERAGE = 0.5               # доля дней с записями, иначе окно пустое
+SG_VERSION = 1
+
+Spectrogram = Tuple[pd.DatetimeIndex, np.ndarray, np.ndarray]   # (центры окон, периоды, мощность)
+
+
+def _series(uid: int, param: str) -> Optional[Tuple[pd.Timestamp, np.ndarray, np.ndarray]]:
+    """Ежедневный ряд param: (первый день, значения с интерполяцией, маска дней с данными)."""
+    if param not in pyramid.columns(uid):
+        return None
+    day = pyramid.level(uid, "D", params=[param])[(param, "mean")].dropna()
+    if day.empty:
+        return None
+    days = pd.date_range(day.index.min(), day.index.max(), freq="D")
+    full = day.reindex(days)
+    observed = full.notna().to_numpy()
+    values = full.interpolate(limit_area="inside").to_numpy(dtype=float)
+    return days[0], values, observed
+
+
+def _window_power(values: np.ndarray, observed: np.ndarray, first: int) -> np.ndarray:
+    """Мощность окон, начинающихся с индекса first (кратного SG_STEP)."""
+    win = np.lib.stride_tricks.sliding_window_view(values[first:], SG_WINDOW)[::SG_STEP]
+    cover = np.lib.stride_tricks.sliding_window_view(observed[first:], SG_WINDOW)[::SG_STEP]
+    if not len(win):
+        return np.empty((0, SG_WINDOW // 2))
+    win = (win - win.mean(axis=1, keepdims=True)) * np.hanning(SG_WINDOW)
+    power = np.abs(np.fft.rfft(win, axis=1)[:, 1:]) ** 2
+    power[cover.mean(axis=1) < SG_MIN_COVERAGE] = np.nan
+    return power
+
+
+def _first_change(old: dict, start: pd.Timestamp, values: np.ndarray, observed: np.ndarray) -> int:
+    """Первый день, с которого ряд отличается от сохранённого."""
+    if old.get("start") != start:
+        return 0
+    n = min(len(old["values"]), len(values))
+    same = (old["observed"][:n] == observed[:n]) & np.isclose(
+        old["values"][:n], values[:n], equal_nan=True)
+    diff = np.flatnonzero(~same)
+    return int(diff[0]) if len(diff) else n
+
+
+def _sg_name(param: str) -> str:
+    return f"spectrogram/{param}"
+
+
+def spectrogram(uid: int, param: str) -> Optional[Spectrogram]:
+    """Sliding-window spectrogram of param, updated incrementally from the cached state."""
+    version = storage.data_version(uid)
+    state = storage.load_cache(uid, _sg_name(param), SG_VERSION) or {}
+    if state.get("version") != version:
+        series = _series(uid, param)
+        if series is None or len(series[1]) < SG_WINDOW:
+            return None
+        start, values, observed = series
+        first = _first_change(state, start, values, observed) if state else 0
+        keep = max(0, (first - SG_WINDOW) // SG_STEP + 1) if first >= SG_WINDOW else 0
+        old = state.get("power", np.empty((0, SG_WINDOW // 2)))
+        keep = min(keep, len(old))
+        old = old[:keep]
+        power = np.vstack([old, _window_power(values, observed, keep * SG_STEP)])
+        state = {"version": version, "start": start, "values": values,
+                 "observed": observed, "power": power}
+        storage.store_cache(uid, _sg_name(param), SG_VERSION, state)
+    power = state["power"]
+    centres = state["start"] + pd.to_timedelta(
+        np.arange(len(power)) * SG_STEP + SG_WINDOW // 2, unit="D")
+    periods = SG_WINDOW / np.arange(1, SG_WINDOW // 2 + 1)
+    return centres, periods, power
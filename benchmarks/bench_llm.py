@@ -0,0 +1,68 @@
+"""
+Новый AsyncOpenAI на каждый сон (как было в dreams.analyze) против общего
+клиента utils.llm — на локальной заглушке benchmarks/stub_llm.py.
+
+    python benchmarks/bench_llm.py [запросов] [параллельно] [задержка заглушки, с]
+"""
+import asyncio, pathlib, sys, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import config
+from benchmarks import stub_llm
+
+
+async def fresh_client(base_url: str, text: str) -> str:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key="local", base_url=base_url)
+    try:
+        resp = await client.chat.completions.create(
+            model="stub", messages=[{"role": "user", "content": text}])
+    finally:
+        await client.close()     # старый код пул не закрывал — здесь хотя бы без утечки
+    return resp.choices[0].message.content
+
+
+async def run(call, n: int, parallel: int) -> float:
+    sem = asyncio.Semaphore(parallel)
+
+    async def one(i: int):
+        async with sem:
+            await call(f"сон {i}")
+
+    t = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - t
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    parallel = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    server = stub_llm.start(latency=latency)
+    config.LLM_BASE_URL = server.base_url
+    from utils import llm
+
+    async def shared(text: str) -> str:
+        return await llm.chat([{"role": "user", "content": text}], model="stub")
+
+    async def bench():
+        before = server.connections
+        t_old = await run(lambda t: fresh_client(server.base_url, t), n, parallel)
+        c_old, before = server.connections - before, server.connections
+        t_new = await run(shared, n, parallel)
+        c_new = server.connections - before
+        await llm.close()
+        return t_old, c_old, t_new, c_new
+
+    t_old, c_old, t_new, c_new = asyncio.run(bench())
+    st = llm.stats()["latency"]
+    print(f"запросов: {n}, параллельно: {parallel}, задержка заглушки: {latency} с")
+    print(f"клиент на вызов: {t_old * 1000:8.1f} мс, соединений: {c_old}")
+    print(f"общий клиент:    {t_new * 1000:8.1f} мс, соединений: {c_new}")
+    print(f"задержка общего клиента: среднее {st['mean'] * 1000:.1f} мс, p95 ≤ {st['p95']} с")
+
+
+if __name__ == "__main__":
+    main()
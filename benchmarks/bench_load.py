@@ -0,0 +1,106 @@
+"""
+Сравнение построчной сборки DataFrame (старый _load) с колоночной
+(analysis.frame.from_records) на многолетнем наборе debug_generator.
+
+    python benchmarks/bench_load.py [лет] [повторов]
+"""
+import datetime, pathlib, sys, tempfile, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import config
+_tmp = tempfile.TemporaryDirectory(prefix="bench_load_")      # удаляется в main()
+config.BASE_DIR = pathlib.Path(_tmp.name)
+
+import pandas as pd
+
+import debug_generator
+from analysis.frame import from_records
+from utils.storage import load_records
+
+
+def legacy_frame(mood, dreams) -> pd.DataFrame:
+    """Построчная сборка, как в _load до перехода на колоночную."""
+    rows = []
+    for rec in mood:
+        rec = dict(rec)
+        date_str = rec.get("date")
+        if not date_str:
+            continue
+        try:
+            rec_date = datetime.date.fromisoformat(str(date_str))
+        except ValueError:
+            try:
+                rec_date = datetime.datetime.strptime(str(date_str)[:8], "%Y%m%d").date()
+            except ValueError:
+                continue
+        rec["date"] = rec_date
+        rows.append(rec)
+    df = pd.DataFrame(rows)
+
+    dream_rows = []
+    for rec in dreams:
+        date = rec.get("date")
+        metrics = rec.get("metrics") or {}
+        if not date or not metrics:
+            continue
+        row = {"date": pd.to_datetime(date)}
+        if "cim_score" in metrics:
+            row["cim_score"] = metrics["cim_score"]
+        if "intensity" in metrics:
+            row["intensity"] = metrics["intensity"]
+        if "emotions" in metrics:
+            for emo in metrics["emotions"]:
+                row.setdefault(f"emo_{emo}", metrics.get("intensity", 1))
+        dream_rows.append(row)
+
+    df_dream = pd.DataFrame(dream_rows)
+    if not df.empty and "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+    if not df_dream.empty:
+        df = pd.concat([df, df_dream], ignore_index=True, sort=False)
+    return df
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def run() -> None:
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    uid = 1
+    debug_generator.gen(uid, days=365 * years)
+    mood, dreams = load_records(uid, "mood"), load_records(uid, "dreams")
+
+    old, new = legacy_frame(mood, dreams), from_records(mood, dreams)
+    cols = sorted(old.columns)
+    key = ["date", "mood"]
+    same = (
+        sorted(new.columns) == cols
+        and old[cols].sort_values(key).reset_index(drop=True)
+        .equals(new[cols].sort_values(key).reset_index(drop=True))
+    )
+
+    t_old = best_of(lambda: legacy_frame(mood, dreams), repeat)
+    t_new = best_of(lambda: from_records(mood, dreams), repeat)
+    print(f"записей: {len(mood)} чек-инов, {len(dreams)} снов ({years} лет)")
+    print(f"построчно:   {t_old * 1000:8.1f} мс")
+    print(f"по колонкам: {t_new * 1000:8.1f} мс")
+    print(f"ускорение:   {t_old / t_new:8.1f}×   (результат совпадает: {same})")
+
+
+def main() -> None:
+    try:
+        run()
+    finally:
+        _tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
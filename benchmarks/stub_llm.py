@@ -0,0 +1,166 @@
+"""
+Локальная заглушка OpenAI chat completions для тестов и бенчмарков: отвечает
+«анализом» с корректной строкой METRICS, умеет SSE-стриминг (stream=true),
+искусственную задержку и случайные 500/429 для проверки повторов.
+
+    python benchmarks/stub_llm.py [--port 8089] [--latency 0.5] [--ttft 0.2] [--error-rate 0]
+    LLM_BASE_URL=http://127.0.0.1:8089/v1 python bot.py
+
+GET /stats возвращает число запросов и принятых TCP-соединений — по нему
+видно, переиспользует ли клиент соединения.
+"""
+import argparse, hashlib, json, pathlib, random, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from config import CIM_EMOTIONS
+
+ANALYSIS = (
+    "Сон говорит о переходе: знакомые места сменяются незнакомыми, и сновидец "
+    "ищет опору. По Юнгу это встреча с Тенью — той частью себя, которую днём "
+    "не замечают. Образ воды указывает на бессознательное, дорога — на путь "
+    "индивидуации. "
+)
+
+
+def reply_for(text: str) -> Tuple[str, dict]:
+    """Deterministic analysis text and metrics for a dream text."""
+    h = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16)
+    emotions = [CIM_EMOTIONS[(h >> (8 * i)) % len(CIM_EMOTIONS)] for i in range(1 + h % 3)]
+    metrics = {"intensity": round(0.5 + (h % 6) / 2, 1), "emotions": sorted(set(emotions))}
+    body = ANALYSIS * (2 + h % 4)
+    return body + "\nMETRICS: " + json.dumps(metrics, ensure_ascii=False), metrics
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, addr, latency=0.0, ttft=0.0, chunk=40, error_rate=0.0):
+        super().__init__(addr, Handler)
+        self.latency, self.ttft, self.chunk, self.error_rate = latency, ttft, chunk, error_rate
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"          # keep-alive, чтобы пул клиента был заметен
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, code: int, payload: dict) -> None:
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            s = self.server
+            return self._json(200, {"requests": s.requests, "connections": s.connections})
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        s = self.server
+        with s.lock:
+            s.requests += 1
+        if s.error_rate and random.random() < s.error_rate:
+            return self._json(random.choice([429, 500]), {"error": {"message": "stub error"}})
+
+        user = next((m["content"] for m in reversed(body.get("messages", []))
+                     if m.get("role") == "user"), "")
+        text, _ = reply_for(user)
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 for m in body.get("messages", [])),
+                 "completion_tokens": len(text) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "stub")
+        if body.get("stream"):
+            return self._stream(text, model, usage, (body.get("stream_options") or {}).get("include_usage"))
+
+        time.sleep(s.latency)
+        self._json(200, {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+            "model": model, "usage": usage,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+        })
+
+    def _stream(self, text: str, model: str, usage: dict, include_usage: bool) -> None:
+        s = self.server
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload) -> None:
+            data = b"data: " + (payload if isinstance(payload, bytes)
+                                else json.dumps(payload, ensure_ascii=False).encode("utf-8")) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def chunk(delta: dict, finish=None) -> dict:
+            return {"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        time.sleep(s.ttft)
+        pieces = [text[i:i + s.chunk] for i in range(0, len(text), s.chunk)]
+        pause = max(s.latency - s.ttft, 0) / max(len(pieces), 1)
+        event(chunk({"role": "assistant", "content": ""}))
+        for piece in pieces:
+            event(chunk({"content": piece}))
+            time.sleep(pause)
+        event(chunk({}, "stop"))
+        if include_usage:
+            event({"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                   "created": int(time.time()), "model": model, "choices": [], "usage": usage})
+        event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start(port: int = 0, **opts) -> StubServer:
+    """Start the stub in a daemon thread; its URL is server.base_url."""
+    server = StubServer(("127.0.0.1", port), **opts)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.5, help="полное время ответа, с")
+    ap.add_argument("--ttft", type=float, default=0.2, help="время до первого фрагмента при стриминге, с")
+    ap.add_argument("--chunk", type=int, default=40, help="символов во фрагменте стрима")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/500")
+    args = ap.parse_args()
+    server = StubServer(("127.0.0.1", args.port), latency=args.latency, ttft=args.ttft,
+                        chunk=args.chunk, error_rate=args.error_rate)
+    print(f"stub LLM on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,16 @@ from aiogram.types import Message, BotCommand
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from Token import API_TOKEN, AUTHORIZED_USER_IDS
 from config import load_user_times, save_user_times
-from handlers import dreams, mood, manage, missed, view_dreams
+from handlers import backfill, dreams, mood, manage, missed, view_dreams
+from utils import aio_storage, llm
+from analysis import render_service
 logging.basicConfig(level=logging.INFO)
 bot=Bot(API_TOKEN, parse_mode='HTML')
 dp=Dispatcher()
 
 # порядок подключения ВАЖЕН:
 dp.include_router(dreams.router)
+dp.include_router(backfill.router)    # до mood: его обработчик ловит любые сообщения
 dp.include_router(mood.router)
 dp.include_router(manage.router)
 dp.include_router(missed.router)
@@ -40,7 +43,7 @@ async def evening(uid:int):
     await bot.send_message(uid,"Вечерний чек‑ин.")
     await mood.start(bot, uid)
 async def plan(uid: int):
-    m, e = load_user_times(uid)
+    m, e = await aio_storage.run_io(load_user_times, uid)
     sched.add_job(
         morning,
         "cron",
@@ -79,7 +82,7 @@ async def cmd_set(msg: Message):
     parts=msg.text.split()
     if len(parts)!=3:
         await msg.reply("/set HH:MM HH:MM"); return
-    save_user_times(msg.from_user.id, parts[1], parts[2])
+    await aio_storage.run_io(save_user_times, msg.from_user.id, parts[1], parts[2])
     await plan(msg.from_user.id)
     await msg.reply("Установлено")
 
@@ -87,6 +90,15 @@ async def main():
     for uid in AUTHORIZED_USER_IDS: await plan(uid)
     await setup_commands()
     sched.start()
-    await dp.start_polling(bot)
+    resumed = await dreams.start_analysis(bot)
+    if resumed:
+        logging.info("очередь разбора снов: продолжаем %d заданий", resumed)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await dreams.stop_analysis()   # недоделанные разборы останутся в data/.jobs/
+        await aio_storage.shutdown()   # дописываем очередь записи на диск
+        render_service.shutdown()
+        await llm.close()
 if __name__=='__main__':
     asyncio.run(main())
@@ -1,8 +1,28 @@
-import os, json
+import os, json, threading
 from datetime import time
 from pathlib import Path
 BASE_DIR = Path(__file__).with_suffix('').parent / "data"
 BASE_DIR.mkdir(exist_ok=True)
+# хранилище записей: "files" (JSONL-сегменты в data/<id>/) или "sqlite"
+STORAGE_BACKEND=os.getenv("STORAGE_BACKEND", "files")
+SQLITE_PATH=BASE_DIR/"bipolarbot.sqlite3"
+# рендер графиков: число процессов и сколько заданий может ждать в очереди
+RENDER_WORKERS=int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE=int(os.getenv("RENDER_QUEUE", "8"))
+# сколько соседних страниц графика дорисовывать заранее на свободных процессах
+PREFETCH_PAGES=int(os.getenv("PREFETCH_PAGES", "2"))
+# анализ снов: модель, адрес API (пусто — OpenAI; можно указать локальную заглушку),
+# таймаут запроса в секундах и число повторов с экспоненциальной паузой
+LLM_MODEL=os.getenv("LLM_MODEL", "gpt-4o")
+LLM_BASE_URL=os.getenv("LLM_BASE_URL") or None
+LLM_TIMEOUT=float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT=float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_RETRIES=int(os.getenv("LLM_RETRIES", "3"))
+# очередь разбора снов: сколько запросов к модели одновременно и не чаще скольких в минуту
+ANALYSIS_WORKERS=int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_RATE=float(os.getenv("ANALYSIS_RATE", "20"))
+# кому доступны служебные команды бота (/backfill), через запятую
+ADMIN_IDS=[int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 DEFAULT_MORNING=time(8,0)
 DEFAULT_EVENING=time(21,0)
 PARAMETERS=[
@@ -56,6 +76,9 @@ def _set_path(uid:int) -> Path:
     return BASE_DIR/str(uid)/"settings.json"
 
 def _load_settings(uid:int) -> dict:
+    if STORAGE_BACKEND=="sqlite":
+        from utils import sqlite_store
+        return sqlite_store.load_settings(uid)
     p=_set_path(uid)
     if p.exists():
         try:
@@ -65,9 +88,16 @@ def _load_settings(uid:int) -> dict:
     return {}
 
 def _save_settings(uid:int, data:dict):
+    if STORAGE_BACKEND=="sqlite":
+        from utils import sqlite_store
+        sqlite_store.save_settings(uid, data)
+        return
     p=_set_path(uid)
     p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, ensure_ascii=False))
+    # атомарно: временный файл + rename; pid/поток — чтобы писатели не мешали друг другу
+    tmp=p.with_name(f".{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False))
+    os.replace(tmp,p)
 def load_user_times(uid:int):
     d=_load_settings(uid)
     mt=list(map(int,d.get("morning","08:00").split(":")))
@@ -0,0 +1,228 @@
+# handlers/backfill.py
+# ───────────────────────────────────────────────────────────
+# Дозаполнение метрик старых снов. Сны с текстом, но без metrics (ошибка
+# OpenAI, запись без ключа, прерванный разбор) не попадают ни в графики
+# CIM, ни в счётчики эмоций. run() находит их у всех пользователей и
+# прогоняет через тот же разбор, что и новые сны: не больше `workers`
+# запросов одновременно, не чаще `rate` в минуту. Результаты дописываются в
+# записи пачками по FLUSH_EVERY через storage.update_records; подписчики
+# on_update (frame, пирамида, счётчики эмоций) добавляют метрики пачки как
+# дельту, без пересборки по всей истории.
+#
+# Возобновление после сбоя: заполненные записи при следующем запуске уже
+# не находятся, а ответы из незаписанной пачки лежат в кэше разборов и
+# повторно не оплачиваются. Сны, разбор которых не дал метрик, считаются в
+# data/.jobs/backfill.json и после MAX_FAILURES попыток пропускаются.
+# Ошибка самого запроса (сеть, сбой API) неудачей сна не считается — сон
+# просто ждёт следующего запуска; без ключа модели (LLMUnavailable) запуск
+# прерывается сразу.
+#
+#     python maintenance.py backfill [id…]       (при остановленном боте)
+#     /backfill                                  (в боте, для ADMIN_IDS)
+import asyncio, dataclasses, hashlib, json, logging, os, threading, time, uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Router, types
+from aiogram.filters import Command
+
+from config import ADMIN_IDS, ANALYSIS_RATE, ANALYSIS_WORKERS, BASE_DIR
+from handlers import dreams
+from utils import aio_storage, jobs, llm, storage
+from utils.live import LiveMessage
+
+router = Router()
+
+FLUSH_EVERY = 10
+MAX_FAILURES = 3
+
+log = logging.getLogger(__name__)
+_STATE = BASE_DIR / ".jobs" / "backfill.json"
+
+
+@dataclasses.dataclass
+class Progress:
+    total: int
+    done: int = 0
+    filled: int = 0
+    failed: int = 0
+    skipped: int = 0                  # пропущены после MAX_FAILURES неудач
+    errors: int = 0                   # запрос к модели не удался — повторятся в следующий раз
+    started: float = dataclasses.field(default_factory=time.monotonic)
+
+    def eta(self) -> Optional[float]:
+        """Seconds left at the current pace, or None before the first result."""
+        if not self.done:
+            return None
+        return (time.monotonic() - self.started) / self.done * (self.total - self.done)
+
+    def __str__(self) -> str:
+        line = f"{self.done}/{self.total}: заполнено {self.filled}, без метрик {self.failed}"
+        eta = self.eta()
+        if eta is not None and self.done < self.total:
+            line += f", осталось ~{int(eta // 60)} мин {int(eta % 60)} с"
+        if self.errors:
+            line += f", ошибок запроса {self.errors}"
+        if self.skipped:
+            line += f", пропущено после {MAX_FAILURES} неудач: {self.skipped}"
+        return line
+
+
+def _key(rec: Dict[str, Any]) -> str:
+    """Id записи; у старых записей без id — хэш текста сна."""
+    if rec.get("id"):
+        return rec["id"]
+    return "t:" + hashlib.sha1((rec.get("dream") or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _needs_metrics(rec: Dict[str, Any]) -> bool:
+    text = (rec.get("dream") or "").strip()
+    return bool(text) and text not in dreams.LABELS.values() and not rec.get("metrics")
+
+
+def missing(uid: int, skip: Optional[set] = None) -> List[Dict[str, Any]]:
+    """Dream records of a user with text but no metrics (excluding keys in skip)."""
+    skip = skip or set()
+    seen, out = set(), []
+    for rec in storage.load_records(uid, "dreams"):
+        k = _key(rec)
+        if _needs_metrics(rec) and k not in skip and k not in seen:
+            seen.add(k)
+            out.append(rec)
+    return out
+
+
+def _read_state() -> Dict[str, Any]:
+    try:
+        state = json.loads(_STATE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault("failed", {})
+    return state
+
+
+def _write_state(text: str) -> None:
+    _STATE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _STATE.with_name(f".{_STATE.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, _STATE)
+
+
+def _fill(batch: Dict[str, Tuple[str, dict]]) -> storage.RecordUpdate:
+    def fn(rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        hit = batch.get(_key(rec))
+        if hit is None or not _needs_metrics(rec):
+            return None
+        analysis, metrics = hit
+        return dict(rec, id=rec.get("id") or uuid.uuid4().hex[:12], analysis=analysis, metrics=metrics)
+    return fn
+
+
+async def run(uids: Optional[List[int]] = None,
+              workers: int = ANALYSIS_WORKERS,
+              rate: float = ANALYSIS_RATE,
+              progress: Optional[Callable[[Progress], Awaitable[None]]] = None,
+              retry_failed: bool = False) -> Progress:
+    """Analyse all dreams without metrics and write the results into their records."""
+    state = await aio_storage.run_io(_read_state)
+    failed: Dict[str, int] = state["failed"]
+    queued = {j.get("record") for j in await aio_storage.run_io(dreams.analysis_queue.stored)}
+
+    todo: List[Tuple[int, Dict[str, Any]]] = []
+    skipped = 0
+    for uid in uids or await aio_storage.run_io(storage.user_ids):
+        for r in await aio_storage.call(uid, missing, uid, queued):
+            if retry_failed or failed.get(f"{uid}:{_key(r)}", 0) < MAX_FAILURES:
+                todo.append((uid, r))
+            else:
+                skipped += 1
+
+    p = Progress(total=len(todo), skipped=skipped)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in todo:
+        queue.put_nowait(item)
+    limiter = jobs.RateLimiter(rate)
+    results: Dict[int, Dict[str, Tuple[str, dict]]] = {}
+
+    async def flush(uid: int) -> None:
+        batch = results.pop(uid, None)
+        if batch:
+            await aio_storage.update_records(uid, "dreams", _fill(batch))
+
+    async def save_state() -> None:
+        await aio_storage.run_io(_write_state, json.dumps(state, ensure_ascii=False))
+
+    async def worker() -> None:
+        while not queue.empty():
+            uid, rec = queue.get_nowait()
+            text, k = rec["dream"], _key(rec)
+            raw = await aio_storage.run_io(dreams._cached, uid, text)
+            if raw is None:
+                await limiter.wait()
+                try:
+                    raw = await dreams.analyze(text)
+                except llm.LLMUnavailable:
+                    raise                     # без ключа не выйдет ни один сон
+                except Exception:
+                    log.exception("backfill: разбор сна %s пользователя %s не удался", k, uid)
+                    raw = None
+                else:
+                    await aio_storage.run_io(dreams._remember, uid, text, raw)
+            analysis, metrics = dreams._parse(raw) if raw is not None else ("", {})
+            if raw is None:
+                p.errors += 1
+            elif metrics:
+                p.filled += 1
+                results.setdefault(uid, {})[k] = (analysis, metrics)
+                if failed.pop(f"{uid}:{k}", None) is not None:
+                    await save_state()
+                if len(results[uid]) >= FLUSH_EVERY:
+                    await flush(uid)
+            else:
+                p.failed += 1
+                failed[f"{uid}:{k}"] = failed.get(f"{uid}:{k}", 0) + 1
+                await save_state()
+            p.done += 1
+            if progress:
+                await progress(p)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:                       # прерванный запуск останавливает и остальных
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for uid in list(results):
+            await flush(uid)
+    return p
+
+
+# ───── команда /backfill ───────────────────────────────────
+_task: Optional[asyncio.Task] = None
+
+
+@router.message(Command("backfill"))
+async def cmd_backfill(msg: types.Message):
+    global _task
+    if msg.from_user.id not in ADMIN_IDS:
+        return
+    if _task is not None and not _task.done():
+        await msg.reply("Дозаполнение уже идёт.")
+        return
+    live = LiveMessage(msg.bot, msg.chat.id)
+    await live.start("Ищу сны без метрик…")
+
+    async def show(p: Progress) -> None:
+        if live.due():
+            await live.update(f"Дозаполняю метрики снов\n{p}")
+
+    async def job() -> None:
+        try:
+            p = await run(progress=show)
+            await live.finish(f"Готово. {p}" if p.total or p.skipped
+                              else "Сны без метрик не найдены.")
+        except Exception as e:
+            await live.finish(f"Дозаполнение прервано: {e}")
+            raise
+
+    _task = asyncio.create_task(job())
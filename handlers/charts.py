@@ -0,0 +1,147 @@
+# handlers/charts.py
+# ───────────────────────────────────────────────────────────
+# Отправка графиков в Telegram. Уже загруженную картинку (та же версия
+# данных, те же параметры) пересылаем по file_id — без рендера и без
+# повторной загрузки PNG; новую рисуем через render_service и запоминаем
+# file_id, который вернул send_photo.
+#
+# После показа страницы пейджера соседние страницы (сначала более старая,
+# под «⬅️») дорисовываются в кэш, пока у пула есть свободные
+# процессы: не больше PREFETCH_PAGES на пользователя, по одной за раз.
+# Уход из пейджера или новый показ того же вида отменяет недоделанное.
+#
+# Частые нажатия «⬅️/➡️» схлопываются: prepare_latest() отменяет ожидание
+# ещё не готового рендера того же вида (uid, view), так что в чат уходит
+# только последнее состояние; отправка под delivering() идёт по очереди.
+# Уже начатый в процессе рендер при этом дорисовывается в кэш и держит своё
+# место в очереди рендера, пока процесс не освободится.
+import asyncio, logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from analysis import chart_cache, render_service
+from config import PREFETCH_PAGES
+from utils import aio_storage
+
+log = logging.getLogger(__name__)
+_prefetch: Dict[Tuple[int, str], asyncio.Task] = {}     # (uid, вид) → задача
+_latest: Dict[Tuple[int, str], asyncio.Task] = {}       # (uid, вид) → текущий рендер
+_delivery: Dict[Tuple[int, str], asyncio.Lock] = {}
+
+
+class Superseded(Exception):
+    """A newer request for the same view replaced this one."""
+
+
+@dataclass
+class Chart:
+    uid: int
+    key: chart_cache.Key
+    fn: Callable
+    args: tuple
+    file_id: Optional[str] = None
+    data: Optional[bytes] = None
+
+
+async def prepare(uid: int, kind: str, fn: Callable, *args) -> Optional[Chart]:
+    """Known file_id or freshly rendered PNG of a chart; None if there is no data.
+
+    Raises render_service.RenderBusy when the render queue is full.
+    """
+    key = await render_service.chart_key(uid, kind, args)
+    chart = Chart(uid, key, fn, args)
+    chart.file_id = await aio_storage.run_io(chart_cache.file_id, key)
+    if chart.file_id:
+        return chart
+    chart.data = await render_service.chart(uid, kind, fn, *args, key=key)
+    return chart if chart.data is not None else None
+
+
+async def prepare_latest(uid: int, view: str, kind: str, fn: Callable, *args) -> Optional[Chart]:
+    """prepare() that a newer call for the same (uid, view) cancels with Superseded."""
+    key = (uid, view)
+    prev = _latest.get(key)
+    if prev is not None:
+        prev.cancel()                   # отменяется ожидание; рендер в процессе доработает в кэш
+    task = asyncio.ensure_future(prepare(uid, kind, fn, *args))
+    _latest[key] = task
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if _latest.get(key) is not task:
+            raise Superseded()
+        raise
+    finally:
+        if _latest.get(key) is task:
+            del _latest[key]
+
+
+def pending(uid: int, view: str) -> bool:
+    """Is a newer render of this view still in progress?"""
+    return (uid, view) in _latest
+
+
+def delivering(uid: int, view: str) -> asyncio.Lock:
+    """Lock serialising delete/send of the messages of one view."""
+    return _delivery.setdefault((uid, view), asyncio.Lock())
+
+
+async def send(bot: Bot, chart: Chart, filename: str,
+               reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+               caption: Optional[str] = None) -> types.Message:
+    """Send a prepared chart and remember its file_id."""
+    uid = chart.uid
+    if chart.file_id:
+        try:
+            return await bot.send_photo(uid, chart.file_id, caption=caption,
+                                        reply_markup=reply_markup)
+        except TelegramBadRequest:            # file_id протух — загрузим заново
+            await aio_storage.run_io(chart_cache.remember_file_id, chart.key, None)
+            chart.data = await render_service.chart(uid, chart.key[1], chart.fn, *chart.args,
+                                                    key=chart.key)
+            if chart.data is None:            # данных для графика больше нет
+                return await bot.send_message(uid, "Нет данных.", reply_markup=reply_markup)
+    msg = await bot.send_photo(uid, BufferedInputFile(chart.data, filename), caption=caption,
+                               reply_markup=reply_markup)
+    if msg.photo:
+        await aio_storage.run_io(chart_cache.remember_file_id, chart.key, msg.photo[-1].file_id)
+    return msg
+
+
+# ─────────────── упреждающий рендер соседних страниц ───────
+def neighbours(page: int, pages: int) -> List[int]:
+    """Pages (of pages in total) to prefetch around page, most likely next tap first."""
+    out = []
+    for d in range(1, PREFETCH_PAGES + 1):
+        out += [p for p in (page + d, page - d) if 0 <= p < pages]
+    return out[:PREFETCH_PAGES]
+
+
+async def _run_prefetch(uid: int, kind: str, fn: Callable, todo: List[tuple]) -> None:
+    for args in todo:
+        if render_service.idle() <= 0:
+            return                      # пул занят настоящими запросами
+        try:
+            await render_service.chart(uid, kind, fn, *args)
+        except render_service.RenderBusy:
+            return
+        except Exception:
+            log.exception("prefetch %s for %s failed", kind, uid)
+            return
+
+
+def prefetch(uid: int, view: str, kind: str, fn: Callable, todo: List[tuple]) -> None:
+    """Render charts fn(uid, *args) for args in todo into the cache in the background."""
+    cancel_prefetch(uid, view)
+    if todo and PREFETCH_PAGES > 0:
+        _prefetch[(uid, view)] = asyncio.create_task(_run_prefetch(uid, kind, fn, todo))
+
+
+def cancel_prefetch(uid: int, view: Optional[str] = None) -> None:
+    """Stop background renders of one view (or all views) of a user."""
+    for k in [k for k in _prefetch if k[0] == uid and view in (None, k[1])]:
+        _prefetch.pop(k).cancel()
@@ -1,15 +1,15 @@
 # handlers/dreams.py
 # ───────────────────────────────────────────────────────────
-import asyncio, datetime, json, re
-from openai import AsyncOpenAI
-from typing import Optional
+import asyncio, datetime, json, re, uuid
+from typing import Awaitable, Callable, Optional, Tuple
 from aiogram import Router, types, Bot
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from Token import AUTHORIZED_USER_IDS
-from utils.storage import save_json
-from utils import send_long
+from config import ANALYSIS_RATE, ANALYSIS_WORKERS, CIM_EMOTIONS, EMOTION_COEFF, LLM_MODEL
+from utils import aio_storage, analysis_cache, jobs, llm, send_long
+from utils.live import LiveMessage
 
 router = Router()
 
@@ -77,90 +77,199 @@ async def _finish(uid: int, bot: Bot):
         pass
     text = "\n".join(info["msgs"]).strip()
     if text:
-        analysis, metrics = await _commit(uid, text, info["date"])
-        await send_long(
-            bot,
-            uid,
-            f"🌓 Анализ сна:\n{analysis}{_fmt_metrics(metrics)}",
-        )
+        ready = await _commit(uid, text, info["date"])
+        if ready:
+            await send_long(bot, uid, ready)
         from handlers.manage import main_kb
         await bot.send_message(uid, "Меню:", reply_markup=main_kb())
     else:
         payload = {"dream": "", "analysis": "", "metrics": {}, "date": info["date"]}
-        save_json(uid, "dreams", "dream", payload)
+        aio_storage.save_json(uid, "dreams", "dream", payload)
         await bot.send_message(uid, "Сон сохранён (пусто).")
         from handlers.manage import main_kb
         await bot.send_message(uid, "Меню:", reply_markup=main_kb())
 
 
 # ───── GPT-анализ ──────────────────────────────────────────
-async def analyze(text: str) -> str:
-    """Return GPT analysis with metrics line."""
-    try:
-        from Token import OPENAI_API_KEY
-        if not OPENAI_API_KEY:
-            raise Exception("Фича с анализом снов через чатгпт пока не работает.")
-        from config import CIM_EMOTIONS
-
-        emotions = ", ".join(CIM_EMOTIONS)
-        prompt = (
-            "Сначала подробно проанализируй сон по Юнгу без форматирования Markdown, с форматированием для Telegram."
-            "В конце ответа отдельной строкой напиши 'METRICS: '{\"intensity\": <0.5-3>, \"emotions\":[...]}'."
-            "Для расчёта CIM-анализа перечисли эмоции только из списка: "
-            f"{emotions}. "
-        )
-
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        resp = await client.chat.completions.create(
-            model="gpt-4o",
-
-            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": text}],
-            max_tokens=3500,
-            temperature=0.7,
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        return f"(ошибка OpenAI: {e})"
-
-
-async def _commit(uid: int, dream_txt: str, date_iso: Optional[str] = None):
-    metrics = {}
-    analysis = ""
+PROMPT = (
+    "Сначала подробно проанализируй сон по Юнгу без форматирования Markdown, с форматированием для Telegram."
+    "В конце ответа отдельной строкой напиши 'METRICS: '{\"intensity\": <0.5-3>, \"emotions\":[...]}'."
+    "Для расчёта CIM-анализа перечисли эмоции только из списка: "
+    f"{', '.join(CIM_EMOTIONS)}. "
+)
+
+
+async def analyze(text: str,
+                  on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """Return GPT analysis with metrics line.
+
+    With on_text the reply is streamed and on_text gets the text generated so far.
+    Errors of the model call propagate, so that the caller can retry.
+    """
+    messages = [{"role": "system", "content": PROMPT}, {"role": "user", "content": text}]
+    if on_text is None:
+        return await llm.chat(messages, max_tokens=3500, temperature=0.7)
     raw = ""
-    if dream_txt.strip():
-        raw = await analyze(dream_txt)
-        analysis = raw
-        m = re.search(r"METRICS:\s*(['\"])?(\{.*\})(?:\1)?", raw, re.S)
-        if m:
-            json_str = m.group(2)
-
-            try:
-                metrics = json.loads(json_str)
-            except Exception:
-                metrics = {}
-            analysis = raw[: m.start()].strip()
-        else:
-            analysis = re.sub(r"METRICS:.*", "", raw, flags=re.S).strip()
+    async for delta in llm.stream_chat(messages, max_tokens=3500, temperature=0.7):
+        raw += delta
+        await on_text(raw)
+    return raw.strip()
+
+
+def _parse(raw: str) -> Tuple[str, dict]:
+    """Split model output into analysis text and metrics (with cim_score)."""
+    metrics = {}
+    analysis = raw
+    m = re.search(r"METRICS:\s*(['\"])?(\{.*\})(?:\1)?", raw, re.S)
+    if m:
+        json_str = m.group(2)
+
+        try:
+            metrics = json.loads(json_str)
+        except Exception:
+            metrics = {}
+        analysis = raw[: m.start()].strip()
+    else:
+        analysis = re.sub(r"METRICS:.*", "", raw, flags=re.S).strip()
 
     intensity = metrics.get("intensity")
     emotions = metrics.get("emotions") or []
     if intensity and emotions:
-        from config import EMOTION_COEFF
         coeffs = [EMOTION_COEFF.get(e.lower(), 0) for e in emotions]
         if coeffs:
             e_val = sum(coeffs) / len(coeffs)
             metrics["cim_score"] = round(float(intensity) * e_val, 2)
+    return analysis, metrics
+
+
+# ───── очередь разбора ───────────────────────────────────────
+# Сон сохраняется сразу, а разбор делает фоновая очередь utils.jobs:
+# не больше ANALYSIS_WORKERS запросов к модели одновременно и не чаще
+# ANALYSIS_RATE в минуту. Заглушка отправляется сразу и её id хранится в
+# задании; ответ модели идёт потоком и по мере генерации дописывается в неё
+# (utils.live); в конце строка METRICS
+# разбирается, разбор сохраняется в запись сна по её id (storage.update_records:
+# производные данные получают пару «сон без метрик → сон с метриками» и
+# дополняются, а не пересобираются). Ошибка модели — повтор задания с паузой
+# (jobs.RETRIES); после последней попытки пользователь видит текст ошибки, а
+# сон остаётся без метрик до /backfill. Незаконченные задания переживают перезапуск.
+_bot: Optional[Bot] = None
+_HEADER = "🌓 Анализ сна:\n"
+
+
+def _cached(uid: int, text: str) -> Optional[str]:
+    return analysis_cache.get(uid, analysis_cache.key(text, PROMPT, LLM_MODEL))
+
+
+def _remember(uid: int, text: str, raw: str) -> None:
+    # ошибки и ответы без разобранных метрик не кэшируем — их стоит переспросить
+    if _parse(raw)[1]:
+        analysis_cache.put(uid, analysis_cache.key(text, PROMPT, LLM_MODEL), raw)
+
+
+def _visible(raw: str) -> str:
+    """Текст ответа без строки METRICS (её пользователь видит только разобранной)."""
+    return raw.split("METRICS:", 1)[0].rstrip()
+
+
+def _failed(e: Exception) -> str:
+    """Текст для пользователя, когда разбор так и не получился."""
+    return f"{_HEADER}(ошибка OpenAI: {e})"
+
+
+async def _placeholder(chat_id: int, reply_to: Optional[int]) -> int:
+    """Сообщение, которое потом заменит разбор; его id хранится в задании."""
+    kwargs = {}
+    if reply_to:
+        kwargs = {"reply_to_message_id": reply_to, "allow_sending_without_reply": True}
+    return await LiveMessage(_bot, chat_id).start(_QUEUED, **kwargs)
 
+
+async def _run_job(job: dict) -> None:
+    if job.get("message") is None:        # задание без заглушки (не отправилась)
+        job["message"] = await _placeholder(job["chat"], job.get("reply_to"))
+        await analysis_queue.checkpoint()
+    live = LiveMessage(_bot, job["chat"], job["message"])
+    if "raw" not in job:                  # задание прежних версий — ищем в кэше сами
+        job["raw"] = await aio_storage.run_io(_cached, job["uid"], job["text"])
+    if job["raw"] is None:
+        async def show(raw: str) -> None:
+            if live.due():
+                await live.update(_HEADER + _visible(raw))
+        try:
+            job["raw"] = await analyze(job["text"], on_text=show)
+        except llm.LLMUnavailable as e:
+            await live.finish(_failed(e))   # без ключа повтор не поможет; сон дозаполнит /backfill
+            return
+        except Exception as e:
+            if job.get("tries", 0) + 1 >= jobs.RETRIES:
+                await live.finish(_failed(e))
+            else:
+                await live.finish(_HEADER + "Модель не ответила, попробую ещё раз чуть позже…")
+            raise                           # повтор с паузой — в JobQueue
+        await aio_storage.run_io(_remember, job["uid"], job["text"], job["raw"])
+        await analysis_queue.checkpoint()
+    analysis, metrics = _parse(job["raw"])
+
+    def fill(rec: dict) -> Optional[dict]:
+        if rec.get("id") != job["record"]:
+            return None
+        return dict(rec, analysis=analysis, metrics=metrics)
+
+    await aio_storage.update_records(job["uid"], "dreams", fill)
+    await live.finish(f"{_HEADER}{analysis}{_fmt_metrics(metrics)}")
+
+
+analysis_queue = jobs.JobQueue("dreams", _run_job, ANALYSIS_WORKERS, ANALYSIS_RATE)
+
+
+async def start_analysis(bot: Bot) -> int:
+    """Start the analysis workers (resuming unfinished jobs); returns the number resumed."""
+    global _bot
+    _bot = bot
+    return await analysis_queue.start()
+
+
+async def stop_analysis() -> None:
+    await analysis_queue.close()
+
+
+async def _commit(uid: int, dream_txt: str, date_iso: Optional[str] = None,
+                  chat_id: Optional[int] = None, reply_to: Optional[int] = None) -> Optional[str]:
+    """Save the dream and queue its analysis under a placeholder message.
+
+    A dream whose text was already analysed is answered from the cache: the
+    analysis is saved with it and returned as the message to send.
+    """
     if not date_iso:
         date_iso = datetime.date.today().isoformat()
     payload = {
+        "id": uuid.uuid4().hex[:12],
         "dream": dream_txt,
-        "analysis": analysis,
-        "metrics": metrics,
+        "analysis": "",
+        "metrics": {},
         "date": date_iso,
     }
-    save_json(uid, "dreams", "dream", payload)
-    return analysis, metrics
+    raw = await aio_storage.run_io(_cached, uid, dream_txt) if dream_txt.strip() else None
+    if raw is not None:
+        payload["analysis"], payload["metrics"] = _parse(raw)
+    await aio_storage.save_json(uid, "dreams", "dream", payload)   # запись должна быть на диске
+    if raw is not None:
+        return f"{_HEADER}{payload['analysis']}{_fmt_metrics(payload['metrics'])}"
+    if dream_txt.strip():
+        chat_id = chat_id or uid
+        try:
+            message = await _placeholder(chat_id, reply_to)
+        except Exception:
+            message = None                # заглушку отправит само задание
+        await analysis_queue.submit({      # raw=None: в кэше уже искали, повторно не ищем
+            "uid": uid, "chat": chat_id, "record": payload["id"],
+            "text": dream_txt, "reply_to": reply_to, "message": message, "raw": None,
+        })
+    return None
+
+
+_QUEUED = "🌙 Сон сохранён. Разбор появится в этом сообщении, как только будет готов."
 
 
 # ───── команды /dream и кнопки ─────────────────────────────
@@ -170,13 +279,9 @@ async def cmd_dream(msg: types.Message):
         return
     text = msg.text.replace("/dream", "", 1).strip()
     if text:
-        analysis, metrics = await _commit(msg.from_user.id, text, None)
-        await send_long(
-            msg.bot,
-            msg.chat.id,
-            f"🌓 Анализ сна:\n{analysis}{_fmt_metrics(metrics)}",
-            reply_to_message_id=msg.message_id,
-        )
+        ready = await _commit(msg.from_user.id, text, None, chat_id=msg.chat.id, reply_to=msg.message_id)
+        if ready:
+            await send_long(msg.bot, msg.chat.id, ready, reply_to_message_id=msg.message_id)
         from handlers.manage import main_kb
         await msg.answer("Меню:", reply_markup=main_kb())
     else:
@@ -184,6 +289,14 @@ async def cmd_dream(msg: types.Message):
         await start_record(msg.bot, msg.from_user.id)
 
 
+# записи-отметки без текста сна (разбирать в них нечего)
+LABELS = {
+    "dream_none": "Не запомнил сон",
+    "dream_lazy": "Лень записывать",
+    "dream_frag": "Помню урывками",
+}
+
+
 # Обрабатываем кнопки, кроме завершения записи
 @router.callback_query(lambda c: c.data.startswith("dream_") and c.data != "dream_end")
 async def dream_buttons(cq: types.CallbackQuery, bot: Bot):
@@ -198,16 +311,11 @@ async def dream_buttons(cq: types.CallbackQuery, bot: Bot):
         await cq.answer()
         return
 
-    label_map = {
-        "dream_none": "Не запомнил сон",
-        "dream_lazy": "Лень записывать",
-        "dream_frag": "Помню урывками",
-    }
-    label = label_map.get(code, code)
+    label = LABELS.get(code, code)
     info = _active.pop(uid, None)
     date_iso = info.get("date") if info else datetime.date.today().isoformat()
     payload = {"dream": label, "analysis": "(нет)", "metrics": {}, "date": date_iso}
-    save_json(uid, "dreams", "dream", payload)
+    aio_storage.save_json(uid, "dreams", "dream", payload)
     await cq.message.edit_text(f"📑 Записал: {label}")
     from handlers.manage import main_kb
     await cq.message.answer("Меню:", reply_markup=main_kb())
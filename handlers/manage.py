@@ -7,10 +7,14 @@ from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from handlers import view_dreams
 from utils.env import AUTHORIZED_USER_IDS
-from config import CIM_EMOTIONS, load_user_times, save_user_times, user_graph_params, add_custom_param
-from analysis.generate_plot import plot_multi, emotion_counts
-from analysis.fourier import save_fft
-from utils.storage import user_dir
+from config import CIM_EMOTIONS, load_user_times, save_user_times, user_graph_params, user_parameters, add_custom_param
+from analysis.generate_plot import render_multi, emotion_counts, page_count
+from analysis.cim_charts import render_heatmap, render_pairs
+from analysis import lagcorr
+from analysis.fourier import MODE_TITLES, cycles_text, render_fft, render_spectra, render_spectrogram
+from utils import aio_storage
+from analysis.render_service import RenderBusy
+from handlers import charts
 from analysis.export import export
 from handlers import mood
 from handlers import view_dreams   # 📚 кнопка сны
@@ -33,6 +37,7 @@ class GraphState:
 _graph_state: dict[int, GraphState] = {}
 _cim_state: dict[int, GraphState] = {}
 _wait_param: set[int] = set()
+_BUSY = "Сейчас строится много графиков, попробуйте через минуту."
 
 
 router = Router()
@@ -56,6 +61,7 @@ def main_kb() -> types.InlineKeyboardMarkup:
     kb.button(text="🔍 FFT",           callback_data="mg_fft")
     kb.button(text="📚 Архив снов",    callback_data="mg_dreams")
     kb.button(text="🎭 CIM-анализ",   callback_data="mg_cim")
+    kb.button(text="🔗 Сны и настроение", callback_data="mg_lag")
     kb.button(text="🗓 Пропуски",      callback_data="mg_missed")
     kb.button(text="📝 Чек-ин",        callback_data="mg_now")
     kb.button(text="🌙 Записать сон",  callback_data="mg_dream_now")
@@ -88,7 +94,7 @@ async def open_settings(cq: types.CallbackQuery):
 # ───── кнопка «📚 Сны»  → календарь  ──────────────────────
 @router.callback_query(lambda c: c.data == "mg_dreams")
 async def dreams_button(cq: types.CallbackQuery, bot: Bot):
-    lst = view_dreams.dates_with_dreams(cq.from_user.id)
+    lst = await aio_storage.call(cq.from_user.id, view_dreams.dates_with_dreams, cq.from_user.id)
     if not lst:
         await bot.send_message(cq.from_user.id, "Нет сохранённых снов.")
         await cq.answer(); return
@@ -120,7 +126,7 @@ async def dreams_button(cq: types.CallbackQuery, bot: Bot):
     Без фейковых Message — формируем ответ напрямую.
     """
     uid = cq.from_user.id
-    lst = view_dreams.dates_with_dreams(uid)
+    lst = await aio_storage.call(uid, view_dreams.dates_with_dreams, uid)
 
     if not lst:
         await bot.send_message(uid, "Нет сохранённых снов.")
@@ -157,7 +163,7 @@ async def g_choose_param(cq: types.CallbackQuery):
     st.page = 0
     st.params = []
     st.msg_id = None
-    g_params = user_graph_params(cq.from_user.id)
+    g_params = await aio_storage.run_io(user_graph_params, cq.from_user.id)
     kb = InlineKeyboardBuilder()
     for k, l in g_params:
         kb.button(text=l, callback_data=f"gp_add_{k}")
@@ -168,28 +174,42 @@ async def g_choose_param(cq: types.CallbackQuery):
 
 
 async def _show_graph(bot: Bot, uid: int, st: GraphState, message: types.Message):
-    path = user_dir(uid) / "plot.png"
-    res = plot_multi(uid, st.params, st.period, str(path), st.page)
+    args = (list(st.params), st.period, st.page)
+    try:
+        chart = await charts.prepare_latest(uid, "graph", "graph", render_multi, *args)
+    except charts.Superseded:
+        return                          # пока рисовали, пользователь нажал ещё раз
+    except RenderBusy:
+        await bot.send_message(uid, _BUSY)
+        return
+    g_params = await aio_storage.run_io(user_graph_params, uid)
     kb = InlineKeyboardBuilder()
     if st.period != "all":
         kb.button(text="⬅️", callback_data="gprev")
         kb.button(text="➡️", callback_data="gnext")
     kb.adjust(2)
     kb.button(text="Выбрать другой параметр", callback_data="g_new")
-    if len(st.params) < len(user_graph_params(uid)):
+    if len(st.params) < len(g_params):
         kb.button(text="Выбрать дополнительный параметр", callback_data="g_more")
     kb.adjust(1)
     kb.button(text="⬅️ Меню", callback_data="mg_back")
-    if st.msg_id:
-        try:
-            await bot.delete_message(uid, st.msg_id)
-        except Exception:
-            pass
-    if res:
-        msg = await bot.send_photo(uid, FSInputFile(res), reply_markup=kb.as_markup())
-    else:
-        msg = await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
-    st.msg_id = msg.message_id
+    async with charts.delivering(uid, "graph"):
+        if charts.pending(uid, "graph"):
+            return
+        if st.msg_id:
+            try:
+                await bot.delete_message(uid, st.msg_id)
+            except Exception:
+                pass
+        if chart:
+            msg = await charts.send(bot, chart, "graph.png", kb.as_markup())
+        else:
+            msg = await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
+        st.msg_id = msg.message_id
+    if args[1] != "all" and chart:
+        pages = await aio_storage.call(uid, page_count, uid, args[0], args[1])
+        charts.prefetch(uid, "graph", "graph", render_multi,
+                        [args[:2] + (p,) for p in charts.neighbours(args[2], pages)])
 
 
 @router.callback_query(lambda c: c.data.startswith("gp_add_"))
@@ -204,6 +224,7 @@ async def g_first_param(cq: types.CallbackQuery, bot: Bot):
 @router.callback_query(lambda c: c.data == "g_new")
 async def g_new_param(cq: types.CallbackQuery):
     st = _graph_state.get(cq.from_user.id)
+    charts.cancel_prefetch(cq.from_user.id, "graph")
     if st and st.msg_id:
         try:
             await cq.bot.delete_message(cq.from_user.id, st.msg_id)
@@ -211,7 +232,7 @@ async def g_new_param(cq: types.CallbackQuery):
             pass
         st.msg_id = None
     kb = InlineKeyboardBuilder()
-    for k, l in user_graph_params(cq.from_user.id):
+    for k, l in await aio_storage.run_io(user_graph_params, cq.from_user.id):
         kb.button(text=l, callback_data=f"gp_add_{k}")
     kb.button(text="⬅️", callback_data="mg_graph")
     kb.adjust(2)
@@ -226,9 +247,10 @@ async def g_more_param(cq: types.CallbackQuery):
     st = _graph_state.get(cq.from_user.id)
     if not st:
         await cq.answer(); return
+    g_params = await aio_storage.run_io(user_graph_params, cq.from_user.id)
     kb = InlineKeyboardBuilder()
-    remaining = [k for k, _ in user_graph_params(cq.from_user.id) if k not in st.params]
-    for k, l in user_graph_params(cq.from_user.id):
+    remaining = [k for k, _ in g_params if k not in st.params]
+    for k, l in g_params:
         if k in remaining:
             kb.button(text=l, callback_data=f"ga_{k}")
     if remaining:
@@ -254,7 +276,7 @@ async def g_add_param(cq: types.CallbackQuery, bot: Bot):
     if not st:
         await cq.answer(); return
     if cq.data == "ga_all":
-        st.params = [k for k, _ in user_graph_params(cq.from_user.id)]
+        st.params = [k for k, _ in await aio_storage.run_io(user_graph_params, cq.from_user.id)]
     else:
         param = cq.data.split("_", 1)[1]
         if param not in st.params:
@@ -301,11 +323,14 @@ async def cim_choose_param(cq: types.CallbackQuery):
     st.page = 0
     st.params = []
     st.msg_id = None
-    counts = emotion_counts(cq.from_user.id)
+    counts = await aio_storage.call(cq.from_user.id, emotion_counts, cq.from_user.id)
     available = [e for e in CIM_EMOTIONS if counts.get(e)]
     kb = InlineKeyboardBuilder()
     for e in available:
         kb.button(text=f"{e} ({counts[e]})", callback_data=f"cp_add_{e}")
+    if available:
+        kb.button(text="Тепловая карта", callback_data="c_heat")
+        kb.button(text="Частые пары", callback_data="c_pairs")
     kb.button(text="⬅️", callback_data="mg_cim")
     kb.adjust(2)
     if available:
@@ -316,10 +341,15 @@ async def cim_choose_param(cq: types.CallbackQuery):
 
 
 async def _show_cim(bot: Bot, uid: int, st: GraphState, message: types.Message):
-    path = user_dir(uid) / "cim_plot.png"
-    params = [f"emo_{p}" for p in st.params]
-    res = plot_multi(uid, params, st.period, str(path), st.page)
-    counts = emotion_counts(uid)
+    args = ([f"emo_{p}" for p in st.params], st.period, st.page)
+    try:
+        chart = await charts.prepare_latest(uid, "cim", "graph", render_multi, *args)
+    except charts.Superseded:
+        return
+    except RenderBusy:
+        await bot.send_message(uid, _BUSY)
+        return
+    counts = await aio_storage.call(uid, emotion_counts, uid)
     available = [e for e in CIM_EMOTIONS if counts.get(e)]
     kb = InlineKeyboardBuilder()
     if st.period != "all":
@@ -332,16 +362,42 @@ async def _show_cim(bot: Bot, uid: int, st: GraphState, message: types.Message):
     kb.adjust(1)
     kb.button(text="⬅️ Меню", callback_data="mg_back")
 
-    if st.msg_id:
-        try:
-            await bot.delete_message(uid, st.msg_id)
-        except Exception:
-            pass
-    if res:
-        msg = await bot.send_photo(uid, FSInputFile(res), reply_markup=kb.as_markup())
+    async with charts.delivering(uid, "cim"):
+        if charts.pending(uid, "cim"):
+            return
+        if st.msg_id:
+            try:
+                await bot.delete_message(uid, st.msg_id)
+            except Exception:
+                pass
+        if chart:
+            msg = await charts.send(bot, chart, "cim.png", kb.as_markup())
+        else:
+            msg = await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
+        st.msg_id = msg.message_id
+    if args[1] != "all" and chart:
+        pages = await aio_storage.call(uid, page_count, uid, args[0], args[1])
+        charts.prefetch(uid, "cim", "graph", render_multi,
+                        [args[:2] + (p,) for p in charts.neighbours(args[2], pages)])
+
+
+@router.callback_query(lambda c: c.data in ("c_heat", "c_pairs"))
+async def cim_matrix_chart(cq: types.CallbackQuery, bot: Bot):
+    uid = cq.from_user.id
+    st = _cim_state.setdefault(uid, GraphState())
+    kind, fn = ("cim_heat", render_heatmap) if cq.data == "c_heat" else ("cim_pairs", render_pairs)
+    try:
+        chart = await charts.prepare(uid, kind, fn, st.period, 0)
+    except RenderBusy:
+        await cq.answer(_BUSY, show_alert=True)
+        return
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ Меню", callback_data="mg_back")
+    if chart:
+        await charts.send(bot, chart, f"{kind}.png", kb.as_markup())
     else:
-        msg = await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
-    st.msg_id = msg.message_id
+        await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
+    await cq.answer()
 
 
 @router.callback_query(lambda c: c.data.startswith("cp_add_"))
@@ -356,17 +412,21 @@ async def cim_first_param(cq: types.CallbackQuery, bot: Bot):
 @router.callback_query(lambda c: c.data == "c_new")
 async def cim_new_param(cq: types.CallbackQuery):
     st = _cim_state.get(cq.from_user.id)
+    charts.cancel_prefetch(cq.from_user.id, "cim")
     if st and st.msg_id:
         try:
             await cq.bot.delete_message(cq.from_user.id, st.msg_id)
         except Exception:
             pass
         st.msg_id = None
-    counts = emotion_counts(cq.from_user.id)
+    counts = await aio_storage.call(cq.from_user.id, emotion_counts, cq.from_user.id)
     available = [e for e in CIM_EMOTIONS if counts.get(e)]
     kb = InlineKeyboardBuilder()
     for e in available:
         kb.button(text=f"{e} ({counts[e]})", callback_data=f"cp_add_{e}")
+    if available:
+        kb.button(text="Тепловая карта", callback_data="c_heat")
+        kb.button(text="Частые пары", callback_data="c_pairs")
     kb.button(text="⬅️", callback_data="mg_cim")
     kb.adjust(2)
     if available:
@@ -383,7 +443,7 @@ async def cim_more_param(cq: types.CallbackQuery):
     st = _cim_state.get(cq.from_user.id)
     if not st:
         await cq.answer(); return
-    counts = emotion_counts(cq.from_user.id)
+    counts = await aio_storage.call(cq.from_user.id, emotion_counts, cq.from_user.id)
     available = [e for e in CIM_EMOTIONS if counts.get(e)]
     remaining = [e for e in available if e not in st.params]
     kb = InlineKeyboardBuilder()
@@ -414,7 +474,7 @@ async def cim_add_param(cq: types.CallbackQuery, bot: Bot):
     st = _cim_state.get(cq.from_user.id)
     if not st:
         await cq.answer(); return
-    counts = emotion_counts(cq.from_user.id)
+    counts = await aio_storage.call(cq.from_user.id, emotion_counts, cq.from_user.id)
     available = [e for e in CIM_EMOTIONS if counts.get(e)]
     if cq.data == "ca_all":
         st.params = list(available)
@@ -440,35 +500,129 @@ async def cim_nav(cq: types.CallbackQuery, bot: Bot):
 
 
 # ───── кнопка FFT ─────────────────────────────────────────
-@router.callback_query(lambda c: c.data == "mg_fft")
-async def fft_param(cq: types.CallbackQuery):
+_fft_mode: dict[int, str] = {}          # uid → "fft" | "ls"
+
+
+def _fft_kb(uid: int, params: list[tuple[str, str]]) -> types.InlineKeyboardMarkup:
+    mode = _fft_mode.get(uid, "fft")
+    other = "ls" if mode == "fft" else "fft"
     kb = InlineKeyboardBuilder()
-    for k, l in user_graph_params(cq.from_user.id):
+    for k, l in params:
         kb.button(text=l, callback_data=f"f_{k}")
+    kb.button(text="Все параметры", callback_data="fall")
+    kb.button(text="Спектрограмма", callback_data="fsg")
+    kb.button(text=f"Режим: {MODE_TITLES[other]}", callback_data="fmode")
     kb.button(text="⬅️", callback_data="mg_back")
     kb.adjust(2)
-    await cq.message.edit_text("FFT параметр:", reply_markup=kb.as_markup())
+    return kb.as_markup()
+
+
+@router.callback_query(lambda c: c.data == "mg_fft")
+async def fft_param(cq: types.CallbackQuery):
+    mode = _fft_mode.get(cq.from_user.id, "fft")
+    params = await aio_storage.run_io(user_graph_params, cq.from_user.id)
+    await _edit(cq.message, f"Спектр ({MODE_TITLES[mode]}), параметр:", _fft_kb(cq.from_user.id, params))
+    await cq.answer()
+
+
+@router.callback_query(lambda c: c.data == "fmode")
+async def fft_mode(cq: types.CallbackQuery):
+    uid = cq.from_user.id
+    _fft_mode[uid] = "ls" if _fft_mode.get(uid, "fft") == "fft" else "fft"
+    await fft_param(cq)
+
+
+async def _send_spectrum(cq: types.CallbackQuery, bot: Bot, kind: str, fn, arg,
+                         params: list[tuple[str, str]], filename: str):
+    uid = cq.from_user.id
+    mode = _fft_mode.get(uid, "fft")
+    try:
+        chart = await charts.prepare(uid, kind, fn, arg, mode)
+    except RenderBusy:
+        await cq.answer(_BUSY, show_alert=True)
+        return
+    # подпись — из спектров, которые рендер уже сохранил в .cache, без слота рендера
+    caption = await aio_storage.call(uid, cycles_text, uid, params, mode) if chart else ""
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ Меню", callback_data="mg_back")
+    if chart:
+        caption = f"Главные циклы:\n{caption}" if caption else None
+        await charts.send(bot, chart, filename, kb.as_markup(), caption=caption)
+    else:
+        await bot.send_message(uid, "Нет данных.", reply_markup=kb.as_markup())
     await cq.answer()
 
 
 @router.callback_query(lambda c: c.data.startswith("f_"))
 async def send_fft(cq: types.CallbackQuery, bot: Bot):
     param = cq.data[2:]
-    path = user_dir(cq.from_user.id) / f"{param}_fft.png"
-    res = save_fft(cq.from_user.id, param, str(path))
+    params = [(k, l) for k, l in await aio_storage.run_io(user_graph_params, cq.from_user.id)
+              if k == param]
+    await _send_spectrum(cq, bot, "fft", render_fft, param, params, f"{param}_fft.png")
+
+
+@router.callback_query(lambda c: c.data == "fall")
+async def send_all_spectra(cq: types.CallbackQuery, bot: Bot):
+    params = await aio_storage.run_io(user_graph_params, cq.from_user.id)
+    await _send_spectrum(cq, bot, "spectra", render_spectra, [k for k, _ in params], params,
+                         "spectra.png")
+
+
+@router.callback_query(lambda c: c.data == "fsg")
+async def spectrogram_param(cq: types.CallbackQuery):
+    kb = InlineKeyboardBuilder()
+    for k, l in await aio_storage.run_io(user_graph_params, cq.from_user.id):
+        kb.button(text=l, callback_data=f"fsg_{k}")
+    kb.button(text="⬅️", callback_data="mg_fft")
+    kb.adjust(2)
+    await _edit(cq.message, "Спектрограмма, параметр:", kb.as_markup())
+    await cq.answer()
+
+
+@router.callback_query(lambda c: c.data.startswith("fsg_"))
+async def send_spectrogram(cq: types.CallbackQuery, bot: Bot):
+    uid = cq.from_user.id
+    param = cq.data[4:]
+    try:
+        chart = await charts.prepare(uid, "spectrogram", render_spectrogram, param)
+    except RenderBusy:
+        await cq.answer(_BUSY, show_alert=True)
+        return
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ Меню", callback_data="mg_back")
+    if chart:
+        await charts.send(bot, chart, f"{param}_spectrogram.png", kb.as_markup())
+    else:
+        await bot.send_message(uid, "Мало данных: нужно хотя бы 90 дней.", reply_markup=kb.as_markup())
+    await cq.answer()
+
+
+# ───── CIM-score ↔ параметры ───────────────────────────────
+@router.callback_query(lambda c: c.data == "mg_lag")
+async def send_lagcorr(cq: types.CallbackQuery, bot: Bot):
+    uid = cq.from_user.id
+    params = await aio_storage.run_io(user_parameters, uid)
+    keys = [k for k, _ in params]
+    try:
+        chart = await charts.prepare(uid, "lagcorr", lagcorr.render, keys)
+    except RenderBusy:
+        await cq.answer(_BUSY, show_alert=True)
+        return
+    text = await aio_storage.call(uid, lagcorr.summary, uid, params) if chart else ""
     kb = InlineKeyboardBuilder()
     kb.button(text="⬅️ Меню", callback_data="mg_back")
-    if res:
-        await bot.send_photo(cq.from_user.id, photo=FSInputFile(res), reply_markup=kb.as_markup())
+    if chart:
+        caption = f"Сильнейшая связь:\n{text}" if text else None
+        await charts.send(bot, chart, "lagcorr.png", kb.as_markup(), caption=caption)
     else:
-        await bot.send_message(cq.from_user.id, "Нет данных.", reply_markup=kb.as_markup())
+        await bot.send_message(uid, "Нужны и сны с CIM-score, и чек-ины.", reply_markup=kb.as_markup())
     await cq.answer()
 
 
 # ───── кнопка Напоминания ─────────────────────────────────
 @router.callback_query(lambda c: c.data == "mg_time")
 async def time_view(cq: types.CallbackQuery):
-    m, e = load_user_times(cq.from_user.id)
+    m, e = await aio_storage.run_io(load_user_times, cq.from_user.id)
     await cq.message.edit_text(
         f"Утро  {m.strftime('%H:%M')}\nВечер {e.strftime('%H:%M')}\n"
         f"Измени:  /set HH:MM HH:MM",
@@ -480,7 +634,7 @@ async def time_view(cq: types.CallbackQuery):
 # ───── кнопка Экспорт ─────────────────────────────────────
 @router.callback_query(lambda c: c.data == "mg_export")
 async def exp(cq: types.CallbackQuery, bot: Bot):
-    path = export(cq.from_user.id)
+    path = await aio_storage.call(cq.from_user.id, export, cq.from_user.id)
     await bot.send_document(
         cq.from_user.id,
         FSInputFile(path),
@@ -500,7 +654,7 @@ async def add_param_prompt(cq: types.CallbackQuery):
 async def receive_param(msg: types.Message):
     _wait_param.discard(msg.from_user.id)
     label = msg.text.strip()
-    add_custom_param(msg.from_user.id, label)
+    await aio_storage.run_io(add_custom_param, msg.from_user.id, label)
     await msg.reply(f"Добавлен параметр: {label}")
     from handlers.manage import main_kb
     await msg.answer("Меню:", reply_markup=main_kb())
@@ -514,6 +668,7 @@ async def receive_param(msg: types.Message):
 # ───── Назад ──────────────────────────────────────────────
 @router.callback_query(lambda c: c.data == "mg_back")
 async def back(cq: types.CallbackQuery):
+    charts.cancel_prefetch(cq.from_user.id)
     try:
         await cq.message.delete()
     except Exception:
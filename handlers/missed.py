@@ -1,7 +1,8 @@
 import datetime, json
 from aiogram import Router, types, Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from utils.storage import user_dir
+from utils.storage import load_records
+from utils import aio_storage
 from handlers import mood, dreams
 router=Router()
 def build_calendar(days_list, prefix):
@@ -21,15 +22,15 @@ async def choose_type(cq: types.CallbackQuery):
     await cq.message.edit_text("Что добавить?", reply_markup=kb.as_markup())
     await cq.answer()
 def get_missing_dates(uid, sub):
-    folder=user_dir(uid)/sub
-    existing={f.name.split('_')[1] for f in folder.glob(f'{sub[:-1]}_*')} if folder.exists() else set()
     today=datetime.date.today()
+    since=today-datetime.timedelta(days=30)
+    existing={str(r.get("date")) for r in load_records(uid, sub, since, today)}
     dates=[today-datetime.timedelta(days=i) for i in range(1,31)]
-    return [d for d in dates if d.strftime('%Y%m%d') not in existing]
+    return [d for d in dates if d.isoformat() not in existing]
 @router.callback_query(lambda c:c.data in ["missed_ci","missed_dream"])
 async def show_calendar(cq: types.CallbackQuery):
     typ="mood" if cq.data=="missed_ci" else "dreams"
-    days=get_missing_dates(cq.from_user.id, typ)
+    days=await aio_storage.call(cq.from_user.id, get_missing_dates, cq.from_user.id, typ)
     if not days:
         await cq.answer("Пропусков нет"); return
     markup=build_calendar(days[:16],"ci" if typ=="mood" else "dr")
@@ -3,8 +3,8 @@
 from __future__ import annotations
 
 import asyncio
-import json
-from pathlib import Path
+import datetime
+import logging
 from typing import Dict, Optional
 
 from aiogram import Router, Bot, types
@@ -13,8 +13,11 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import user_parameters
 from Token import AUTHORIZED_USER_IDS
+from analysis import episodes
 from handlers import manage
-from utils.storage import user_dir, save_json
+from utils import aio_storage
+
+log = logging.getLogger(__name__)
 
 router = Router()
 _state: Dict[int, Dict] = {}          # user_id → {"index": int, "data": dict, "file": Path}
@@ -31,8 +34,9 @@ def build_kb(param: str) -> types.InlineKeyboardMarkup:
 
 
 async def start(bot: Bot, uid: int, backdate: Optional[str] = None) -> None:
-    params=user_parameters(uid)
-    _state[uid] = {"index": 0, "data": {"date": backdate}, "file": None, "params":params}
+    params=await aio_storage.run_io(user_parameters, uid)
+    date_iso = backdate or datetime.date.today().isoformat()
+    _state[uid] = {"index": 0, "data": {"date": date_iso}, "file": None, "params":params}
     k, label = params[0]
     await bot.send_message(uid, f"{label}  (-3…3):", reply_markup=build_kb(k))
 
@@ -52,18 +56,22 @@ async def cb_scale(cq: types.CallbackQuery):
     payload, val = cq.data.rsplit("_", 1)          # m_<param>_<val>
     _, param = payload.split("_", 1)
 
-    st = _state.setdefault(cq.from_user.id, {"index": 0, "data": {}, "file": None, "params": user_parameters(cq.from_user.id)})
+    st = _state.get(cq.from_user.id)
+    if st is None:
+        st = _state[cq.from_user.id] = {"index": 0, "data": {}, "file": None, "params": None}
     st["data"][param] = None if val == "x" else int(val)
     st["index"] += 1
 
-    params = st.get("params") or user_parameters(cq.from_user.id)
+    if not st.get("params"):
+        st["params"] = await aio_storage.run_io(user_parameters, cq.from_user.id)
+    params = st["params"]
     if st["index"] >= len(params):
         # Все ответы получены — спрашиваем summary, сохранять пока рано
         await cq.message.answer(
             "📝 Что было самым живым сегодня? (можно ничего не писать)"
         )
         # запускаем тайм-аут ожидания текста
-        asyncio.create_task(_summary_timeout(cq.from_user.id))
+        asyncio.create_task(_summary_timeout(cq.from_user.id, bot=cq.bot))
         await cq.answer()
         return
 
@@ -73,31 +81,51 @@ async def cb_scale(cq: types.CallbackQuery):
 
 
 # ─────────────────────────────────────────────────────────
-async def _save_final(uid: int):
-    """Создаём/перезаписываем единственный файл итогов."""
+async def _save_final(uid: int, bot: Optional[Bot] = None):
+    """Дописываем итог чек-ина в сегмент (ровно один раз за сессию)."""
     st = _state.get(uid)
     if st is None:
         return
 
-    # Если файла ещё нет — создаём, иначе перезаписываем
+    # запись в сегменте только дописывается, поэтому повторно не сохраняем
     if st["file"] is None:
-        fp = save_json(uid, "mood", "mood", st["data"])
-        st["file"] = fp
-    else:
-        Path(st["file"]).write_text(
-            json.dumps(st["data"], ensure_ascii=False) + "\n",
-            encoding="utf-8",
-        )  # простая перезапись JSONL одной строкой
+        st["file"] = aio_storage.save_json(uid, "mood", "mood", st["data"])
+        if bot is not None:
+            asyncio.create_task(_report_shift(bot, uid, st["file"]))
+
+
+_SHIFT_TEXT = {
+    "mania": "⚠️ С {since} заметно выросли: {params}. Похоже на начало подъёма — "
+             "стоит присмотреться к себе и при необходимости обсудить это с врачом.",
+    "depression": "⚠️ С {since} заметно снизились: {params}. Похоже на начало спада — "
+                  "стоит присмотреться к себе и при необходимости обсудить это с врачом.",
+}
+
+
+async def _report_shift(bot: Bot, uid: int, saved: "asyncio.Future") -> None:
+    """После записи чек-ина сообщаем о новом сдвиге, если детектор его видит."""
+    try:
+        await saved
+        flag = await aio_storage.run_io(episodes.take_new_flag, uid)
+    except Exception:
+        log.exception("не удалось проверить сдвиг после чек-ина %s", uid)
+        return
+    if not flag:
+        return
+    labels = dict(await aio_storage.run_io(user_parameters, uid))
+    params = ", ".join(labels.get(p, p).lower() for p in flag["params"])
+    since = datetime.date.fromisoformat(flag["since"]).strftime("%d.%m")
+    await bot.send_message(uid, _SHIFT_TEXT[flag["kind"]].format(since=since, params=params))
 
 
-async def _summary_timeout(uid: int, delay: int = 600):
+async def _summary_timeout(uid: int, delay: int = 600, bot: Optional[Bot] = None):
     """Через delay секунд, если summary не пришёл, дописываем (пусто)."""
     await asyncio.sleep(delay)
     st = _state.get(uid)
     if st is None or "summary" in st["data"]:
         return                            # текст пришёл, ничего делать не нужно
     st["data"]["summary"] = "(пусто)"
-    await _save_final(uid)
+    await _save_final(uid, bot)
     _state.pop(uid, None)
 
 
@@ -105,14 +133,14 @@ async def _summary_timeout(uid: int, delay: int = 600):
 @router.message(lambda m: m.from_user.id in AUTHORIZED_USER_IDS and m.from_user.id not in manage._wait_param)
 async def summary_or_plain(msg: types.Message):
     st = _state.get(msg.from_user.id)
-    params = None
-    if st is not None:
-        params = st.get("params")
-    if st is None or st["index"] < len(params or user_parameters(msg.from_user.id)):
-        return     # нет открытой сессии или чек-ин ещё не закончен
+    if st is None:
+        return     # нет открытой сессии
+    params = st.get("params") or await aio_storage.run_io(user_parameters, msg.from_user.id)
+    if st["index"] < len(params):
+        return     # чек-ин ещё не закончен
 
     st["data"]["summary"] = msg.text or "(пусто)"
-    await _save_final(msg.from_user.id)
+    await _save_final(msg.from_user.id, msg.bot)
     _state.pop(msg.from_user.id, None)
     await msg.reply("✅ Сохранено!")
     from handlers.manage import main_kb
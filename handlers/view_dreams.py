@@ -7,7 +7,8 @@ from aiogram import Router, types, Bot
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from utils.storage import load_records
+from utils.storage import iter_records, find_record
+from utils import aio_storage
 
 from Token import AUTHORIZED_USER_IDS
 
@@ -17,9 +18,8 @@ PAGE = 16  # сколько дат на одной странице
 
 # ─── возвращаем даты с реальными снами ────────────────────
 def dates_with_dreams(uid: int) -> List[datetime.date]:
-    recs = load_records(uid, "dreams")
     out = []
-    for r in recs:
+    for r in iter_records(uid, "dreams"):
         if r.get("dream") and not r["dream"].startswith("Не запомнил"):
             date_str = r.get("date")
             if not date_str:
@@ -58,7 +58,7 @@ def kb_calendar(lst: List[datetime.date], page: int) -> types.InlineKeyboardMark
 async def dreams_root(msg: types.Message):
     if msg.from_user.id not in AUTHORIZED_USER_IDS:
         return
-    lst = dates_with_dreams(msg.from_user.id)
+    lst = await aio_storage.call(msg.from_user.id, dates_with_dreams, msg.from_user.id)
     if not lst:
         await msg.reply("Нет сохранённых снов.")
         return
@@ -69,7 +69,7 @@ async def dreams_root(msg: types.Message):
 @router.callback_query(lambda c: c.data.startswith("dreampg_"))
 async def change_page(cq: types.CallbackQuery):
     page = int(cq.data.split("_", 1)[1])
-    lst = dates_with_dreams(cq.from_user.id)
+    lst = await aio_storage.call(cq.from_user.id, dates_with_dreams, cq.from_user.id)
     await cq.message.edit_reply_markup(reply_markup=kb_calendar(lst, page))
     await cq.answer()
 
@@ -78,13 +78,12 @@ async def change_page(cq: types.CallbackQuery):
 @router.callback_query(lambda c: c.data.startswith("showdream_"))
 async def show_one(cq: types.CallbackQuery, bot: Bot):
     date_iso = cq.data.split("_", 1)[1]
-    recs = load_records(cq.from_user.id, "dreams")
-    rec = next((r for r in recs if r.get("date") == date_iso), None)
+    rec = await aio_storage.call(cq.from_user.id, find_record, cq.from_user.id, "dreams", date_iso)
     if not rec:
         await cq.answer("Запись не найдена"); return
 
     await bot.send_message(
         cq.from_user.id,
-        f"🌙 Сон ({date_iso}):\n{rec['dream']}\n\n🌓 {rec['analysis']}"
+        f"🌙 Сон ({date_iso}):\n{rec['dream']}\n\n🌓 {rec['analysis'] or '(разбор ещё готовится)'}"
     )
     await cq.answer()
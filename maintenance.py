@@ -0,0 +1,100 @@
+"""Офлайн-обслуживание каталога data/ (запускать при остановленном боте)."""
+import argparse, asyncio, time
+
+from config import ANALYSIS_RATE, ANALYSIS_WORKERS
+from utils import storage
+
+
+def _uids(args) -> list[int]:
+    return args.uid or storage.user_ids()
+
+
+def cmd_compact(args) -> None:
+    for uid in _uids(args):
+        for sub in ("mood", "dreams"):
+            n = storage.compact(uid, sub)
+            print(f"{uid}/{sub}: {n} файлов слито в сегменты")
+
+
+def cmd_migrate_sqlite(args) -> None:
+    from utils import sqlite_store
+    for uid in _uids(args):
+        done = sqlite_store.migrate(uid)
+        print(f"{uid}: " + ", ".join(f"{sub} {n}" for sub, n in done.items()))
+
+
+def cmd_rebuild_emotions(args) -> None:
+    from analysis import emotions
+    for uid in _uids(args):
+        tally = emotions.rebuild(uid)
+        print(f"{uid}: {sum(tally['total'].values())} упоминаний эмоций")
+
+
+def cmd_rebuild_episodes(args) -> None:
+    from analysis import episodes
+    for uid in _uids(args):
+        flag = episodes.rebuild(uid, quiet=True)["flag"]
+        state = f"{flag['kind']} с {flag['since']}" if flag and flag["active"] else "сдвигов нет"
+        print(f"{uid}: {state}")
+
+
+def cmd_backfill(args) -> None:
+    from handlers import backfill
+    from utils import aio_storage, llm
+
+    last = [0.0]
+
+    async def show(p) -> None:
+        now = time.monotonic()
+        if now - last[0] >= 1 or p.done == p.total:
+            last[0] = now
+            print(f"\r{p}", end="", flush=True)
+
+    async def go():
+        try:
+            return await backfill.run(args.uid or None, workers=args.workers, rate=args.rate,
+                                      progress=show, retry_failed=args.retry_failed)
+        finally:
+            await llm.close()
+            await aio_storage.flush()
+
+    try:
+        p = asyncio.run(go())
+    except llm.LLMUnavailable as e:
+        raise SystemExit(f"\nдозаполнение прервано: {e}")
+    print(f"\r{p}" if p.total or p.skipped else "сны без метрик не найдены")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    cmds = parser.add_subparsers(dest="cmd", required=True)
+
+    p = cmds.add_parser("compact", help="слить старые файлы-записи в месячные сегменты")
+    p.add_argument("uid", type=int, nargs="*", help="id пользователей (по умолчанию все)")
+    p.set_defaults(func=cmd_compact)
+
+    p = cmds.add_parser("migrate-sqlite", help="перенести JSON-записи в SQLite (однократно)")
+    p.add_argument("uid", type=int, nargs="*", help="id пользователей (по умолчанию все)")
+    p.set_defaults(func=cmd_migrate_sqlite)
+
+    p = cmds.add_parser("rebuild-emotions", help="пересчитать счётчики эмоций снов")
+    p.add_argument("uid", type=int, nargs="*", help="id пользователей (по умолчанию все)")
+    p.set_defaults(func=cmd_rebuild_emotions)
+
+    p = cmds.add_parser("rebuild-episodes", help="пересобрать детектор сдвигов настроения")
+    p.add_argument("uid", type=int, nargs="*", help="id пользователей (по умолчанию все)")
+    p.set_defaults(func=cmd_rebuild_episodes)
+
+    p = cmds.add_parser("backfill", help="дозаполнить метрики снов, где их нет")
+    p.add_argument("uid", type=int, nargs="*", help="id пользователей (по умолчанию все)")
+    p.add_argument("--workers", type=int, default=ANALYSIS_WORKERS, help="запросов к модели одновременно")
+    p.add_argument("--rate", type=float, default=ANALYSIS_RATE, help="запросов в минуту (0 — без ограничения)")
+    p.add_argument("--retry-failed", action="store_true", help="повторить и сны, где метрик не было уже трижды")
+    p.set_defaults(func=cmd_backfill)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# tests/conftest.py
+# ───────────────────────────────────────────────────────────
+# Общая обвязка тестов: каталог данных во временной папке и пустые кэши
+# производных данных, чтобы тесты не видели data/ бота и друг друга.
+import sys, types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+try:
+    import Token  # noqa: F401
+except ImportError:                       # Token.py у каждого свой и в репозиторий не входит
+    Token = types.ModuleType("Token")
+    Token.API_TOKEN, Token.AUTHORIZED_USER_IDS, Token.OPENAI_API_KEY = "", [], ""
+    sys.modules["Token"] = Token
+
+# модуль → кэши в памяти процесса, привязанные к данным пользователей
+_CACHES = {
+    "utils.storage": ("_cache",),
+    "analysis.frame": ("_frames",),
+    "analysis.pyramid": ("_pyramids",),
+    "analysis.emotions": ("_tallies", "_matrices"),
+    "analysis.episodes": ("_states",),
+    "analysis.spectral": ("_cache",),
+    "analysis.lagcorr": ("_cache",),
+}
+
+
+def _clear_caches() -> None:
+    for name, attrs in _CACHES.items():
+        mod = sys.modules.get(name)
+        for attr in attrs if mod else ():
+            getattr(mod, attr).clear()
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    """Temporary BASE_DIR with the files backend and empty in-memory caches."""
+    import config
+    from utils import jobs, storage
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "files")
+    for mod in (config, storage, jobs):
+        monkeypatch.setattr(mod, "BASE_DIR", tmp_path)
+    backfill = sys.modules.get("handlers.backfill")
+    if backfill is not None:
+        monkeypatch.setattr(backfill, "_STATE", tmp_path / ".jobs" / "backfill.json")
+    _clear_caches()
+    yield tmp_path
+    _clear_caches()
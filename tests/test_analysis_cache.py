@@ -0,0 +1,74 @@
+import os
+
+from utils import analysis_cache, llm
+
+
+def _counts() -> tuple:
+    s = llm.stats()
+    return s.get("cache_hits", 0), s.get("cache_misses", 0)
+
+
+def test_hit_after_put_and_miss_before(base_dir):
+    k = analysis_cache.key("Мне снилось  МОРЕ\n", "prompt", "gpt-4o")
+    hits, misses = _counts()
+    assert analysis_cache.get(1, k) is None
+    analysis_cache.put(1, k, "разбор")
+    assert analysis_cache.get(1, k) == "разбор"
+    assert _counts() == (hits + 1, misses + 1)
+    assert analysis_cache.get(2, k) is None          # у каждого пользователя свой кэш
+
+
+def test_key_normalizes_text_but_not_prompt_or_model():
+    k = analysis_cache.key("Мне снилось  МОРЕ\n", "prompt", "gpt-4o")
+    assert analysis_cache.key("мне снилось море", "prompt", "gpt-4o") == k
+    assert analysis_cache.key("мне снилось море", "prompt v2", "gpt-4o") != k
+    assert analysis_cache.key("мне снилось море", "prompt", "gpt-4o-mini") != k
+    assert analysis_cache.key("мне снилось поле", "prompt", "gpt-4o") != k
+
+
+def test_least_recently_used_replies_are_pruned(base_dir, monkeypatch):
+    monkeypatch.setattr(analysis_cache, "DISK_BYTES", 300)
+    keys = [analysis_cache.key(f"сон {i}", "p", "m") for i in range(3)]
+    analysis_cache.put(1, keys[0], "x" * 100)
+    analysis_cache.put(1, keys[1], "x" * 100)
+    folder = analysis_cache._dir(1)
+    os.utime(folder / f"{keys[0]}.json", (1, 1))
+    os.utime(folder / f"{keys[1]}.json", (2, 2))
+    assert analysis_cache.get(1, keys[0]) is not None  # попадание освежает ответ
+    analysis_cache.put(1, keys[2], "x" * 100)
+    assert analysis_cache.get(1, keys[1]) is None
+    assert analysis_cache.get(1, keys[0]) is not None
+    assert analysis_cache.get(1, keys[2]) is not None
+
+
+def test_new_dream_is_looked_up_once(base_dir, monkeypatch):
+    import asyncio, types
+    from handlers import dreams
+
+    class Bot:
+        async def send_message(self, chat_id, text, **kwargs):
+            return types.SimpleNamespace(message_id=7)
+
+        async def edit_message_text(self, text, **kwargs):
+            pass
+
+    async def analyze(text, on_text=None):
+        return 'Разбор.\nMETRICS: {"intensity": 1, "emotions": ["покой"]}'
+
+    jobs = []
+
+    async def submit(job):
+        jobs.append(job)
+
+    monkeypatch.setattr(dreams, "_bot", Bot())
+    monkeypatch.setattr(dreams, "analyze", analyze)
+    monkeypatch.setattr(dreams.analysis_queue, "submit", submit)
+    monkeypatch.setattr(dreams.analysis_queue, "checkpoint", lambda: asyncio.sleep(0))
+    hits, misses = _counts()
+
+    async def go():
+        await dreams._commit(1, "новый сон", chat_id=1)
+        await dreams._run_job(jobs[0])
+    asyncio.run(go())
+    assert _counts() == (hits, misses + 1)
+    assert jobs[0]["message"] == 7
@@ -0,0 +1,92 @@
+import asyncio, json
+
+import pytest
+
+from handlers import backfill, dreams
+from utils import storage
+
+_REPLY = 'Разбор.\nMETRICS: {"intensity": 4, "emotions": ["страх"]}'
+
+
+def _dream(i: int, text: str, metrics=None) -> dict:
+    return {"id": f"d{i}", "date": "2024-01-0%d" % i, "dream": text, "analysis": "", "metrics": metrics or {}}
+
+
+def _seed() -> None:
+    storage.save_many(1, "dreams", "dream", [
+        _dream(1, "сон в очереди"),
+        _dream(2, "сон без метрик"),
+        _dream(3, "разобранный сон", {"intensity": 2, "emotions": ["покой"]}),
+        _dream(4, next(iter(dreams.LABELS.values()))),           # кнопка «нет сна»
+    ])
+
+
+def test_missing_skips_queued_and_filled_dreams(base_dir):
+    _seed()
+    assert [r["id"] for r in backfill.missing(1)] == ["d1", "d2"]
+    assert [r["id"] for r in backfill.missing(1, {"d1"})] == ["d2"]
+
+
+def test_run_leaves_queued_dreams_to_the_queue(base_dir, monkeypatch):
+    _seed()
+    queue = dreams.analysis_queue
+    queue.path.parent.mkdir(parents=True, exist_ok=True)
+    queue.path.write_text(json.dumps([{"id": "j1", "uid": 1, "record": "d1", "text": "сон в очереди"}]),
+                          encoding="utf-8")
+    sent = []
+
+    async def analyze(text, on_text=None):
+        sent.append(text)
+        return _REPLY
+    monkeypatch.setattr(dreams, "analyze", analyze)
+
+    p = asyncio.run(backfill.run([1], workers=2, rate=0))
+    assert sent == ["сон без метрик"]
+    assert (p.total, p.filled, p.failed) == (1, 1, 0)
+    recs = {r["id"]: r for r in storage.load_records(1, "dreams")}
+    assert recs["d2"]["metrics"]["emotions"] == ["страх"]
+    assert recs["d1"]["metrics"] == {}
+
+    # повторный запуск ничего не находит, а ответ уже лежит в кэше разборов
+    assert asyncio.run(backfill.run([1], rate=0)).total == 0
+    assert dreams._cached(1, "сон без метрик") == _REPLY
+
+
+def test_dreams_without_metrics_are_skipped_after_max_failures(base_dir, monkeypatch):
+    storage.save_json(1, "dreams", "dream", _dream(2, "сон без метрик"))
+
+    async def analyze(text, on_text=None):
+        return "Разбор без строки метрик."
+    monkeypatch.setattr(dreams, "analyze", analyze)
+    monkeypatch.setattr(dreams, "_cached", lambda uid, text: None)
+
+    for _ in range(backfill.MAX_FAILURES):
+        assert asyncio.run(backfill.run([1], rate=0)).failed == 1
+    p = asyncio.run(backfill.run([1], rate=0))
+    assert (p.total, p.skipped) == (0, 1)
+    assert asyncio.run(backfill.run([1], rate=0, retry_failed=True)).total == 1
+
+
+def test_request_errors_are_not_failures(base_dir, monkeypatch):
+    storage.save_json(1, "dreams", "dream", _dream(2, "сон без метрик"))
+
+    async def down(text, on_text=None):
+        raise ConnectionError("timeout")
+    monkeypatch.setattr(dreams, "analyze", down)
+    for _ in range(backfill.MAX_FAILURES + 1):
+        p = asyncio.run(backfill.run([1], rate=0))
+        assert (p.total, p.errors, p.failed, p.skipped) == (1, 1, 0, 0)
+
+
+def test_missing_api_key_aborts_the_run(base_dir, monkeypatch):
+    storage.save_many(1, "dreams", "dream", [_dream(1, "первый сон"), _dream(2, "второй сон")])
+    sent = []
+
+    async def no_key(text, on_text=None):
+        sent.append(text)
+        raise backfill.llm.LLMUnavailable("нет ключа")
+    monkeypatch.setattr(dreams, "analyze", no_key)
+    with pytest.raises(backfill.llm.LLMUnavailable):
+        asyncio.run(backfill.run([1], workers=1, rate=0))
+    assert len(sent) == 1
+    assert backfill._read_state()["failed"] == {}
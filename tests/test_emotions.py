@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from analysis import emotions
+from utils import storage
+
+
+def _dream(i: int, date: str, emos, intensity: int = 3) -> dict:
+    return {"id": f"d{i}", "date": date, "dream": f"сон {i}", "analysis": "",
+            "metrics": {"intensity": intensity, "emotions": emos} if emos else {}}
+
+
+def test_tallies_follow_an_update(base_dir, monkeypatch):
+    storage.save_many(1, "dreams", "dream", [
+        _dream(1, "2024-01-01", ["страх", "радость"], 4),
+        _dream(2, "2024-01-01", ["страх"], 2),
+        _dream(3, "2024-01-02", None),
+    ])
+    assert emotions.counts(1) == {"страх": 2, "радость": 1}
+
+    rebuild = emotions.rebuild
+    monkeypatch.setattr(emotions, "rebuild", lambda uid: pytest.fail("tally rebuilt"))
+    changed = {"d2": ["радость"], "d3": ["тоска"]}
+    storage.update_records(1, "dreams", lambda r: dict(
+        r, metrics={"intensity": 5, "emotions": changed[r["id"]]}) if r["id"] in changed else None)
+    storage.save_json(1, "dreams", "dream", _dream(4, "2024-01-03", ["страх"], 1))
+
+    assert emotions.counts(1) == {"страх": 2, "радость": 2, "тоска": 1}
+    assert emotions.counts(1, until=storage.parse_date("2024-01-01")) == {"страх": 1, "радость": 2}
+    incremental = emotions._tally(1)
+    m = emotions.matrix(1)
+
+    monkeypatch.setattr(emotions, "rebuild", rebuild)
+    emotions._tallies.clear()
+    emotions._matrices.clear()
+    fresh = emotions.rebuild(1)
+    for key in ("days", "total", "weights"):
+        assert incremental[key] == fresh[key]
+    assert fresh["weights"]["2024-01-01"] == {"страх": 4, "радость": 9}
+    expected = emotions.matrix(1)
+    assert list(m.days) == list(expected.days)
+    np.testing.assert_allclose(m.values, expected.values)
+    assert len(m.days) == 3 and m.values[0, emotions._EMO_INDEX["радость"]] == 4.5
@@ -0,0 +1,59 @@
+import datetime
+
+import numpy as np
+
+from analysis import episodes
+from utils import storage
+
+
+def _series(shift: float, params=("mood", "energy", "irritability"), days: int = 50, at: int = 40):
+    """Чек-ины до сегодняшнего дня: шум вокруг нуля, с дня `at` — сдвиг на shift."""
+    rng = np.random.default_rng(3)
+    start = datetime.date.today() - datetime.timedelta(days=days - 1)
+    out = []
+    for i in range(days):
+        rec = {"date": (start + datetime.timedelta(days=i)).isoformat()}
+        for p in params:
+            x = rng.normal(scale=0.7) + (shift if i >= at else 0.0)
+            rec[p] = round(float(np.clip(x, -3, 3)), 1)
+        out.append(rec)
+    return out
+
+
+def test_no_flag_without_shift(base_dir):
+    storage.save_many(1, "mood", "mood", _series(0.0))
+    assert episodes.current(1) is None
+    assert episodes.take_new_flag(1) is None
+
+
+def test_upward_shift_raises_mania_once(base_dir):
+    recs = _series(2.5)
+    for rec in recs:                      # по одному чек-ину, как в боте
+        storage.save_json(1, "mood", "mood", rec)
+    flag = episodes.current(1)
+    assert flag is not None and flag["kind"] == "mania"
+    assert flag["since"] >= recs[40]["date"]
+    assert len(flag["params"]) >= episodes.MIN_SIGNS and set(flag["params"]) <= episodes.MANIC
+
+    assert episodes.take_new_flag(1)["kind"] == "mania"
+    assert episodes.take_new_flag(1) is None
+
+    # пошаговое состояние совпадает с пересборкой по истории, отметка «сообщено» сохраняется
+    state = {k: v for k, v in episodes._state(1).items() if k != "sig"}
+    episodes._states.clear()
+    rebuilt = {k: v for k, v in episodes.rebuild(1).items() if k != "sig"}
+    assert rebuilt == state
+
+
+def test_downward_shift_is_depression(base_dir):
+    storage.save_many(1, "mood", "mood", _series(-2.5, params=("mood", "energy", "libido")))
+    flag = episodes.current(1)
+    assert flag is not None and flag["kind"] == "depression"
+
+
+def test_backdated_checkin_replays_history(base_dir):
+    recs = _series(0.0)
+    storage.save_many(1, "mood", "mood", recs[1:])
+    episodes.current(1)
+    storage.save_json(1, "mood", "mood", recs[0])
+    assert episodes._state(1)["params"]["mood"]["n"] == len(recs)
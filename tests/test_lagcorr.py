@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from analysis import lagcorr
+from utils import storage
+
+
+def test_lagged_correlation_matches_pandas(base_dir):
+    rng = np.random.default_rng(7)
+    days = pd.date_range("2024-01-01", periods=90, freq="D")
+    cim = pd.Series(rng.normal(size=len(days)), index=days)
+    mood = cim.shift(3) + rng.normal(scale=0.3, size=len(days))     # настроение через 3 дня после сна
+    energy = pd.Series(rng.normal(size=len(days)), index=days)
+    energy[mood.isna()] = np.nan                                     # дни без чек-инов
+    cim[::5] = np.nan                                                # дни без снов
+
+    storage.save_many(1, "mood", "mood", [
+        {"date": d.date().isoformat(), "mood": float(m), "energy": float(e)}
+        for d, m, e in zip(days, mood, energy) if not np.isnan(m)])
+    storage.save_many(1, "dreams", "dream", [
+        {"id": f"d{i}", "date": d.date().isoformat(), "dream": "сон", "metrics": {"cim_score": float(c)}}
+        for i, (d, c) in enumerate(cim.items()) if not np.isnan(c)])
+
+    result = lagcorr.correlations(1)
+    assert set(result) == {"mood", "energy"}
+    for param, series in (("mood", mood), ("energy", energy)):
+        lags, r, n = result[param]
+        assert list(lags) == list(range(-lagcorr.MAX_LAG, lagcorr.MAX_LAG + 1))
+        for k, rk, nk in zip(lags, r, n):
+            shifted = series.shift(-k)                   # param[t + k]
+            assert nk == (cim.notna() & shifted.notna()).sum()
+            np.testing.assert_allclose(rk, cim.corr(shifted), rtol=1e-9, atol=1e-12)
+    assert lagcorr.strongest(result["mood"])[0] == 3
+
+    # второй вызов — из кэша на диске, как в процессе рендера
+    lagcorr._cache.clear()
+    cached = lagcorr.correlations(1)
+    np.testing.assert_array_equal(cached["mood"][1], result["mood"][1])
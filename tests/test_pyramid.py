@@ -0,0 +1,61 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from analysis import frame, pyramid
+from utils import storage
+
+
+def _mood(day: datetime.date, i: int) -> dict:
+    return {"date": day.isoformat(), "mood": i % 7 - 3, "energy": (i * 3) % 7 - 3}
+
+
+def _dream(day: datetime.date, i: int, metrics: bool = True) -> dict:
+    rec = {"id": f"d{i}", "date": day.isoformat(), "dream": f"сон {i}", "analysis": "", "metrics": {}}
+    if metrics:
+        rec["metrics"] = {"intensity": i % 5 + 1, "emotions": ["страх"], "cim_score": float(i % 9 - 4)}
+    return rec
+
+
+def _rebuilt(uid: int) -> dict:
+    """Уровни пирамиды, собранные заново по всей истории."""
+    pyramid._pyramids.clear()
+    (storage.user_dir(uid) / ".cache" / "pyramid.pkl").unlink()
+    return {lvl: pyramid.level(uid, lvl) for lvl in pyramid.LEVELS}
+
+
+def test_incremental_pyramid_equals_rebuild(base_dir, monkeypatch):
+    start = datetime.date(2024, 1, 1)
+    storage.save_many(1, "mood", "mood", [_mood(start + datetime.timedelta(days=i), i) for i in range(40)])
+    storage.save_many(1, "dreams", "dream", [_dream(start + datetime.timedelta(days=2 * i), i) for i in range(10)])
+    pyramid.level(1, "D")                 # снимок, к которому дальше дописываются записи
+    build = pyramid._build
+    monkeypatch.setattr(pyramid, "_build", lambda df: pytest.fail("pyramid rebuilt"))
+
+    # новые дни, дни внутри уже собранных недель и месяцев, новый параметр
+    storage.save_json(1, "mood", "mood", dict(_mood(start + datetime.timedelta(days=3), 5), sleep=2))
+    storage.save_many(1, "mood", "mood", [_mood(start + datetime.timedelta(days=40 + i), i) for i in range(10)])
+    storage.save_json(1, "dreams", "dream", _dream(start + datetime.timedelta(days=45), 20, metrics=False))
+    storage.update_records(1, "dreams", lambda r: dict(_dream(start + datetime.timedelta(days=45), 20),
+                                                       id=r["id"]) if r["id"] == "d20" else None)
+    incremental = {lvl: pyramid.level(1, lvl) for lvl in pyramid.LEVELS}
+
+    monkeypatch.setattr(pyramid, "_build", build)
+    for lvl, df in _rebuilt(1).items():
+        # дописанные столбцы счётчиков могут стать float — сравниваем значения
+        pd.testing.assert_frame_equal(incremental[lvl].sort_index(axis=1), df.sort_index(axis=1),
+                                      check_dtype=False)
+    assert "sleep" in pyramid.columns(1)
+    assert pyramid.last_day(1) == pd.Timestamp(start + datetime.timedelta(days=49))
+
+
+def test_frame_snapshot_matches_records(base_dir):
+    start = datetime.date(2024, 3, 1)
+    storage.save_many(1, "mood", "mood", [_mood(start + datetime.timedelta(days=i), i) for i in range(5)])
+    frame.get_frame(1)
+    storage.save_json(1, "mood", "mood", _mood(start + datetime.timedelta(days=5), 5))
+    storage.save_json(1, "dreams", "dream", _dream(start, 1))
+    fresh = frame.from_records(storage.load_records(1, "mood"), storage.load_records(1, "dreams"))
+    frame._frames.clear()
+    pd.testing.assert_frame_equal(frame.get_frame(1), fresh)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from analysis import spectral
+
+
+def test_fft_uses_each_parameters_own_span():
+    rng = np.random.default_rng(1)
+    days = pd.date_range("2023-01-01", periods=499, freq="D")
+    mood = pd.Series(np.sin(2 * np.pi * np.arange(499) / 30) + rng.normal(scale=0.2, size=499), index=days)
+    custom = pd.Series(np.nan, index=days)
+    custom[300:] = np.sin(2 * np.pi * np.arange(199) / 10)          # параметр заведён позже
+    custom[310:320] = np.nan
+    daily = pd.DataFrame({"mood": mood, "custom1": custom}).drop(days[::4])
+
+    out = spectral._fft(daily)
+    for p in daily.columns:
+        # как прежний расчёт: np.interp от первого до последнего дня с данными
+        col = daily[p].dropna()
+        x = (col.index - col.index[0]).days.to_numpy()
+        y = np.interp(np.arange(x[-1] + 1), x, col.to_numpy()) - col.mean()
+        np.testing.assert_allclose(out[p][0], np.fft.rfftfreq(len(y), d=1)[1:])
+        np.testing.assert_allclose(out[p][1], np.abs(np.fft.rfft(y))[1:])
+    assert round(spectral.dominant(out["custom1"], 1)[0][0]) == 10
+    assert round(spectral.dominant(out["mood"], 1)[0][0]) == 29
@@ -0,0 +1,92 @@
+import json
+
+from utils import storage
+
+
+def test_records_go_to_monthly_segments(base_dir):
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-31", "mood": 1})
+    storage.save_many(1, "mood", "mood", [{"date": "2024-02-01", "mood": 2},
+                                          {"date": "2024-01-05", "mood": 3}])
+    folder = base_dir / "1" / "mood"
+    assert sorted(p.name for p in folder.iterdir()) == ["mood_202401.jsonl", "mood_202402.jsonl"]
+    lines = (folder / "mood_202401.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(x)["mood"] for x in lines] == [1, 3]
+    assert [r["mood"] for r in storage.load_records(1, "mood")] == [1, 3, 2]
+
+
+def test_torn_line_is_skipped(base_dir):
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-01", "mood": 1})
+    with (base_dir / "1" / "mood" / "mood_202401.jsonl").open("a", encoding="utf-8") as f:
+        f.write('{"date": "2024-01-02", "mo')
+    storage.invalidate(1, "mood")
+    assert [r["mood"] for r in storage.load_records(1, "mood")] == [1]
+
+
+def test_compact_merges_legacy_files_by_date(base_dir):
+    folder = base_dir / "1" / "mood"
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-10", "mood": 3})
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-03", "mood": 2})
+    (folder / "mood_20240103_080000.json").write_text(json.dumps({"mood": 1}), encoding="utf-8")
+    (folder / "mood_20240120_080000.json").write_text(
+        json.dumps({"date": "2024-01-20", "mood": 4}), encoding="utf-8")
+    (folder / "mood_20240301_080000.json").write_text(
+        json.dumps({"date": "2024-03-01", "mood": 5}), encoding="utf-8")
+
+    assert storage.compact(1, "mood") == 3
+    assert sorted(p.name for p in folder.iterdir()) == ["mood_202401.jsonl", "mood_202403.jsonl"]
+    recs = storage.load_records(1, "mood")
+    # за 2024-01-03 старый файл записан раньше сегмента и остаётся первым
+    assert [(r["date"], r["mood"]) for r in recs] == [
+        ("2024-01-03", 1), ("2024-01-03", 2), ("2024-01-10", 3), ("2024-01-20", 4), ("2024-03-01", 5)]
+    assert storage.compact(1, "mood") == 0
+
+
+def test_signature_before_write_reaches_listeners(base_dir):
+    seen = []
+
+    def listener(uid, sub, records, before):
+        seen.append((before, storage.signature(uid, sub)))
+
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-01", "mood": 1})
+    sig = storage.signature(1, "mood")
+    assert storage.signature(1, "mood") == sig
+    storage.on_save(listener)
+    try:
+        storage.save_json(1, "mood", "mood", {"date": "2024-01-02", "mood": 2})
+    finally:
+        storage._listeners.remove(listener)
+    assert seen == [(sig, storage.signature(1, "mood"))]
+    assert seen[0][1] != sig
+    assert storage.data_signature_before(1, "mood", sig) == (sig, storage.signature(1, "dreams"))
+
+
+def test_cache_round_trip_is_versioned(base_dir):
+    version = storage.data_version(1)
+    storage.store_cache(1, "probe", version, {"x": [1, 2]})
+    assert storage.load_cache(1, "probe", version) == {"x": [1, 2]}
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-01", "mood": 1})
+    assert storage.data_version(1) != version
+    assert storage.load_cache(1, "probe", storage.data_version(1)) is None
+    assert storage.load_cache(1, "missing", version) is None
+
+
+def test_user_ids_include_sqlite_users_without_a_directory(base_dir, monkeypatch):
+    import config
+    from utils import sqlite_store
+    storage.save_json(1, "mood", "mood", {"date": "2024-01-01", "mood": 1})   # каталог, ещё не перенесён
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(sqlite_store, "SQLITE_PATH", base_dir / "db.sqlite3")
+    monkeypatch.setattr(sqlite_store, "_local", type(sqlite_store._local)())
+    sqlite_store.insert(2, "dreams", {"date": "2024-01-01", "dream": "сон"})
+    sqlite_store.save_settings(3, {"morning": "08:00"})
+    assert storage.user_ids() == [1, 2, 3]
+
+
+def test_save_many_without_records_writes_nothing(base_dir):
+    seen = []
+    storage.on_save(lambda *args: seen.append(args))
+    try:
+        assert storage.save_many(1, "mood", "mood", []) == base_dir / "1" / "mood"
+    finally:
+        storage._listeners.pop()
+    assert seen == [] and storage.load_records(1, "mood") == []
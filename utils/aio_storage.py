@@ -0,0 +1,126 @@
+# utils/aio_storage.py
+# ───────────────────────────────────────────────────────────
+# Асинхронный фасад над utils.storage: чтение и тяжёлые операции с диском
+# идут в пул потоков, запись — через очередь write-behind. Хендлеры не
+# ждут диска: save_json() ставит запись в очередь, фоновая задача забирает
+# всё накопившееся разом и пишет group commit'ом (storage.save_many).
+# Чтения через call() сперва дожидаются записей того же пользователя,
+# так что только что сохранённый сон сразу виден в графиках.
+import asyncio, functools, logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import storage
+
+IO_WORKERS = 4
+
+log = logging.getLogger(__name__)
+_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="storage")
+
+
+async def run_io(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function in the storage thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, functools.partial(fn, *args, **kwargs))
+
+
+# ─────────────── очередь write-behind ──────────────────────
+class _WriteBehind:
+    def __init__(self) -> None:
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, int] = {}            # uid → записей в очереди
+
+    def put(self, uid: int, sub: str, prefix: str, data: Dict[str, Any]) -> asyncio.Future:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[uid] = self._pending.get(uid, 0) + 1
+        self._queue.put_nowait((uid, sub, prefix, data, fut))
+        return fut
+
+    async def _run(self) -> None:
+        q = self._queue
+        while True:
+            batch = [await q.get()]
+            while not q.empty():                       # group commit
+                batch.append(q.get_nowait())
+            groups: Dict[Tuple[int, str, str], List[tuple]] = {}
+            for item in batch:
+                groups.setdefault(item[:3], []).append(item)
+            for (uid, sub, prefix), items in groups.items():
+                try:
+                    path = await run_io(storage.save_many, uid, sub, prefix, [i[3] for i in items])
+                except Exception as e:
+                    log.exception("write-behind: не удалось сохранить %s/%s", uid, sub)
+                    result = e
+                else:
+                    result = path
+                for *_, fut in items:
+                    if not fut.done():
+                        if isinstance(result, Exception):
+                            fut.set_exception(result)
+                            fut.exception()                # никто не обязан ждать
+                        else:
+                            fut.set_result(result)
+                self._pending[uid] -= len(items)
+            for _ in batch:
+                q.task_done()
+
+    async def settled(self, uid: Optional[int] = None) -> None:
+        """Wait until queued writes (of one user or of everyone) hit the disk."""
+        if self._queue is None:
+            return
+        if uid is None or self._pending.get(uid):
+            await self._queue.join()
+
+    async def close(self) -> None:
+        await self.settled()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._queue = self._task = None
+
+
+_writer = _WriteBehind()
+
+
+# ─────────────── публичный API ─────────────────────────────
+def save_json(uid: int, sub: str, prefix: str, data: Dict[str, Any]) -> "asyncio.Future[Path]":
+    """Queue a record for writing; the returned future resolves to the segment path."""
+    return _writer.put(uid, sub, prefix, data)
+
+
+async def call(uid: int, fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking read of uid's data off the loop, after that user's pending writes."""
+    await _writer.settled(uid)
+    return await run_io(fn, *args, **kwargs)
+
+
+async def settled(uid: int) -> None:
+    """Wait until uid's queued writes are on disk (e.g. before another process reads them)."""
+    await _writer.settled(uid)
+
+
+async def load_records(uid: int, sub: str, **kwargs) -> List[Dict[str, Any]]:
+    return await call(uid, storage.load_records, uid, sub, **kwargs)
+
+
+async def update_records(uid: int, sub: str, fn: storage.RecordUpdate) -> int:
+    """storage.update_records off the loop, after uid's queued appends are written."""
+    return await call(uid, storage.update_records, uid, sub, fn)
+
+
+async def flush() -> None:
+    await _writer.settled()
+
+
+async def shutdown() -> None:
+    """Flush the write-behind queue and stop the I/O pool (call from bot.main)."""
+    await _writer.close()
+    _pool.shutdown(wait=True)
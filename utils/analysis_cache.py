@@ -0,0 +1,80 @@
+# utils/analysis_cache.py
+# ───────────────────────────────────────────────────────────
+# Кэш ответов модели на тексты снов: повторно отправленный сон (повтор после
+# ошибки, дважды /dream с тем же текстом) не оплачивается заново и
+# разбирается за миллисекунды. Ключ — sha256 нормализованного текста
+# (NFC, casefold, пробелы схлопнуты) вместе с промптом и моделью, так что
+# смена промпта или модели сама делает старые ответы недоступными.
+# Ответы лежат в data/<uid>/.cache/analyses/<ключ>.json; попадание
+# обновляет mtime, и при записи самые давние удаляются сверх DISK_BYTES.
+# Попадания и промахи считаются в счётчиках utils.llm.stats().
+import hashlib, json, os, re, threading, time, unicodedata
+from pathlib import Path
+from typing import Optional
+
+from utils import llm, storage
+
+DISK_BYTES = 4 * 1024 * 1024      # на одного пользователя
+
+_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    """Text as it is compared for deduplication."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text).casefold()).strip()
+
+
+def key(text: str, prompt: str, model: str) -> str:
+    """Cache key of a model reply to text under prompt and model."""
+    raw = "\0".join((model, prompt, normalize(text)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dir(uid: int) -> Path:
+    return storage.user_dir(uid) / ".cache" / "analyses"
+
+
+def get(uid: int, k: str) -> Optional[str]:
+    """The cached reply for key k, or None."""
+    fp = _dir(uid) / f"{k}.json"
+    try:
+        raw = json.loads(fp.read_text(encoding="utf-8"))["raw"]
+        os.utime(fp)                   # давно не нужные уйдут первыми
+    except (OSError, ValueError, KeyError, TypeError):
+        llm.count("cache_misses")
+        return None
+    llm.count("cache_hits")
+    return raw
+
+
+def _prune(folder: Path) -> None:
+    """Удаляет самые давно использованные ответы сверх DISK_BYTES."""
+    files = []
+    for e in os.scandir(folder):
+        if e.name.endswith(".json") and not e.name.startswith("."):
+            st = e.stat()
+            files.append((st.st_mtime_ns, st.st_size, e.path))
+    total = sum(f[1] for f in files)
+    for _, size, path in sorted(files):
+        if total <= DISK_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def put(uid: int, k: str, raw: str) -> None:
+    """Remember a model reply under key k."""
+    fp = _dir(uid) / f"{k}.json"
+    try:
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fp.with_name(f".{fp.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"raw": raw, "created": time.time()}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, fp)
+        with _lock:
+            _prune(fp.parent)
+    except OSError:
+        pass                          # без кэша просто заплатим ещё раз
@@ -0,0 +1,161 @@
+# utils/jobs.py
+# ───────────────────────────────────────────────────────────
+# Постоянная очередь фоновых заданий (разбор снов моделью). Пока задание
+# не выполнено, оно лежит в data/.jobs/<name>.json: файл переписывается
+# атомарно при постановке и снятии задания, поэтому после перезапуска
+# start() подхватывает всё, что не успело выполниться (задание может
+# выполниться повторно, если бот упал посреди него). Обработку ведут
+# `workers` корутин, RateLimiter разносит начала заданий не чаще `rate`
+# в минуту. Упавшее задание повторяется с растущей паузой до RETRIES раз;
+# что обработчик успел дописать в словарь задания, сохраняется для повтора,
+# а checkpoint() сохраняет это сразу — на случай перезапуска посреди задания.
+import asyncio, json, logging, os, threading, time, uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import BASE_DIR
+from utils.aio_storage import run_io
+
+RETRIES = 3
+RETRY_DELAY = 30                # секунд до первого повтора, дальше вдвое больше
+
+log = logging.getLogger(__name__)
+
+Job = Dict[str, Any]
+Handler = Callable[[Job], Awaitable[None]]
+
+
+class RateLimiter:
+    """Spaces acquisitions evenly so that at most `rate` happen per minute (0 — no limit)."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 60.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class JobQueue:
+    """Persistent queue of jobs processed by a bounded pool of coroutines."""
+
+    def __init__(self, name: str, handler: Handler, workers: int, rate: float) -> None:
+        self.name = name
+        self.workers = max(1, workers)
+        self._handler = handler
+        self._limiter = RateLimiter(rate)
+        self._jobs: Dict[str, Job] = {}             # id → ещё не выполненное задание
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._save_lock: Optional[asyncio.Lock] = None
+        self._loaded = False
+
+    @property
+    def path(self) -> Path:
+        return BASE_DIR / ".jobs" / f"{self.name}.json"
+
+    # ─── файл заданий ───
+    def _read(self) -> List[Job]:
+        try:
+            jobs = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        return [j for j in jobs if isinstance(j, dict) and j.get("id")]
+
+    def _write(self, text: str) -> None:
+        p = self.path
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f".{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, p)
+
+    async def _load(self) -> None:
+        if not self._loaded:
+            for job in await run_io(self._read):
+                self._jobs.setdefault(job["id"], job)
+            self._loaded = True
+
+    async def _persist(self) -> None:
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+        async with self._save_lock:          # снимок внутри замка — старый не перетрёт новый
+            text = json.dumps(list(self._jobs.values()), ensure_ascii=False)
+            await run_io(self._write, text)
+
+    # ─── публичный API ───
+    async def start(self) -> int:
+        """Load unfinished jobs, start the workers and return how many jobs were resumed."""
+        await self._load()
+        self._queue = asyncio.Queue()
+        for jid in self._jobs:
+            self._queue.put_nowait(jid)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return len(self._jobs)
+
+    async def submit(self, job: Job) -> str:
+        """Persist a job and queue it; returns the job id."""
+        await self._load()
+        jid = uuid.uuid4().hex
+        self._jobs[jid] = dict(job, id=jid, tries=0, created=time.time())
+        await self._persist()
+        if self._queue is not None:
+            self._queue.put_nowait(jid)
+        return jid
+
+    async def checkpoint(self) -> None:
+        """Persist unfinished jobs as they are now (with progress handlers wrote into them)."""
+        await self._persist()
+
+    def stored(self) -> List[Job]:
+        """Unfinished jobs as saved on disk (readable from another process)."""
+        return self._read()
+
+    def pending(self, uid: Optional[int] = None) -> int:
+        """Number of unfinished jobs (of one user, if given)."""
+        return sum(1 for j in self._jobs.values() if uid is None or j.get("uid") == uid)
+
+    async def join(self) -> None:
+        """Wait until everything currently queued has been processed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Stop the workers; unfinished jobs stay on disk for the next start()."""
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self) -> None:
+        q = self._queue
+        while True:
+            jid = await q.get()
+            try:
+                job = self._jobs.get(jid)
+                if job is None:
+                    continue
+                await self._limiter.wait()
+                try:
+                    await self._handler(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    job["tries"] = job.get("tries", 0) + 1
+                    log.exception("%s: задание %s упало (попытка %d)", self.name, jid, job["tries"])
+                    if job["tries"] < RETRIES:
+                        await self._persist()
+                        delay = RETRY_DELAY * 2 ** (job["tries"] - 1)
+                        asyncio.get_running_loop().call_later(delay, q.put_nowait, jid)
+                        continue
+                    log.error("%s: задание %s снято после %d попыток", self.name, jid, RETRIES)
+                self._jobs.pop(jid, None)
+                await self._persist()
+            finally:
+                q.task_done()
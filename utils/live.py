@@ -0,0 +1,93 @@
+# utils/live.py
+# ───────────────────────────────────────────────────────────
+# Сообщение, которое дописывается по мере генерации текста: заглушка
+# уходит сразу, дальше edit_message_text не чаще EDIT_INTERVAL секунд —
+# Telegram ограничивает частоту правок, а TelegramRetryAfter просто
+# откладывает следующую. Промежуточные правки идут без разметки, чтобы
+# незакрытый тег не ломал запрос; итоговый текст — с разметкой бота, и
+# если он не помещается в одно сообщение, остаток досылает send_long.
+import asyncio
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from utils import MAX_MESSAGE_LENGTH, send_long, split_first
+
+EDIT_INTERVAL = 1.5              # секунд между правками одного сообщения
+CURSOR = " ▍"
+FINISH_ATTEMPTS = 3
+
+
+class LiveMessage:
+    """A Telegram message progressively edited while its text is being generated."""
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: Optional[int] = None,
+                 interval: float = EDIT_INTERVAL) -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._next = 0.0
+        self._shown = ""
+        self._frozen = False         # текст перерос одно сообщение — дальше ждём финала
+
+    async def start(self, text: str, **kwargs) -> int:
+        """Send the placeholder and return its message id."""
+        msg = await self.bot.send_message(self.chat_id, text, parse_mode=None, **kwargs)
+        self.message_id = msg.message_id
+        self._shown = text
+        self._next = asyncio.get_running_loop().time() + self.interval
+        return self.message_id
+
+    def due(self) -> bool:
+        """Whether update() would edit the message right now."""
+        return not self._frozen and asyncio.get_running_loop().time() >= self._next
+
+    async def update(self, text: str) -> None:
+        """Show the text generated so far (skipped if the last edit was too recent)."""
+        if not self.due():
+            return
+        if len(text) + len(CURSOR) > MAX_MESSAGE_LENGTH:
+            text, _ = split_first(text)
+            self._frozen = True
+        else:
+            text += CURSOR
+        try:
+            await self._edit(text, parse_mode=None)
+        except TelegramRetryAfter as e:
+            self._next = asyncio.get_running_loop().time() + e.retry_after
+        except TelegramBadRequest:
+            pass                     # промежуточная правка не обязательна
+
+    async def finish(self, text: str) -> None:
+        """Replace the message with the final text; overflow goes out via send_long."""
+        first, rest = split_first(text)
+        for attempt in range(FINISH_ATTEMPTS):
+            try:
+                await self._edit(first)
+                break
+            except TelegramRetryAfter as e:
+                if attempt == FINISH_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "parse" in str(e).lower():
+                    await self._edit(first, parse_mode=None)   # разметка модели не разобралась
+                else:
+                    rest = text                 # заглушку удалили — шлём заново целиком
+                break
+        if rest:
+            await send_long(self.bot, self.chat_id, rest)
+
+    async def _edit(self, text: str, **kwargs) -> None:
+        if text == self._shown:
+            return
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id,
+                                             message_id=self.message_id, **kwargs)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                raise
+        self._shown = text
+        self._next = asyncio.get_running_loop().time() + self.interval
@@ -0,0 +1,180 @@
+# utils/llm.py
+# ───────────────────────────────────────────────────────────
+# Общий клиент модели для анализа снов. AsyncOpenAI создаётся один раз на
+# event loop и держит пул соединений, так что каждый сон не платит за новое
+# TCP/TLS-соединение. Таймауты и число повторов (с экспоненциальной паузой
+# самого SDK) берутся из config; LLM_BASE_URL позволяет подставить вместо
+# API локальную заглушку (benchmarks/stub_llm.py).
+# Каждый вызов пишет в гистограммы задержку и расход токенов — stats();
+# у потоковых вызовов (stream_chat) ещё и время до первого фрагмента.
+import asyncio, bisect, logging, os, threading, time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from openai import AsyncOpenAI, Timeout
+
+from config import LLM_BASE_URL, LLM_CONNECT_TIMEOUT, LLM_MODEL, LLM_RETRIES, LLM_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)          # секунды
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 3500, 8000)
+
+
+class LLMUnavailable(RuntimeError):
+    """No API key and no local base URL configured."""
+
+
+# ─────────────── гистограммы ───────────────────────────────
+class Histogram:
+    """Fixed-bucket histogram; the last bucket collects everything above."""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.n = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.n += 1
+        self.total += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None if empty or beyond the last bound)."""
+        if not self.n:
+            return None
+        need, seen = q * self.n, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= need:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.n,
+            "mean": self.total / self.n if self.n else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(zip([*map(str, self.bounds), "inf"], self.counts)),
+        }
+
+
+_lock = threading.Lock()
+_hist = {
+    "latency": Histogram(LATENCY_BUCKETS),
+    "ttft": Histogram(LATENCY_BUCKETS),
+    "prompt_tokens": Histogram(TOKEN_BUCKETS),
+    "completion_tokens": Histogram(TOKEN_BUCKETS),
+}
+_counters = {"calls": 0, "errors": 0}
+
+
+def observe(name: str, value: float) -> None:
+    """Add a value to one of the named histograms."""
+    with _lock:
+        _hist[name].observe(value)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Increment a named counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def stats() -> Dict[str, Any]:
+    """Counters and histogram snapshots of all calls so far."""
+    with _lock:
+        out: Dict[str, Any] = dict(_counters)
+        out.update({name: h.snapshot() for name, h in _hist.items()})
+    return out
+
+
+# ─────────────── клиент ────────────────────────────────────
+_client: Optional[AsyncOpenAI] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _api_key() -> Optional[str]:
+    try:
+        from Token import OPENAI_API_KEY
+    except ImportError:
+        OPENAI_API_KEY = None
+    return OPENAI_API_KEY or os.getenv("OPENAI_API_KEY")
+
+
+def client() -> AsyncOpenAI:
+    """The shared client of the running event loop (created on first use)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        key = _api_key()
+        if not key and not LLM_BASE_URL:
+            raise LLMUnavailable("Фича с анализом снов через чатгпт пока не работает.")
+        # пул соединений привязан к loop'у — в новом loop'е (CLI, тесты) свой клиент
+        _client = AsyncOpenAI(
+            api_key=key or "local",
+            base_url=LLM_BASE_URL,
+            timeout=Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            max_retries=LLM_RETRIES,
+        )
+        _client_loop = loop
+    return _client
+
+
+async def chat(messages: List[Dict[str, str]], **params) -> str:
+    """Run one chat completion with the shared client and record its metrics."""
+    params.setdefault("model", LLM_MODEL)
+    c = client()
+    count("calls")
+    t0 = time.perf_counter()
+    try:
+        resp = await c.chat.completions.create(messages=messages, **params)
+    except Exception:
+        count("errors")
+        raise
+    finally:
+        observe("latency", time.perf_counter() - t0)
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        observe("prompt_tokens", usage.prompt_tokens or 0)
+        observe("completion_tokens", usage.completion_tokens or 0)
+    return (resp.choices[0].message.content or "").strip()
+
+
+async def stream_chat(messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+    """Stream a chat completion as text fragments, recording time to first token."""
+    params.setdefault("model", LLM_MODEL)
+    c = client()
+    count("calls")
+    t0 = time.perf_counter()
+    first = True
+    try:
+        stream = await c.chat.completions.create(
+            messages=messages, stream=True, stream_options={"include_usage": True}, **params)
+        async for chunk in stream:
+            if chunk.usage is not None:
+                observe("prompt_tokens", chunk.usage.prompt_tokens or 0)
+                observe("completion_tokens", chunk.usage.completion_tokens or 0)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if first:
+                    observe("ttft", time.perf_counter() - t0)
+                    first = False
+                yield delta
+    except Exception:
+        count("errors")
+        raise
+    finally:
+        observe("latency", time.perf_counter() - t0)
+
+
+async def close() -> None:
+    """Close the shared client's connection pool."""
+    global _client, _client_loop
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception:
+            log.exception("llm: не удалось закрыть клиент")
+    _client = _client_loop = None
@@ -0,0 +1,234 @@
+# utils/sqlite_store.py
+# ───────────────────────────────────────────────────────────
+# SQLite-бэкенд хранилища (STORAGE_BACKEND=sqlite). Запись целиком лежит
+# в колонке data как JSON, а uid/date вынесены в индексируемые колонки,
+# поэтому выборки по диапазону дат и «запись за день» идут по индексу
+# (uid, date), а не перебором всей истории. Счётчики эмоций снов ведёт
+# analysis.emotions поверх любого бэкенда.
+import datetime, json, sqlite3, threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import SQLITE_PATH
+from utils.storage import load_file_records, parse_date, user_dir
+
+TABLES = ("mood", "dreams")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mood (
+    id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid  INTEGER NOT NULL,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mood_uid_date ON mood(uid, date);
+
+CREATE TABLE IF NOT EXISTS dreams (
+    id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid  INTEGER NOT NULL,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dreams_uid_date ON dreams(uid, date);
+
+-- индекс эмоций прежних версий: его заменили счётчики analysis.emotions
+DROP TABLE IF EXISTS dream_emotions;
+
+-- счётчик изменений уже сохранённых записей: входит в подпись (uid, sub)
+CREATE TABLE IF NOT EXISTS revisions (
+    uid INTEGER NOT NULL,
+    sub TEXT NOT NULL,
+    n   INTEGER NOT NULL,
+    PRIMARY KEY (uid, sub)
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    uid  INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+_local = threading.local()   # по соединению на поток
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(str(SQLITE_PATH), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _table(sub: str) -> str:
+    if sub not in TABLES:
+        raise ValueError(f"unknown record kind: {sub}")
+    return sub
+
+
+def _iso(value: Any) -> Optional[str]:
+    d = parse_date(value)
+    return d.isoformat() if d else None
+
+
+def _range(since: Optional[datetime.date], until: Optional[datetime.date]):
+    sql, args = "", []
+    if since is not None:
+        sql += " AND date >= ?"
+        args.append(since.isoformat())
+    if until is not None:
+        sql += " AND date <= ?"
+        args.append(until.isoformat())
+    return sql, args
+
+
+# ─────────────── запись ────────────────────────────────────
+def _insert(conn: sqlite3.Connection, uid: int, sub: str, data: Dict[str, Any]) -> int:
+    date = _iso(data.get("date"))
+    cur = conn.execute(
+        f"INSERT INTO {_table(sub)} (uid, date, data) VALUES (?, ?, ?)",
+        (uid, date, json.dumps(data, ensure_ascii=False)),
+    )
+    return cur.lastrowid
+
+
+def insert(uid: int, sub: str, data: Dict[str, Any]) -> int:
+    """Insert one record and return its row id."""
+    conn = _conn()
+    with conn:
+        return _insert(conn, uid, sub, data)
+
+
+def insert_many(uid: int, sub: str, records: List[Dict[str, Any]]) -> None:
+    """Insert several records in one transaction (group commit)."""
+    conn = _conn()
+    with conn:
+        for data in records:
+            _insert(conn, uid, sub, data)
+
+
+def update(uid: int, sub: str, fn) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Apply fn to every record of a user, store the changed ones in one transaction
+    and return them as (old, new) pairs."""
+    table = _table(sub)
+    conn = _conn()
+    changed = []
+    with conn:
+        rows = conn.execute(f"SELECT id, data FROM {table} WHERE uid = ? ORDER BY id", (uid,)).fetchall()
+        for row_id, data in rows:
+            old = json.loads(data)
+            new = fn(dict(old))
+            if new is None:
+                continue
+            conn.execute(f"UPDATE {table} SET date = ?, data = ? WHERE id = ?",
+                         (_iso(new.get("date")), json.dumps(new, ensure_ascii=False), row_id))
+            changed.append((old, new))
+        if changed:
+            conn.execute(
+                "INSERT INTO revisions (uid, sub, n) VALUES (?, ?, 1) "
+                "ON CONFLICT(uid, sub) DO UPDATE SET n = n + 1",
+                (uid, table),
+            )
+    return changed
+
+
+# ─────────────── чтение ────────────────────────────────────
+def load(uid: int, sub: str,
+         since: Optional[datetime.date] = None,
+         until: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+    """Records of a user in insertion order, optionally within [since, until]."""
+    where, args = _range(since, until)
+    rows = _conn().execute(
+        f"SELECT data FROM {_table(sub)} WHERE uid = ?{where} ORDER BY id",
+        [uid, *args],
+    )
+    return [json.loads(r[0]) for r in rows]
+
+
+def iterate(uid: int, sub: str,
+            since: Optional[datetime.date] = None,
+            until: Optional[datetime.date] = None) -> Iterator[Dict[str, Any]]:
+    """Lazy variant of load(): rows are decoded as the caller consumes them."""
+    where, args = _range(since, until)
+    cur = _conn().execute(
+        f"SELECT data FROM {_table(sub)} WHERE uid = ?{where} ORDER BY id",
+        [uid, *args],
+    )
+    for (data,) in cur:
+        yield json.loads(data)
+
+
+def signature(uid: int, sub: str) -> tuple:
+    """(max id, count, revision) of a user's rows — changes on every insert, delete or update."""
+    conn = _conn()
+    row = conn.execute(
+        f"SELECT MAX(id), COUNT(*) FROM {_table(sub)} WHERE uid = ?", (uid,)
+    ).fetchone()
+    rev = conn.execute("SELECT n FROM revisions WHERE uid = ? AND sub = ?", (uid, sub)).fetchone()
+    return ("sqlite", *row, rev[0] if rev else 0)
+
+
+def user_ids() -> List[int]:
+    """Ids of all users with records or settings in the database."""
+    rows = _conn().execute("SELECT uid FROM mood UNION SELECT uid FROM dreams UNION SELECT uid FROM settings")
+    return sorted(r[0] for r in rows)
+
+
+def find(uid: int, sub: str, date_iso: str) -> Optional[Dict[str, Any]]:
+    """First record stored for the given date."""
+    row = _conn().execute(
+        f"SELECT data FROM {_table(sub)} WHERE uid = ? AND date = ? ORDER BY id LIMIT 1",
+        (uid, _iso(date_iso)),
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+# ─────────────── настройки ─────────────────────────────────
+def load_settings(uid: int) -> dict:
+    row = _conn().execute("SELECT data FROM settings WHERE uid = ?", (uid,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def save_settings(uid: int, data: dict) -> None:
+    conn = _conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO settings (uid, data) VALUES (?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET data = excluded.data",
+            (uid, json.dumps(data, ensure_ascii=False)),
+        )
+
+
+# ─────────────── миграция из data/<uid>/… ──────────────────
+def migrate(uid: int) -> Dict[str, int]:
+    """
+    Одноразово переносит JSON-файлы пользователя в базу. Таблица, в которой
+    у пользователя уже есть записи, пропускается, так что повторный запуск
+    ничего не дублирует. Возвращает число перенесённых записей по таблицам.
+    """
+    conn = _conn()
+    done: Dict[str, int] = {}
+    with conn:
+        for sub in TABLES:
+            if conn.execute(f"SELECT 1 FROM {sub} WHERE uid = ? LIMIT 1", (uid,)).fetchone():
+                done[sub] = 0
+                continue
+            recs = load_file_records(uid, sub)
+            for rec in recs:
+                _insert(conn, uid, sub, rec)
+            done[sub] = len(recs)
+
+        p = user_dir(uid) / "settings.json"
+        exists = conn.execute("SELECT 1 FROM settings WHERE uid = ?", (uid,)).fetchone()
+        if p.exists() and not exists:
+            try:
+                data = json.loads(p.read_text())
+            except Exception:
+                data = {}
+            conn.execute(
+                "INSERT INTO settings (uid, data) VALUES (?, ?)",
+                (uid, json.dumps(data, ensure_ascii=False)),
+            )
+    return done
@@ -1,11 +1,24 @@
 # utils/storage.py
 # ───────────────────────────────────────────────────────────
-import datetime, json
+# Записи хранятся в месячных сегментах <sub>/<prefix>_YYYYMM.jsonl
+# (одна JSON-строка на запись, только дописывание). Старые файлы
+# «одна запись — один файл» (<prefix>_YYYYMMDD_HHMMSS.json) читаются
+# как раньше и сливаются в сегменты командой `python maintenance.py compact`.
+# При STORAGE_BACKEND=sqlite те же функции работают через utils/sqlite_store.py.
+import calendar, datetime, hashlib, json, logging, os, pickle, threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import config
 from config import BASE_DIR
 
+SEGMENT_SUFFIX = ".jsonl"
+CACHE_SIZE = 64          # сколько пар (uid, sub) держать в памяти
+
+log = logging.getLogger(__name__)
+
+
 # ───────────────────────────────────────────────────────────
 def user_dir(uid: int) -> Path:
     p = BASE_DIR / str(uid)
@@ -13,58 +26,528 @@ def user_dir(uid: int) -> Path:
     return p
 
 
-# ─────────────── запись отдельного JSON-файла ──────────────
-def save_json(uid: int, sub: str, prefix: str, data: Dict[str, Any]) -> Path:
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    folder = user_dir(uid) / sub
-    folder.mkdir(exist_ok=True)
+def user_ids() -> List[int]:
+    """Return ids of all users that have a data directory (or rows in SQLite)."""
+    ids = set()
+    if BASE_DIR.exists():
+        ids.update(int(p.name) for p in BASE_DIR.iterdir() if p.is_dir() and p.name.isdigit())
+    db = _sqlite()
+    if db:
+        ids.update(db.user_ids())      # у пользователя может не быть каталога
+    return sorted(ids)
+
+
+def _sqlite():
+    """Модуль SQLite-бэкенда, если он выбран в config.STORAGE_BACKEND."""
+    if config.STORAGE_BACKEND != "sqlite":
+        return None
+    from utils import sqlite_store
+    return sqlite_store
+
+
+def _prefix(sub: str) -> str:
+    return sub[:-1] if sub.endswith("s") else sub
+
+
+def parse_date(value: Any) -> Optional[datetime.date]:
+    """ISO-дата или YYYYMMDD… → date; всё остальное → None."""
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        try:
+            return datetime.datetime.strptime(str(value)[:8], "%Y%m%d").date()
+        except ValueError:
+            return None
+
+
+def _is_segment(fp: Path) -> bool:
+    return fp.suffix == SEGMENT_SUFFIX
+
+
+def _legacy_date(fp: Path) -> Optional[str]:
+    """Дата из имени старого файла <prefix>_YYYYMMDD[_HHMMSS].json."""
+    parts = fp.stem.split("_")
+    if len(parts) < 2:
+        return None
+    d = parse_date(parts[1])
+    return d.isoformat() if d else None
+
+
+def _dump(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def _atomic_write(fp: Path, text: Union[str, bytes]) -> None:
+    """Записать файл целиком через временный файл и os.replace."""
+    # точка — чтобы не попасть в glob; pid/поток — чтобы писатели не мешали друг другу
+    tmp = fp.with_name(f".{fp.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    with tmp.open("wb") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fp)
+
+
+# ─────────────── подписчики на новые записи ────────────────
+# Производные данные (аналитический DataFrame и т.п.) обновляются
+# инкрементально: после каждой записи подписчик получает новые записи и
+# подпись (uid, sub) *до* записи — по ней он проверяет, что его состояние
+# было актуальным и к нему достаточно дописать новые строки.
+# Перезапись уже сохранённых записей (update_records) приходит подписчикам
+# on_update парами (старая, новая запись); кто не подписан, просто видит
+# чужую подпись и пересобирается по запросу.
+SaveListener = Callable[[int, str, List[Dict[str, Any]], tuple], None]
+UpdateListener = Callable[[int, str, List[Tuple[Dict[str, Any], Dict[str, Any]]], tuple], None]
+_listeners: List[SaveListener] = []
+_update_listeners: List[UpdateListener] = []
+
+
+def on_save(fn: SaveListener) -> SaveListener:
+    """Register a listener called after records are appended (usable as decorator)."""
+    _listeners.append(fn)
+    return fn
+
+
+def on_update(fn: UpdateListener) -> UpdateListener:
+    """Register a listener called with (old, new) pairs after records are rewritten."""
+    _update_listeners.append(fn)
+    return fn
+
+
+def _notify(uid: int, sub: str, records: list, before: tuple,
+            listeners: Optional[list] = None) -> None:
+    for fn in _listeners if listeners is None else listeners:
+        try:
+            fn(uid, sub, records, before)
+        except Exception:
+            log.exception("save listener %s failed", getattr(fn, "__name__", fn))
+
+
+# ─────────────── дописывание записей в сегменты ────────────
+# Запись и её подписчики идут под одним замком: перезапись сегмента
+# (update_records) не потеряет дописанную в это время строку, а подпись
+# «до» у подписчика относится ровно к его записи, а не к соседней.
+_write_lock = threading.Lock()
 
-    fp = folder / f"{prefix}_{ts}.json"
-    fp.write_text(json.dumps(data, ensure_ascii=False) + "\n", encoding="utf-8")
+
+def save_many(uid: int, sub: str, prefix: str, records: List[Dict[str, Any]]) -> Path:
+    """
+    Group commit: записи раскладываются по месячным сегментам и дописываются
+    одним write() + fsync на сегмент. Оборванная при сбое строка потом просто
+    пропускается читателем. Возвращает путь последнего сегмента (для пустого
+    списка — каталог записей, ничего не записывая).
+    """
+    if not records:
+        return config.SQLITE_PATH if _sqlite() else user_dir(uid) / sub
+    with _write_lock:
+        before = signature(uid, sub) if _listeners else ()
+        invalidate(uid, sub)
+        db = _sqlite()
+        if db:
+            db.insert_many(uid, sub, records)
+            _notify(uid, sub, records, before)
+            return config.SQLITE_PATH
+
+        folder = user_dir(uid) / sub
+        folder.mkdir(exist_ok=True)
+
+        groups: Dict[Path, List[str]] = {}
+        for data in records:
+            day = parse_date(data.get("date")) or datetime.date.today()
+            fp = folder / f"{prefix}_{day.strftime('%Y%m')}{SEGMENT_SUFFIX}"
+            groups.setdefault(fp, []).append(_dump(data))
+        for fp, lines in groups.items():
+            with fp.open("a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+        _notify(uid, sub, records, before)
     return fp
 
 
+def save_json(uid: int, sub: str, prefix: str, data: Dict[str, Any]) -> Path:
+    """Append a record to the monthly segment of its date and return the segment path."""
+    return save_many(uid, sub, prefix, [data])
+
+
+# ─────────────── изменение сохранённых записей ──────────────
+RecordUpdate = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def update_records(uid: int, sub: str, fn: RecordUpdate) -> int:
+    """
+    Rewrite records in place: fn gets each record and returns its new version
+    (or None to keep it). Only files with changed records are rewritten,
+    atomically; on_update listeners get the (old, new) pairs. Returns the
+    number of changed records.
+    """
+    with _write_lock:
+        before = signature(uid, sub) if _update_listeners else ()
+        invalidate(uid, sub)
+        db = _sqlite()
+        pairs = db.update(uid, sub, fn) if db else _rewrite(uid, sub, fn)
+        invalidate(uid, sub)
+        if pairs:
+            _notify(uid, sub, pairs, before, _update_listeners)
+    return len(pairs)
+
+
+def _rewrite(uid: int, sub: str, fn: RecordUpdate) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """update_records() для файлов; вызывать под _write_lock."""
+    folder = user_dir(uid) / sub
+    if not folder.exists():
+        return []
+    pairs = []
+    for fp in _files(folder, sub):
+        legacy_date = None if _is_segment(fp) else _legacy_date(fp)
+        lines: List[bytes] = []
+        hits = 0
+        with fp.open("rb") as f:
+            for raw in f:
+                try:
+                    rec = json.loads(raw.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    rec = None                   # битую строку переносим как есть
+                new = fn(dict(rec)) if isinstance(rec, dict) and "enc" not in rec else None
+                if new is None:
+                    lines.append(raw if raw.endswith(b"\n") else raw + b"\n")
+                    continue
+                lines.append(_dump(new).encode("utf-8"))
+                hits += 1
+                # подписчикам — записи такими, какими их отдаёт _read_file
+                old, new = dict(rec), dict(new)
+                for r in (old, new):
+                    if not r.get("date") and legacy_date:
+                        r["date"] = legacy_date
+                pairs.append((old, new))
+        if hits:
+            _atomic_write(fp, b"".join(lines))
+    return pairs
+
+
 # ─────────────── запись в указанный JSON-файл ───────────────
 def save_json_named(uid: int, sub: str, name: str, data: Dict[str, Any]) -> Path:
     """Write JSON data to a file with an explicit name."""
-    folder = user_dir(uid) / sub
-    folder.mkdir(exist_ok=True)
+    with _write_lock:
+        before = signature(uid, sub) if _listeners else ()
+        invalidate(uid, sub)
+        db = _sqlite()
+        if db:
+            db.insert(uid, sub, data)     # в базе имя файла не нужно
+            _notify(uid, sub, [data], before)
+            return config.SQLITE_PATH
+
+        folder = user_dir(uid) / sub
+        folder.mkdir(exist_ok=True)
 
-    if not name.endswith(".json"):
-        name += ".json"
+        if not name.endswith(".json"):
+            name += ".json"
 
-    fp = folder / name
-    fp.write_text(json.dumps(data, ensure_ascii=False) + "\n", encoding="utf-8")
+        fp = folder / name
+        existed = fp.exists()
+        _atomic_write(fp, _dump(data))
+        if not existed:                    # перезапись — не дописывание: подписчики
+            _notify(uid, sub, [data], before)   # пересоберут всё по подписи
     return fp
 
 
 # ─────────── чтение всех строк с защитой от «кривых» ───────
-def load_records(uid: int, sub: str) -> List[Dict[str, Any]]:
+def _read_file(fp: Path) -> Iterable[Dict[str, Any]]:
+    legacy_date = None if _is_segment(fp) else _legacy_date(fp)
+    with fp.open("rb") as f:                     # ← бинарный режим
+        for raw in f:
+            try:
+                line = raw.decode("utf-8")       # плохие байты → UnicodeError
+            except UnicodeDecodeError:
+                continue                         # пропускаем старую строку
+            try:
+                j = json.loads(line)
+            except json.JSONDecodeError:
+                continue                         # тоже пропускаем
+            if not isinstance(j, dict) or "enc" in j:
+                continue  # старые зашифрованные записи пропускаем
+            if not j.get("date") and legacy_date:
+                j["date"] = legacy_date          # старые чек-ины без даты
+            yield j
+
+
+def _files(folder: Path, sub: str) -> List[Path]:
+    return sorted(folder.glob(f"{_prefix(sub)}_*"))
+
+
+def _name_range(fp: Path) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
     """
-    Возвращает список словарей. Строки, которые не декодируются как UTF-8
-    или не парсятся в JSON, просто пропускаются, чтобы не ронять бота.
-    Старые зашифрованные записи игнорируются.
+    Границы дат записей файла по его имени (None — граница неизвестна):
+    сегмент <prefix>_YYYYMM.jsonl — ровно этот месяц, <prefix>_YYYYMMDD.json
+    (debug_generator) — ровно этот день, старый <prefix>_YYYYMMDD_HHMMSS.json —
+    не позже дня записи (задним числом пишут только в прошлое).
     """
+    parts = fp.stem.split("_")
+    if len(parts) < 2 or not parts[1].isdigit():
+        return None, None
+    stamp = parts[1]
+    try:
+        if _is_segment(fp) and len(stamp) == 6:
+            y, m = int(stamp[:4]), int(stamp[4:])
+            return datetime.date(y, m, 1), datetime.date(y, m, calendar.monthrange(y, m)[1])
+        day = datetime.datetime.strptime(stamp, "%Y%m%d").date()
+    except ValueError:
+        return None, None
+    return (day if len(parts) == 2 else None), day
+
+
+def load_file_records(uid: int, sub: str) -> List[Dict[str, Any]]:
+    """All records of the files backend, regardless of STORAGE_BACKEND."""
     folder = user_dir(uid) / sub
     if not folder.exists():
         return []
 
     out: List[Dict[str, Any]] = []
+    for fp in _files(folder, sub):
+        out.extend(_read_file(fp))
+    return out
 
-    prefix = sub[:-1] if sub.endswith("s") else sub
-    for fp in sorted(folder.glob(f"{prefix}_*")):
-        with fp.open("rb") as f:                 # ← бинарный режим
-            for raw in f:
-                try:
-                    line = raw.decode("utf-8")   # плохие байты → UnicodeError
-                except UnicodeDecodeError:
-                    continue                     # пропускаем старую строку
-                try:
-                    j = json.loads(line)
-                except json.JSONDecodeError:
-                    continue                     # тоже пропускаем
 
-                if "enc" in j:
-                    continue  # старые зашифрованные записи пропускаем
-                out.append(j)
-    return out
+def _in_range(rec: Dict[str, Any],
+              since: Optional[datetime.date],
+              until: Optional[datetime.date]) -> bool:
+    if since is None and until is None:
+        return True
+    d = parse_date(rec.get("date"))
+    if d is None:
+        return False
+    return (since is None or d >= since) and (until is None or d <= until)
+
+
+# ─────────── LRU-кэш записей по (uid, sub) ──────────────────
+# Запись хранится вместе с «подписью» каталога: mtime самого каталога
+# меняется при добавлении/удалении файлов (debug_generator, ручное
+# копирование), а mtime/размер сегментов — при дописывании в них.
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def signature(uid: int, sub: str) -> tuple:
+    """Cheap fingerprint that changes whenever the records of (uid, sub) change."""
+    db = _sqlite()
+    if db:
+        return db.signature(uid, sub)
+    folder = BASE_DIR / str(uid) / sub
+    try:
+        st = folder.stat()
+    except FileNotFoundError:
+        return ()
+    segments = []
+    with os.scandir(folder) as it:
+        for e in it:
+            if e.name.endswith(SEGMENT_SUFFIX):
+                s = e.stat()
+                segments.append((e.name, s.st_mtime_ns, s.st_size))
+    return (st.st_mtime_ns, tuple(sorted(segments)))
+
+
+def data_signature(uid: int) -> tuple:
+    """Signature of all of a user's records (mood and dreams)."""
+    return signature(uid, "mood"), signature(uid, "dreams")
+
+
+def data_version(uid: int) -> str:
+    """Short hash of data_signature(): changes only when mood/dream records change."""
+    return hashlib.sha1(repr(data_signature(uid)).encode()).hexdigest()[:16]
+
+
+def data_signature_before(uid: int, sub: str, before: tuple) -> tuple:
+    """data_signature() as it was right before a save listener's write to sub."""
+    mood, dreams = data_signature(uid)
+    return (before, dreams) if sub == "mood" else (mood, before)
+
+
+# ─────────── производные данные в data/<uid>/.cache ─────────
+# Графики рисуют отдельные процессы (analysis/render_service.py), поэтому
+# то, что считается из записей (пирамида агрегатов, спектры, корреляции),
+# хранится на диске с версией — её читают и процесс бота, и все рендер-процессы.
+def load_cache(uid: int, name: str, version: Any) -> Optional[Any]:
+    """Value stored by store_cache() under name, or None if absent or of another version."""
+    try:
+        with (user_dir(uid) / ".cache" / f"{name}.pkl").open("rb") as f:
+            stored = pickle.load(f)
+    except Exception:
+        return None                      # нет, битый или от другой версии pandas
+    if not isinstance(stored, dict) or stored.get("version") != version:
+        return None
+    return stored["value"]
+
+
+def store_cache(uid: int, name: str, version: Any, value: Any) -> None:
+    """Persist value under name in the user's .cache directory, tagged with version."""
+    p = user_dir(uid) / ".cache" / f"{name}.pkl"
+    p.parent.mkdir(parents=True, exist_ok=True)      # name может быть «каталог/имя»
+    tmp = p.with_name(f".{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("wb") as f:
+        pickle.dump({"version": version, "value": value}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, p)
+
+
+def invalidate(uid: int, sub: str) -> None:
+    with _cache_lock:
+        _cache.pop((uid, sub), None)
+
+
+def cache_stats() -> Dict[str, int]:
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache))
+
+
+def _cached(uid: int, sub: str) -> List[Dict[str, Any]]:
+    key = (uid, sub)
+    sig = signature(uid, sub)
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == sig:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return hit[1]
+        _cache_stats["misses"] += 1
+
+    db = _sqlite()
+    recs = db.load(uid, sub) if db else load_file_records(uid, sub)
+    with _cache_lock:
+        _cache[key] = (sig, recs)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return recs
+
+
+def _peek(uid: int, sub: str) -> Optional[List[Dict[str, Any]]]:
+    """Записи из кэша, если он актуален, иначе None (без чтения диска)."""
+    key = (uid, sub)
+    sig = signature(uid, sub)
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == sig:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return hit[1]
+    return None
+
+
+def iter_records(uid: int, sub: str,
+                 since: Optional[datetime.date] = None,
+                 until: Optional[datetime.date] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково отдаёт записи за [since, until] (включительно). Файлы, чьи
+    имена показывают, что они вне диапазона, даже не открываются; чтение
+    можно прервать в любой момент. Выборка по диапазону берёт тёплый кэш,
+    но не заполняет его.
+    """
+    db = _sqlite()
+    if db:
+        yield from db.iterate(uid, sub, since, until)
+        return
+    if since is None and until is None:
+        cached = _cached(uid, sub)           # всё равно читаем всё — кладём в кэш
+    else:
+        cached = _peek(uid, sub)
+    if cached is not None:
+        for r in cached:
+            if _in_range(r, since, until):
+                yield dict(r)
+        return
+
+    folder = BASE_DIR / str(uid) / sub
+    if not folder.exists():
+        return
+    for fp in _files(folder, sub):
+        lo, hi = _name_range(fp)
+        if since is not None and hi is not None and hi < since:
+            continue
+        if until is not None and lo is not None and lo > until:
+            continue
+        for r in _read_file(fp):
+            if _in_range(r, since, until):
+                yield r
+
+
+def load_records(uid: int, sub: str,
+                 since: Optional[datetime.date] = None,
+                 until: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+    """
+    Возвращает список словарей. Строки, которые не декодируются как UTF-8
+    или не парсятся в JSON, просто пропускаются, чтобы не ронять бота.
+    Старые зашифрованные записи игнорируются.
+    since/until (включительно) ограничивают выборку по дате записи.
+    Полная история берётся из LRU-кэша; вызывающий получает копии.
+    """
+    if since is not None or until is not None:
+        return list(iter_records(uid, sub, since, until))
+    return [dict(r) for r in _cached(uid, sub)]
+
+
+def find_record(uid: int, sub: str, date_iso: str) -> Optional[Dict[str, Any]]:
+    """Первая запись за указанную дату или None."""
+    db = _sqlite()
+    if db:
+        return db.find(uid, sub, date_iso)
+    d = parse_date(date_iso)
+    if d is None:
+        return None
+    return next((r for r in iter_records(uid, sub, d, d) if r.get("date") == date_iso), None)
+
+
+# ─────────── офлайн-компакция в месячные сегменты ───────────
+def _clean(fp: Path) -> bool:
+    """True, если каждая строка файла — обычная JSON-запись."""
+    try:
+        lines = [l for l in fp.read_bytes().splitlines() if l.strip()]
+        return all(
+            isinstance(j, dict) and "enc" not in j
+            for j in (json.loads(l.decode("utf-8")) for l in lines)
+        )
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return False
+
+
+def compact(uid: int, sub: str) -> int:
+    """
+    Сливает старые файлы-записи в месячные сегменты и переписывает сегменты
+    атомарно (временный файл + os.replace). Файлы с нечитаемыми или
+    зашифрованными строками не трогаются. Запускать при остановленном боте.
+    Возвращает число удалённых старых файлов.
+    """
+    folder = user_dir(uid) / sub
+    if not folder.exists():
+        return 0
+    prefix = _prefix(sub)
+    files = [fp for fp in _files(folder, sub) if _is_segment(fp) or _clean(fp)]
+    legacy = [fp for fp in files if not _is_segment(fp)]
+    if not legacy:
+        return 0
+
+    # старые файлы — раньше сегментов: за один и тот же день они записаны первыми
+    months: Dict[str, List[Tuple[datetime.date, Dict[str, Any]]]] = {}
+    touched = set()
+    for fp in legacy + [fp for fp in files if _is_segment(fp)]:
+        for rec in _read_file(fp):
+            day = parse_date(rec.get("date")) or datetime.date.today()
+            if _is_segment(fp):
+                month = fp.stem.split("_")[-1]   # запись остаётся в своём сегменте
+            else:
+                month = day.strftime("%Y%m")
+                touched.add(month)
+            months.setdefault(month, []).append((day, rec))
+
+    for month in sorted(touched):
+        # устойчивая сортировка по дате: «первая запись за день» остаётся первой
+        recs = [rec for _, rec in sorted(months[month], key=lambda x: x[0])]
+        fp = folder / f"{prefix}_{month}{SEGMENT_SUFFIX}"
+        _atomic_write(fp, "".join(_dump(r) for r in recs))
+    for fp in legacy:
+        fp.unlink()
+    invalidate(uid, sub)
+    return len(legacy)